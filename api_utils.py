@@ -3,14 +3,23 @@
 from datetime import datetime
 from uuid import uuid4
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional, Dict
 import jwt  
+from cryptography.hazmat.primitives import serialization
 import requests 
+from requests.adapters import HTTPAdapter
 from dateutil import parser
 from dotenv import load_dotenv
+from rate_limit import RateLimitedSession
+from log_utils import get_logger
 
 load_dotenv()
 
+logger = get_logger("api_utils")
+
 # Read environment variables
 private_key = os.getenv('RKS_PRIVATE_KEY')
 service_account_name = os.getenv('RKS_SERVICE_ACCOUNT')
@@ -18,8 +27,64 @@ project_id = os.getenv('RKS_PROJECT_ID')
 base_url = os.getenv('BASE_URL')
 token_url = f'{base_url}/identityserver/connect/token'
 
+# Max number of keep-alive connections held open per host.
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE) -> requests.Session:
+    # Rate limited per endpoint, with 429/5xx backoff; see rate_limit.
+    session = RateLimitedSession()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Created once per container so warm Lambda invocations reuse open connections.
+# Every call to the MyDataHelps API should go through this session.
+http_session = create_session()
+
+def get_rate_limit_stats() -> dict:
+    return http_session.get_stats()
+
+
+# Cached tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '60'))
+
+# Kept at module scope so warm invocations skip the PEM parse and token round-trip.
+_signing_key = None
+_service_token = {"access_token": None, "expires_at": 0.0}
+_service_token_lock = threading.Lock()
+
+
+def _get_signing_key():
+    global _signing_key
+    if _signing_key is None:
+        _signing_key = serialization.load_pem_private_key(private_key.encode(), password=None)
+    return _signing_key
 
-def get_service_access_token() -> str:
+
+def get_service_access_token(force_refresh: bool = False) -> str:
+    """
+    Returns a service access token, reusing the cached one until it is
+    within TOKEN_REFRESH_MARGIN seconds of its expiry.
+    """
+    with _service_token_lock:
+        if (
+            not force_refresh
+            and _service_token["access_token"]
+            and time.time() < _service_token["expires_at"] - TOKEN_REFRESH_MARGIN
+        ):
+            return _service_token["access_token"]
+
+        requested_at = time.time()
+        token = _request_service_access_token()
+        _service_token["access_token"] = token["access_token"]
+        _service_token["expires_at"] = requested_at + float(token.get("expires_in", 0))
+        return _service_token["access_token"]
+
+
+def _request_service_access_token() -> dict:
     assertion = {
         "iss": service_account_name,
         "sub": service_account_name,
@@ -27,16 +92,16 @@ def get_service_access_token() -> str:
         "exp": datetime.now().timestamp() + 200,
         "jti": str(uuid4()),
     }
-    signed_assertion = jwt.encode(payload=assertion, key=private_key, algorithm="RS256")
+    signed_assertion = jwt.encode(payload=assertion, key=_get_signing_key(), algorithm="RS256")
     token_payload = {
         "scope": "api",
         "grant_type": "client_credentials",
         "client_assertion_type": "urn:ietf:params:oauth:client-assertion-type:jwt-bearer",
         "client_assertion": signed_assertion
     }
-    response = requests.post(url=token_url, data=token_payload)
+    response = http_session.post(url=token_url, data=token_payload)
     response.raise_for_status()
-    return response.json()["access_token"]
+    return response.json()
 
 
 def get_from_api(
@@ -55,7 +120,7 @@ def get_from_api(
     }
 
     url = f'{base_url}/{resource_url}'
-    response = requests.get(url=url, params=query_params, headers=headers)
+    response = http_session.get(url=url, params=query_params, headers=headers)
 
     if raise_error:
         response.raise_for_status()
@@ -63,11 +128,85 @@ def get_from_api(
     return response
 
 
+def iter_api_pages(
+    service_access_token: str,
+    url: str,
+    query_params: Dict[str, str],
+    items_key: str
+):
+    """
+    Yields the items of each page of a MyDataHelps query, following
+    nextPageID until the last page.
+    """
+    params = dict(query_params)
+    headers = {
+        "Authorization": f"Bearer {service_access_token}",
+        "Accept": "application/json"
+    }
+
+    while True:
+        response = http_session.get(url, headers=headers, params=params)
+        response.raise_for_status()
+        data = response.json()
+        yield data.get(items_key, [])
+
+        next_page_id = data.get("nextPageID")
+        if not next_page_id:
+            break
+        params["pageID"] = next_page_id
+
+
+# Max number of delegated participant tokens kept in memory.
+PARTICIPANT_TOKEN_CACHE_SIZE = int(os.getenv('PARTICIPANT_TOKEN_CACHE_SIZE', '1024'))
+
+# LRU of (participant_id, scopes) -> (access_token, expires_at), oldest first.
+_participant_tokens = OrderedDict()
+_participant_token_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_participant_token_lock = threading.Lock()
+
+
 def get_participant_access_token(
     service_access_token: str,
     participant_id: str,
     scopes: str
 ) -> str:
+    """
+    Returns a delegated participant token, served from an LRU cache keyed by
+    (participant_id, scopes) while the token is not about to expire.
+    """
+    cache_key = (participant_id, scopes)
+    with _participant_token_lock:
+        cached = _participant_tokens.get(cache_key)
+        if cached and time.time() < cached[1] - TOKEN_REFRESH_MARGIN:
+            _participant_tokens.move_to_end(cache_key)
+            _participant_token_stats["hits"] += 1
+            return cached[0]
+        _participant_token_stats["misses"] += 1
+
+    requested_at = time.time()
+    token = _request_participant_access_token(service_access_token, participant_id, scopes)
+    expires_at = requested_at + float(token.get("expires_in", 0))
+
+    with _participant_token_lock:
+        _participant_tokens[cache_key] = (token["access_token"], expires_at)
+        _participant_tokens.move_to_end(cache_key)
+        while len(_participant_tokens) > PARTICIPANT_TOKEN_CACHE_SIZE:
+            _participant_tokens.popitem(last=False)
+            _participant_token_stats["evictions"] += 1
+
+    return token["access_token"]
+
+
+def get_participant_token_cache_stats() -> Dict[str, int]:
+    with _participant_token_lock:
+        return dict(_participant_token_stats, size=len(_participant_tokens))
+
+
+def _request_participant_access_token(
+    service_access_token: str,
+    participant_id: str,
+    scopes: str
+) -> dict:
     token_payload = {
         "scope": scopes,
         "grant_type": "delegated_participant",
@@ -76,16 +215,16 @@ def get_participant_access_token(
         "client_secret": "secret",
         "token": service_access_token,
     }
-    response = requests.post(url=token_url, data=token_payload)
+    response = http_session.post(url=token_url, data=token_payload)
     response.raise_for_status()
-    return response.json()["access_token"]
+    return response.json()
 
 
 def safe_parse_iso(s):
     try:
         return parser.isoparse(s)
     except Exception as e:
-        print(f"Skipping invalid timestamp: {s} – {e}")
+        logger.debug("Skipping invalid timestamp", extra={"timestamp": s, "error": str(e)})
         return None
 
 
@@ -96,12 +235,12 @@ def get_all_participants(project_id, access_token):
     Returns:
         list of participant objects.
     """
-    url = f"https://mydatahelps.org/api/v1/administration/projects/{project_id}/participants"
+    url = f"{base_url}/api/v1/administration/projects/{project_id}/participants"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_session.get(url, headers=headers)
     if response.status_code != 200:
         raise RuntimeError(f"Failed to fetch participants: {response.status_code} - {response.text}")
 
@@ -109,12 +248,12 @@ def get_all_participants(project_id, access_token):
 
 def get_surveys(project_id, access_token, participant_id):
 
-    url = f"https://mydatahelps.org/api/v1/administration/projects/{project_id}/participants/{participant_id}/surveyevents"
+    url = f"{base_url}/api/v1/administration/projects/{project_id}/participants/{participant_id}/surveyevents"
     headers = {
         "Authorization": f"Bearer {access_token}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = http_session.get(url, headers=headers)
     if response.status_code != 200:
         raise RuntimeError(f"Failed to fetch surveys for {participant_id}: {response.status_code} - {response.text}")
 
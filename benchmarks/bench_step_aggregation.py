@@ -0,0 +1,99 @@
+"""
+Microbenchmark: step aggregation before and after the columnar engine.
+
+    python benchmarks/bench_step_aggregation.py [--points 10000 100000]
+
+Runs on synthetic Steps payloads spread over two days and several sources
+and checks that both implementations return the same totals.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitbit  # noqa: E402
+import step_columns  # noqa: E402
+from api_utils import safe_parse_iso  # noqa: E402
+
+
+def reference_aggregate_steps_by_source(data_points):
+    """The per-point implementation the providers used before step_columns."""
+    step_totals = defaultdict(int)
+    today = datetime.now(timezone.utc).date()
+
+    for dp in data_points:
+        if dp.get("type") != "Steps":
+            continue
+
+        try:
+            start_date = safe_parse_iso(dp["startDate"])
+            if not start_date:
+                continue
+        except Exception as e:
+            print(f"Skipping invalid timestamp: {dp['startDate']} – {e}")
+            continue
+
+        if start_date.date() != today:
+            continue
+
+        try:
+            source_name = dp["source"]["properties"].get("SourceName", "Unknown Source")
+            step_value = int(float(dp["value"]))
+            step_totals[source_name] += step_value
+        except Exception as e:
+            print(f"Error parsing entry: {e}")
+
+    return dict(step_totals)
+
+
+def make_points(n, seed=0):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    sources = ["Watch", "Phone", "Fitbit Charge", "Ring"]
+    points = []
+    for i in range(n):
+        start = now - timedelta(seconds=rng.randrange(0, 36 * 3600))
+        points.append({
+            "id": str(i),
+            "type": "Steps",
+            "startDate": start.isoformat().replace("+00:00", "Z"),
+            "observationDate": start.isoformat().replace("+00:00", "Z"),
+            "value": str(rng.randrange(0, 200)),
+            "source": {"properties": {"SourceName": rng.choice(sources)}}
+        })
+    return points
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--points", type=int, nargs="+", default=[10000, 100000])
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print(f"NumPy {step_columns.np.__version__}, from {step_columns.NUMPY_MIN_POINTS} points")
+    print(f"{'points':>8} {'reference (s)':>14} {'columnar (s)':>13} {'speedup':>8}")
+    for n in args.points:
+        points = make_points(n)
+        reference_time, reference = best_of(lambda: reference_aggregate_steps_by_source(points), args.repeat)
+        columnar_time, columnar = best_of(lambda: fitbit.aggregate_steps_by_source(points), args.repeat)
+        assert reference == columnar, (reference, columnar)
+        print(f"{n:>8} {reference_time:>14.3f} {columnar_time:>13.3f} {reference_time / columnar_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
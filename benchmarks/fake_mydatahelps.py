@@ -0,0 +1,349 @@
+"""
+Local stand-in for the MyDataHelps REST API, for the benchmarks.
+
+Serves the token endpoint, participants (segment pages, single reads and
+updates), devicedatapoints (v1 and v2, per participant or bulk),
+surveytasks and notifications, with a configurable latency per request and
+configurable payload sizes. The server runs in its own process, so its work
+doesn't compete with the code being measured. Request counts per route are
+available through FakeMyDataHelps.stats().
+"""
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.request
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from participant_generator import generate_participants
+
+PLATFORM_NAMESPACES = {
+    "iOS": ["AppleHealth"],
+    "Android": ["GoogleFit", "HealthConnect"],
+    "Fitbit": ["Fitbit"],
+}
+SLEEP_TYPES = {
+    "AppleHealth": "Sleep Analysis",
+    "Fitbit": "SleepLevelLight",
+    "GoogleFit": "SleepSegment",
+    "HealthConnect": "SleepSession",
+}
+SURVEY_NAMES = ("log_breakfast_en", "log_lunch_en", "log_dinner_en")
+POINT_VARIANTS = 16
+PID_PLACEHOLDER = "__PID__"
+
+_API_PATH = re.compile(r"^/api/(v1|v2)/administration/projects/[^/]+/(\w+)(?:/([^/]+))?(?:/(\w+))?$")
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+        self.configure({})
+
+    def configure(self, config):
+        self.latency = float(config.get("latency", 0.0))
+        self.points_per_participant = int(config.get("points_per_participant", 200))
+        self.points_page_size = int(config.get("points_page_size", 1000))
+        self.tasks_page_size = int(config.get("tasks_page_size", 200))
+        self.completion_rate = float(config.get("completion_rate", 0.3))
+        self.seed = int(config.get("seed", 0))
+        self.now = datetime.now(timezone.utc)
+
+        segment_ids = config.get("segment_ids", {})
+        by_platform = generate_participants(
+            int(config.get("participants", 0)), self.seed, float(config.get("active_fraction", 0.3)), self.now
+        )
+        self.segments = {segment_ids.get(platform, platform): ps for platform, ps in by_platform.items()}
+        self.roster = [p for ps in by_platform.values() for p in ps]
+        self.participants = {}
+        for platform, ps in by_platform.items():
+            for p in ps:
+                self.participants[p["participantIdentifier"]] = (platform, p)
+        self.tasks = self._generate_tasks()
+        # Full result lists of recent queries, so paging through one query
+        # doesn't regenerate its points for every page.
+        self.query_cache = OrderedDict()
+        self.point_templates = {}
+
+    def count(self, route):
+        with self.lock:
+            self.counts[route] += 1
+
+    def _generate_tasks(self):
+        rng = random.Random(self.seed + 1)
+        today = self.now.replace(hour=0, minute=0, second=0, microsecond=0)
+        tasks = []
+        for pid in self.participants:
+            for survey_name in SURVEY_NAMES:
+                complete = rng.random() < self.completion_rate
+                inserted = today + timedelta(seconds=rng.randrange(0, max(1, int((self.now - today).total_seconds()))))
+                task = {
+                    "participantIdentifier": pid,
+                    "surveyName": survey_name,
+                    "status": "complete" if complete else "incomplete",
+                    "insertedDate": _iso(inserted),
+                }
+                if complete:
+                    task["endDate"] = _iso(min(self.now, inserted + timedelta(minutes=10)))
+                tasks.append(task)
+        return tasks
+
+    def cached_query(self, key, compute):
+        with self.lock:
+            if key in self.query_cache:
+                self.query_cache.move_to_end(key)
+                return self.query_cache[key]
+        result = compute()
+        with self.lock:
+            self.query_cache[key] = result
+            while len(self.query_cache) > 64:
+                self.query_cache.popitem(last=False)
+        return result
+
+    def get_point_templates(self, namespace, variant):
+        """
+        One of POINT_VARIANTS pre-encoded point sets per namespace, as
+        (observationDate, type, JSON with a participant placeholder) sorted by
+        date. Participants share these, which keeps the server cheap enough
+        not to dominate the measurements.
+        """
+        key = (namespace, variant)
+        with self.lock:
+            templates = self.point_templates.get(key)
+        if templates is not None:
+            return templates
+
+        rng = random.Random(f"{self.seed}:{namespace}:{variant}")
+        sources = ["Watch", "Phone"]
+        templates = []
+        for j in range(self.points_per_participant):
+            observed = _iso(self.now - timedelta(seconds=rng.randrange(0, 20 * 3600)))
+            roll = rng.random()
+            point = {
+                "id": f"{PID_PLACEHOLDER}-{namespace}-{j}",
+                "participantIdentifier": PID_PLACEHOLDER,
+                "namespace": namespace,
+                "startDate": observed,
+                "observationDate": observed,
+                "source": {"properties": {"SourceName": rng.choice(sources)}},
+            }
+            if roll < 0.8:
+                point.update(type="Steps", value=str(rng.randrange(0, 300)))
+            elif roll < 0.9:
+                point.update(type=SLEEP_TYPES[namespace], value="asleep", duration=rng.randrange(60, 3600) * 1000)
+            else:
+                point.update(type="HeartRate", value=str(rng.randrange(50, 120)))
+            templates.append((observed, point["type"], json.dumps(point)))
+        templates.sort()
+
+        with self.lock:
+            self.point_templates[key] = templates
+        return templates
+
+    def get_points(self, pid, namespace, point_type=None, observed_after=""):
+        """Returns the participant's matching points as JSON strings."""
+        entry = self.participants.get(pid)
+        if entry is None or namespace not in PLATFORM_NAMESPACES[entry[0]]:
+            return []
+        templates = self.get_point_templates(namespace, zlib.crc32(pid.encode()) % POINT_VARIANTS)
+        return [
+            encoded.replace(PID_PLACEHOLDER, pid)
+            for observed, dp_type, encoded in templates
+            if observed > observed_after and (point_type is None or dp_type == point_type)
+        ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs
+    # add ~40ms to every keep-alive request.
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None):
+        self._send_raw(status, json.dumps(body if body is not None else {}).encode())
+
+    def _send_raw(self, status, data):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _route(self, method):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        body = self._read_body()
+        state = self.state
+
+        if parts.path == "/_stats":
+            with state.lock:
+                return self._send(200, dict(state.counts))
+        if parts.path == "/_reset":
+            with state.lock:
+                state.counts.clear()
+            return self._send(200)
+        if parts.path == "/_setup":
+            state.configure(json.loads(body or b"{}"))
+            return self._send(200, {"participants": len(state.participants)})
+
+        if state.latency:
+            time.sleep(state.latency)
+
+        if parts.path.endswith("/connect/token"):
+            state.count(f"{method} token")
+            return self._send(200, {"access_token": "bench-token", "expires_in": 3600, "token_type": "Bearer"})
+
+        match = _API_PATH.match(parts.path)
+        if not match:
+            state.count(f"{method} unknown")
+            return self._send(404)
+        version, resource, item, sub = match.groups()
+        route = f"{method} {resource}" + ("/{id}" if item else "") + (f"/{sub}" if sub else "")
+        state.count(route)
+
+        if resource == "participants":
+            return self._participants(method, query, item)
+        if resource == "devicedatapoints" and method == "GET":
+            return self._devicedatapoints(query)
+        if resource == "surveytasks" and method == "GET":
+            return self._surveytasks(query)
+        if resource == "notifications" and method == "POST":
+            records = json.loads(body or b"[]")
+            return self._send(200, [{"participantIdentifier": r.get("participantIdentifier"), "success": True} for r in records])
+        return self._send(404)
+
+    def _participants(self, method, query, item):
+        state = self.state
+        if method == "PUT":
+            return self._send(200)
+        if item:
+            entry = state.participants.get(item)
+            return self._send(200, entry[1]) if entry else self._send(404)
+
+        segment_id = query.get("segmentId", [None])[0]
+        roster = state.roster if segment_id is None else state.segments.get(segment_id, [])
+        page_size = int(query.get("pageSize", ["100"])[0])
+        page = int(query.get("pageNumber", ["0"])[0])
+        return self._send(200, {
+            "participants": roster[page * page_size:(page + 1) * page_size],
+            "totalParticipants": len(roster),
+        })
+
+    def _devicedatapoints(self, query):
+        state = self.state
+        namespace = query.get("namespace", [""])[0]
+        pids = query.get("participantIdentifier") or [
+            pid for pid, (platform, _) in state.participants.items() if namespace in PLATFORM_NAMESPACES[platform]
+        ]
+        point_type = query.get("type", [None])[0]
+        observed_after = query.get("observedAfter", [""])[0]
+
+        def compute():
+            return [
+                encoded for pid in pids
+                for encoded in state.get_points(pid, namespace, point_type, observed_after)
+            ]
+
+        points = state.cached_query((namespace, tuple(pids), point_type, observed_after), compute)
+        offset = int(query.get("pageID", ["0"])[0])
+        page_size = state.points_page_size
+        body = '{"deviceDataPoints": [' + ", ".join(points[offset:offset + page_size]) + "]"
+        if offset + page_size < len(points):
+            body += f', "nextPageID": "{offset + page_size}"'
+        return self._send_raw(200, (body + "}").encode())
+
+    def _surveytasks(self, query):
+        state = self.state
+        names = set(query.get("surveyName", SURVEY_NAMES))
+        status = query.get("status", [None])[0]
+        pid = query.get("participantIdentifier", [None])[0]
+        tasks = [
+            t for t in state.tasks
+            if t["surveyName"] in names
+            and (status is None or t["status"] == status)
+            and (pid is None or t["participantIdentifier"] == pid)
+        ]
+        page_size = int(query.get("pageSize", [str(state.tasks_page_size)])[0])
+        return self._send(200, self._page(tasks, query, page_size, "surveyTasks"))
+
+    @staticmethod
+    def _page(items, query, page_size, items_key):
+        offset = int(query.get("pageID", ["0"])[0])
+        page = {items_key: items[offset:offset + page_size]}
+        if offset + page_size < len(items):
+            page["nextPageID"] = str(offset + page_size)
+        return page
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+
+def _serve(host, port_queue):
+    Handler.state = FakeState()
+    server = ThreadingHTTPServer((host, 0), Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class FakeMyDataHelps:
+    """Starts the fake API in a child process; url is its base URL."""
+
+    def __init__(self, host="127.0.0.1"):
+        self.host = host
+        self.process = None
+        self.url = None
+
+    def start(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve, args=(self.host, port_queue), daemon=True)
+        self.process.start()
+        self.url = f"http://{self.host}:{port_queue.get(timeout=10)}"
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+    def _admin(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        request = urllib.request.Request(self.url + path, data=data, method="POST" if payload is not None or path != "/_stats" else "GET")
+        with urllib.request.urlopen(request, timeout=600) as response:
+            return json.loads(response.read() or b"{}")
+
+    def setup(self, **config):
+        """Regenerates the fake project; see FakeState.configure for the options."""
+        return self._admin("/_setup", config)
+
+    def stats(self):
+        return self._admin("/_stats")
+
+    def reset_stats(self):
+        return self._admin("/_reset", {})
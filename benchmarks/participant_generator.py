@@ -0,0 +1,63 @@
+"""
+Synthetic MyDataHelps participants for the benchmarks.
+
+Participants get a random timezone, weekday and weekend meal times and a
+platform segment. A share of them (active_fraction) has a meal window open
+at generation time, so a scheduler run has decision points to act on.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+TIMEZONES = [
+    "Europe/Zurich", "Europe/Berlin", "Europe/London", "Europe/Lisbon",
+    "America/New_York", "America/Chicago", "America/Los_Angeles",
+    "Asia/Tokyo", "Asia/Kolkata", "Australia/Sydney", "UTC",
+]
+MEALS = ("breakfast", "lunch", "dinner")
+MEAL_HOURS = {"breakfast": (6, 10), "lunch": (11, 14), "dinner": (17, 21)}
+PLATFORM_WEIGHTS = {"iOS": 0.5, "Android": 0.3, "Fitbit": 0.2}
+
+
+def format_mealtime(hour, minute):
+    return datetime(2000, 1, 1, hour, minute).strftime("%I:%M %p")
+
+
+def generate_participant(i, rng, active, now):
+    tz_name = rng.choice(TIMEZONES)
+    custom_fields = {}
+    for prefix in ("mealtime_mon_", "mealtime_we_"):
+        for meal in MEALS:
+            low, high = MEAL_HOURS[meal]
+            custom_fields[prefix + meal] = format_mealtime(rng.randrange(low, high), rng.choice((0, 15, 30, 45)))
+
+    if active:
+        # Open one of today's windows: it started up to 90 minutes ago.
+        local_now = now.astimezone(pytz.timezone(tz_name))
+        start = local_now - timedelta(minutes=rng.randrange(0, 90))
+        if start.date() == local_now.date():
+            prefix = "mealtime_mon_" if local_now.weekday() < 5 else "mealtime_we_"
+            custom_fields[prefix + rng.choice(MEALS)] = format_mealtime(start.hour, start.minute)
+
+    custom_fields["TrackingCount"] = str(rng.randrange(0, 10))
+    custom_fields["SurveysDelivered"] = str(rng.randrange(1, 12))
+    return {
+        "participantIdentifier": f"bench-{i:06d}",
+        "demographics": {"timeZone": tz_name},
+        "customFields": custom_fields,
+    }
+
+
+def generate_participants(n, seed=0, active_fraction=0.3, now=None):
+    """Returns {platform: [participant, ...]} with n participants in total."""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    platforms = list(PLATFORM_WEIGHTS)
+    weights = [PLATFORM_WEIGHTS[p] for p in platforms]
+
+    by_platform = {platform: [] for platform in platforms}
+    for i in range(n):
+        platform = rng.choices(platforms, weights)[0]
+        by_platform[platform].append(generate_participant(i, rng, rng.random() < active_fraction, now))
+    return by_platform
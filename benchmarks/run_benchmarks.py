@@ -0,0 +1,216 @@
+"""
+End-to-end benchmark of the scheduler and notifier handlers.
+
+    python benchmarks/run_benchmarks.py [--participants 100 1000 10000]
+
+Runs jitai_logic.lambda_handler and notifier_logic.lambda_handler against
+a local fake MyDataHelps API (fake_mydatahelps) and an in-memory log store
+(storage.MemoryStorage) with synthetic participants. For each phase it
+reports wall time, API requests, log storage operations and peak traced
+memory. tracemalloc slows the handlers down several times, so peak memory
+comes from a second, traced run of the same phases.
+
+Phases:
+  scheduler (cold)   first tick: rosters, contexts, tracking, scheduling
+  scheduler (warm)   second tick in the same process (warm caches)
+  notifier           every scheduled entry made due and sent
+  notifier (idle)    a pass with nothing due
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(1, os.path.dirname(BENCH_DIR))
+
+from fake_mydatahelps import FakeMyDataHelps  # noqa: E402
+
+
+def generate_private_key():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+
+
+def configure_environment(base_url, args):
+    """Points the repo modules at the fakes. Must run before they are imported."""
+    os.environ.update({
+        "BASE_URL": base_url,
+        "RKS_PROJECT_ID": "bench-project",
+        "RKS_SERVICE_ACCOUNT": "bench-service-account",
+        "RKS_PRIVATE_KEY": generate_private_key(),
+        "LOG_STORAGE_BACKEND": "memory",
+        "API_RATE_PER_SECOND": str(args.rate),
+        "DEVICE_DATA_FETCH_MODE": args.fetch_mode,
+        "DEVICE_DATA_SYNC_MODE": args.sync_mode,
+    })
+
+
+def make_counting_storage():
+    from storage import MemoryStorage
+
+    class CountingStorage(MemoryStorage):
+        """MemoryStorage that counts operations, as a stand-in for S3."""
+
+        def __init__(self):
+            super().__init__()
+            self.counts = Counter()
+
+        def get(self, key, immutable=False):
+            self.counts["get"] += 1
+            return super().get(key, immutable)
+
+        def put(self, key, body, if_match=None, if_none_match=False):
+            self.counts["put"] += 1
+            self.counts["put_bytes"] += len(body)
+            return super().put(key, body, if_match, if_none_match)
+
+        def list_keys(self, prefix):
+            self.counts["list"] += 1
+            return super().list_keys(prefix)
+
+    return CountingStorage()
+
+
+def reset_process_state(bucket):
+    """Drops the caches kept across warm invocations, as on a cold start."""
+    import jitai_logic
+    import jitai_utils
+    import storage
+
+    jitai_utils.clear_roster_cache()
+    jitai_logic.DECISION_CALENDARS.clear()
+    counting_storage = make_counting_storage()
+    storage.set_storage(bucket, counting_storage)
+    return counting_storage
+
+
+def make_all_scheduled_due(bucket):
+    """Moves every scheduled send into the past and rebuilds the index."""
+    from s3_utils import RunState
+    from schedule_index import SCHEDULE_INDEX_LOG, build_schedule_index
+
+    state = RunState(bucket)
+    scheduled_log = state.get("scheduled_log.json")
+    due = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat().replace("+00:00", "Z")
+    for key, record in list(scheduled_log.items()):
+        if isinstance(record, dict):
+            state.set("scheduled_log.json", key, dict(record, send_time=due))
+    for bucket_key in list(state.get(SCHEDULE_INDEX_LOG)):
+        state.set(SCHEDULE_INDEX_LOG, bucket_key, {})
+    for bucket_key, entries in build_schedule_index(scheduled_log).items():
+        state.set(SCHEDULE_INDEX_LOG, bucket_key, entries)
+    state.save()
+    return len(scheduled_log)
+
+
+class PhaseRecorder:
+    def __init__(self, server, counting_storage, trace_memory, verbose):
+        self.server = server
+        self.storage = counting_storage
+        self.trace_memory = trace_memory
+        self.verbose = verbose
+        self.rows = []
+
+    def run(self, name, fn):
+        self.server.reset_stats()
+        storage_before = Counter(self.storage.counts)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else output):
+            fn()
+        wall = time.perf_counter() - start
+
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        requests = self.server.stats()
+        storage_ops = Counter(self.storage.counts)
+        storage_ops.subtract(storage_before)
+        self.rows.append((name, wall, requests, dict(storage_ops), peak))
+
+
+def report(participants, rows, memory_rows=None):
+    peaks = {row[0]: row[4] for row in memory_rows or []}
+    print(f"\n== {participants} participants")
+    print(f"{'phase':<18} {'wall (s)':>9} {'requests':>9} {'s3 get':>7} {'s3 put':>7} {'peak MB':>8}  requests by route")
+    for name, wall, requests, storage_ops, _ in rows:
+        peak = peaks.get(name)
+        by_route = ", ".join(f"{route}={count}" for route, count in sorted(requests.items()))
+        peak_str = f"{peak / 2**20:8.1f}" if peak is not None else f"{'-':>8}"
+        print(
+            f"{name:<18} {wall:9.3f} {sum(requests.values()):9d} "
+            f"{storage_ops.get('get', 0):7d} {storage_ops.get('put', 0):7d} {peak_str}  {by_route}"
+        )
+
+
+def run_size(server, participants, args, trace_memory=False):
+    import jitai_logic
+    import notifier_logic
+
+    server.setup(
+        participants=participants,
+        seed=args.seed,
+        active_fraction=args.active_fraction,
+        latency=args.latency,
+        points_per_participant=args.points,
+        points_page_size=args.page_size,
+        segment_ids=jitai_logic.SEGMENT_IDS,
+    )
+    counting_storage = reset_process_state(notifier_logic.BUCKET)
+    recorder = PhaseRecorder(server, counting_storage, trace_memory, args.verbose)
+
+    recorder.run("scheduler (cold)", lambda: jitai_logic.lambda_handler(None, None))
+    recorder.run("scheduler (warm)", lambda: jitai_logic.lambda_handler(None, None))
+    make_all_scheduled_due(notifier_logic.BUCKET)
+    recorder.run("notifier", lambda: notifier_logic.lambda_handler(None, None))
+    recorder.run("notifier (idle)", lambda: notifier_logic.lambda_handler(None, None))
+    return recorder.rows
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--participants", type=int, nargs="+", default=[100, 1000])
+    arg_parser.add_argument("--latency", type=float, default=0.01, help="fake API latency per request (s)")
+    arg_parser.add_argument("--points", type=int, default=200, help="device data points per participant and namespace")
+    arg_parser.add_argument("--page-size", type=int, default=1000, help="devicedatapoints page size")
+    arg_parser.add_argument("--active-fraction", type=float, default=0.3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--rate", type=float, default=0, help="API_RATE_PER_SECOND; 0 disables rate limiting")
+    arg_parser.add_argument("--fetch-mode", choices=["participant", "bulk"], default="participant")
+    arg_parser.add_argument("--sync-mode", choices=["full", "incremental"], default="full")
+    arg_parser.add_argument("--no-memory", action="store_true", help="skip the traced run (no peak memory)")
+    arg_parser.add_argument("--verbose", action="store_true", help="show the handlers' output")
+    args = arg_parser.parse_args()
+
+    server = FakeMyDataHelps().start()
+    try:
+        configure_environment(server.url, args)
+        for participants in args.participants:
+            rows = run_size(server, participants, args)
+            memory_rows = None
+            if not args.no_memory:
+                tracemalloc.start()
+                memory_rows = run_size(server, participants, args, trace_memory=True)
+                tracemalloc.stop()
+            report(participants, rows, memory_rows)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+import pytz
+from jitai_utils import MEAL_WINDOW_SECONDS, get_timezone, parse_mealtime_seconds
+
+
+def get_calendar_signature(p):
+    """Everything a participant's decision points depend on."""
+    custom_fields = p.get("customFields", {})
+    return (
+        p.get("demographics", {}).get("timeZone", "UTC"),
+        tuple((key, value) for key, value in custom_fields.items() if key.startswith("mealtime_"))
+    )
+
+
+def compute_participant_intervals(p, utc_day):
+    """
+    Returns the participant's meal windows around utc_day as
+    (start epoch, end epoch, field position, field key) tuples in UTC.
+
+    Windows follow get_active_meal_window_participants: weekday fields on
+    Mon-Fri and weekend fields on Sat/Sun in the participant's local time,
+    lasting MEAL_WINDOW_SECONDS and not running past local midnight. Both
+    ends are local wall-clock times, as in the wall-clock check, so a window
+    spanning a DST change lasts an hour less or more in real time.
+    """
+    tz_name = p.get("demographics", {}).get("timeZone", "UTC")
+    tz = get_timezone(tz_name) or pytz.UTC
+    custom_fields = p.get("customFields", {})
+
+    intervals = []
+    # Local dates that can overlap the UTC day in any timezone.
+    for offset in (-1, 0, 1):
+        local_date = utc_day + timedelta(days=offset)
+        prefix = "mealtime_mon_" if local_date.weekday() < 5 else "mealtime_we_"
+        midnight = datetime.combine(local_date, datetime.min.time())
+
+        for position, (key, value) in enumerate(custom_fields.items()):
+            if not key.startswith(prefix) or not value:
+                continue
+            start_seconds = parse_mealtime_seconds(value)
+            if start_seconds is None:
+                continue
+            end_seconds = min(start_seconds + MEAL_WINDOW_SECONDS, 24 * 60 * 60 - 1e-6)
+            start = tz.localize(midnight + timedelta(seconds=start_seconds)).timestamp()
+            end = tz.localize(midnight + timedelta(seconds=end_seconds)).timestamp()
+            intervals.append((start, end, position, key))
+
+    return intervals
+
+
+class DecisionCalendar:
+    """
+    A roster's decision-point windows for one UTC day, in UTC, sorted by start.
+
+    refresh() rebuilds everything when the day changes and recomputes only the
+    participants whose timezone or meal-time fields changed. The windows
+    containing 'now' are found by bisecting to the starts in
+    [now - longest window, now], which is O(log n + k). A window lasts at
+    most MEAL_WINDOW_SECONDS plus a DST shift, so that range stays short.
+    """
+
+    def __init__(self):
+        self.day = None
+        self.signatures = {}
+        self.participant_intervals = {}
+        self.order = {}
+        self.participants = {}
+        self.roster = None
+        self.starts = []
+        self.intervals = []
+        self.longest = 0.0
+
+    def refresh(self, participants, now=None):
+        if now is None:
+            now = datetime.now(timezone.utc)
+        day = now.astimezone(timezone.utc).date()
+        if participants is self.roster and day == self.day:
+            # Same roster object as last tick (e.g. from the roster cache).
+            return
+        self.roster = participants
+        if day != self.day:
+            self.day = day
+            self.signatures = {}
+            self.participant_intervals = {}
+
+        changed = False
+        order = {}
+        self.participants = {}
+        for position, p in enumerate(participants):
+            pid = p["participantIdentifier"]
+            order[pid] = position
+            self.participants[pid] = p
+            signature = get_calendar_signature(p)
+            if self.signatures.get(pid) != signature:
+                self.signatures[pid] = signature
+                self.participant_intervals[pid] = compute_participant_intervals(p, day)
+                changed = True
+
+        for pid in [pid for pid in self.participant_intervals if pid not in order]:
+            del self.participant_intervals[pid]
+            del self.signatures[pid]
+            changed = True
+
+        self.order = order
+        if changed or not self.starts and self.participant_intervals:
+            self.intervals = sorted(
+                (start, end, pid, position, key)
+                for pid, intervals in self.participant_intervals.items()
+                for start, end, position, key in intervals
+            )
+            self.starts = [interval[0] for interval in self.intervals]
+            self.longest = max((end - start for start, end, *_ in self.intervals), default=0.0)
+
+    def get_active_mealtimes(self, now=None):
+        """Returns {participant ID: [active mealtime field keys in field order]}."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        now_epoch = now.timestamp()
+
+        lo = bisect_left(self.starts, now_epoch - self.longest)
+        hi = bisect_right(self.starts, now_epoch)
+        active = {}
+        for start, end, pid, position, key in self.intervals[lo:hi]:
+            if start <= now_epoch <= end:
+                active.setdefault(pid, []).append((position, key))
+        return {pid: [key for _, key in sorted(hits)] for pid, hits in active.items()}
+
+    def get_active_participants(self, now=None):
+        """
+        Same result as jitai_utils.get_active_meal_window_participants for the
+        roster last passed to refresh(), in roster order.
+        """
+        active = self.get_active_mealtimes(now)
+        active_participants = []
+        for pid in sorted(active, key=self.order.get):
+            p = self.participants[pid]
+            p["active_mealtimes"] = active[pid]
+            active_participants.append(p)
+        return active_participants
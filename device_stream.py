@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timezone
+from step_columns import StepColumns
+
+# Fields kept from each sleep point; the rest of the payload is dropped as
+# soon as the point has been read.
+SLEEP_FIELDS = ("id", "type", "startDate", "observationDate", "value", "duration")
+# Steps points are buffered in columns and summed in batches of this size.
+STEP_BATCH_SIZE = int(os.getenv("STEP_BATCH_SIZE", "1000"))
+
+
+class DeviceDataAggregator:
+    """
+    Folds a provider's data points into today's step totals by source and
+    the trimmed sleep points, one point at a time. Steps are buffered as
+    compact columns and summed every STEP_BATCH_SIZE points, so memory does
+    not grow with the number of step samples.
+    """
+
+    def __init__(self, provider, today=None):
+        self.provider = provider
+        self.today = today or datetime.now(timezone.utc).date()
+        self.step_totals = {}
+        self.step_columns = StepColumns(provider.parse_start_date)
+        self.sleep_data = []
+
+    def add(self, dp):
+        kind = self.provider.get_point_kind(dp)
+        if kind == "steps":
+            self.step_columns.add(dp)
+            if len(self.step_columns) >= STEP_BATCH_SIZE:
+                self.step_columns.sum_into(self.step_totals, self.today)
+        elif kind == "sleep":
+            self.sleep_data.append({field: dp[field] for field in SLEEP_FIELDS if field in dp})
+
+    def result(self):
+        """Returns (daily_steps, sleep_data), as aggregate_steps_by_source and get_sleep give them."""
+        self.step_columns.sum_into(self.step_totals, self.today)
+        return dict(self.step_totals), self.sleep_data
+
+
+def summarize_device_data(provider, service_access_token, project_id, participant_identifier, base_url, observed_after=None):
+    """Streams one participant's points into a DeviceDataAggregator and returns its result."""
+    aggregator = DeviceDataAggregator(provider)
+    for dp in provider.iter_device_data(service_access_token, project_id, participant_identifier, base_url, observed_after):
+        aggregator.add(dp)
+    return aggregator.result()
+
+
+def summarize_device_data_bulk(provider, service_access_token, project_id, participant_identifiers, base_url, chunk_size=100):
+    """
+    Streams a bulk query into one aggregator per participant.
+
+    Returns:
+        dict of participant ID -> (daily_steps, sleep_data); every requested
+        participant is present.
+    """
+    aggregators = {}
+    if participant_identifiers is not None:
+        participant_identifiers = list(participant_identifiers)
+        aggregators = {pid: DeviceDataAggregator(provider) for pid in participant_identifiers}
+
+    for dp in provider.iter_device_data_bulk(service_access_token, project_id, participant_identifiers, base_url, chunk_size):
+        pid = dp.get("participantIdentifier")
+        aggregator = aggregators.get(pid)
+        if aggregator is None:
+            if participant_identifiers is not None:
+                continue
+            aggregator = aggregators[pid] = DeviceDataAggregator(provider)
+        aggregator.add(dp)
+
+    return {pid: aggregator.result() for pid, aggregator in aggregators.items()}
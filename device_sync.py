@@ -0,0 +1,124 @@
+import os
+from datetime import datetime, timedelta, timezone
+from api_utils import safe_parse_iso
+from s3_utils import RunState
+from step_columns import StepColumns
+
+SYNC_STATE_LOG = "device_sync_state.json"
+
+# Each sync re-reads this many minutes before the previous watermark so that
+# points uploaded a little late are still picked up. Points seen inside that
+# overlap are remembered by id so they are never counted twice.
+SYNC_OVERLAP_MINUTES = int(os.getenv("DEVICE_SYNC_OVERLAP_MINUTES", "60"))
+
+
+def load_sync_state(bucket):
+    """
+    Loads today's watermarks and running aggregates, keyed by
+    '<participant ID>::<namespace>', into a RunState. The state is dated, so
+    every UTC day starts with a full 24h fetch.
+
+    Call save() on it once the run's syncs are done. Only the entries this
+    run synced are written, with a conditional put, so overlapping ticks keep
+    each other's watermarks instead of the last save winning.
+    """
+    sync_state = RunState(bucket)
+    sync_state.get(SYNC_STATE_LOG)
+    return sync_state
+
+
+def _to_iso(dt):
+    return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _parse_utc(s):
+    dt = safe_parse_iso(s) if s else None
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _point_id(dp):
+    return dp.get("id") or "|".join(
+        str(dp.get(field)) for field in ("type", "startDate", "observationDate", "value")
+    )
+
+
+def sync_device_data(sync_state, provider, service_access_token, project_id, participant_identifier, base_url, now=None):
+    """
+    Fetches only the points observed since the participant's last sync and
+    folds them into the cached totals in sync_state, the RunState returned
+    by load_sync_state.
+
+    Returns:
+        (daily_steps, sleep_data): today's step totals by source, as
+        aggregate_steps_by_source returns them, and the sleep entries of the
+        trailing 24h as dicts with a 'duration' in ms.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    window_start = now - timedelta(hours=24)
+    overlap = timedelta(minutes=SYNC_OVERLAP_MINUTES)
+
+    key = f"{participant_identifier}::{provider.namespace}"
+    entry = sync_state.get(SYNC_STATE_LOG).get(key) or {
+        "watermark": None,
+        "steps_by_source": {},
+        "sleep": [],
+        "recent_ids": {}
+    }
+
+    watermark = _parse_utc(entry["watermark"])
+    fetch_after = max(watermark - overlap, window_start) if watermark else window_start
+
+    # Work on copies, so a fetch that fails halfway leaves the entry untouched.
+    recent_ids = dict(entry["recent_ids"])
+    sleep = list(entry["sleep"])
+    seen_sleep_ids = {s.get("id") for s in sleep}
+    steps_by_source = dict(entry["steps_by_source"])
+    step_columns = StepColumns(provider.parse_start_date)
+    today = now.astimezone(timezone.utc).date()
+
+    # Points are folded in as they stream in; only their ids are kept.
+    for dp in provider.iter_device_data(
+        service_access_token, project_id, participant_identifier, base_url,
+        observed_after=_to_iso(fetch_after)
+    ):
+        kind = provider.get_point_kind(dp)
+        if kind is None:
+            continue
+        point_id = _point_id(dp)
+        if point_id in recent_ids or point_id in seen_sleep_ids:
+            continue
+        observed = _parse_utc(dp.get("observationDate") or dp.get("startDate")) or now
+        recent_ids[point_id] = _to_iso(observed)
+
+        if kind == "steps":
+            step_columns.add(dp)
+        else:
+            sleep.append({
+                "id": point_id,
+                "observationDate": _to_iso(observed),
+                "duration": dp.get("duration", 0)
+            })
+
+    step_columns.sum_into(steps_by_source, today)
+    entry = dict(entry)
+    entry["sleep"] = [
+        s for s in sleep
+        if (_parse_utc(s["observationDate"]) or now) >= window_start
+    ]
+
+    # Ids older than the next fetch's lower bound can no longer be returned.
+    next_fetch_after = now - overlap
+    entry["recent_ids"] = {
+        point_id: observed for point_id, observed in recent_ids.items()
+        if (_parse_utc(observed) or now) >= next_fetch_after
+    }
+    entry["steps_by_source"] = steps_by_source
+    entry["watermark"] = _to_iso(now)
+    sync_state.set(SYNC_STATE_LOG, key, entry)
+
+    return dict(entry["steps_by_source"]), list(entry["sleep"])
@@ -0,0 +1,143 @@
+import os
+import heapq
+import threading
+import time
+import jitai_logic
+import notifier_logic
+from s3_utils import RunState
+from log_utils import get_logger
+from schedule_index import NOTIFIER_CURSOR_LOG, get_schedule_index
+
+logger = get_logger("dispatcher")
+
+# Sends due within this many seconds of the earliest one are sent together.
+DISPATCH_COALESCE_SECONDS = int(os.getenv("DISPATCH_COALESCE_SECONDS", "30"))
+# How often the in-process scheduler runs jitai_logic.lambda_handler.
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL_SECONDS", "300"))
+# Upper bound on how long the dispatcher sleeps before re-reading the schedule,
+# so entries added by a scheduler running elsewhere are still picked up. The
+# in-process scheduler wakes it through rearm(), so this is only a fallback.
+DISPATCH_POLL_SECONDS = int(os.getenv("DISPATCH_POLL_SECONDS", str(SCHEDULER_INTERVAL_SECONDS)))
+
+
+class Dispatcher:
+    """
+    Long-running notifier that sleeps until the next scheduled send instead
+    of polling every few minutes.
+
+    The unsent entries of the day's schedule index are kept in a min-heap by
+    send time. The dispatcher wakes at the earliest one, stretched to the last
+    send within DISPATCH_COALESCE_SECONDS of it, and runs one notifier pass for
+    all of them. rearm() wakes it early after the schedule changed.
+
+    The schedule is only re-read after a rearm() or a poll timeout. Sends the
+    notifier failed (kept in its cursor's "pending") are retried at the next
+    poll; entries it dropped, e.g. for an invalid send time, are not.
+    """
+
+    def __init__(self, coalesce_seconds=DISPATCH_COALESCE_SECONDS, poll_seconds=DISPATCH_POLL_SECONDS,
+                 send=notifier_logic.lambda_handler):
+        self.coalesce_seconds = coalesce_seconds
+        self.poll_seconds = poll_seconds
+        self.send = send
+        self.heap = []
+        self.pending = {}
+        self.stale = True
+        self.last_send = 0.0
+        self.rearmed = threading.Event()
+        self.stopped = threading.Event()
+
+    def rearm(self):
+        self.rearmed.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.rearmed.set()
+
+    def load_schedule(self):
+        state = RunState(notifier_logic.BUCKET)
+        index = get_schedule_index(state, state.get("scheduled_log.json"))
+        sent_log = state.get("sent_log.json")
+        self.heap = [
+            (epoch, key)
+            for bucket in index.values()
+            for key, epoch in bucket.items()
+            if key not in sent_log
+        ]
+        heapq.heapify(self.heap)
+        self.load_pending(state)
+
+    def load_pending(self, state=None):
+        if state is None:
+            state = RunState(notifier_logic.BUCKET)
+        self.pending = state.get(NOTIFIER_CURSOR_LOG).get("pending") or {}
+
+    def next_wake_time(self, now):
+        """
+        Returns when the next batch should go out, or None if nothing new is
+        scheduled. Entries already due at the last send are left to the poll,
+        so a failing send is not retried in a tight loop.
+        """
+        while self.heap and self.heap[0][0] <= self.last_send:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+
+        first = self.heap[0][0]
+        window_end = max(first, now) + self.coalesce_seconds
+        wake_at = max(epoch for epoch, _ in self.heap if epoch <= window_end)
+        return max(wake_at, now)
+
+    def has_overdue(self, now):
+        """True if the notifier kept a send due by now pending for a retry."""
+        return any(epoch is not None and epoch <= now for epoch in self.pending.values())
+
+    def run_once(self):
+        if self.stale:
+            self.load_schedule()
+            self.stale = False
+        overdue = self.has_overdue(self.last_send)
+        now = time.time()
+        wake_at = self.next_wake_time(now)
+
+        polling = wake_at is None or wake_at - now >= self.poll_seconds
+        timeout = self.poll_seconds if wake_at is None else min(wake_at - now, self.poll_seconds)
+        if self.rearmed.wait(max(timeout, 0)):
+            self.rearmed.clear()
+            self.stale = True
+            return
+        if polling:
+            self.stale = True
+
+        now = time.time()
+        if (wake_at is not None and now >= wake_at) or overdue:
+            self.last_send = now
+            self.send()
+            if not self.stale:
+                self.load_pending()
+
+    def run(self):
+        logger.info("Dispatcher started")
+        while not self.stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Dispatcher pass failed", extra={"error": str(e)})
+                self.stale = True
+                self.stopped.wait(self.poll_seconds)
+
+
+def run_scheduler(dispatcher, interval=SCHEDULER_INTERVAL_SECONDS):
+    while not dispatcher.stopped.is_set():
+        try:
+            jitai_logic.lambda_handler(None, None)
+        except Exception as e:
+            logger.error("Scheduler run failed", extra={"error": str(e)})
+        dispatcher.rearm()
+        dispatcher.stopped.wait(interval)
+
+
+if __name__ == "__main__":
+    dispatcher = Dispatcher()
+    threading.Thread(target=run_scheduler, args=(dispatcher,), daemon=True).start()
+    dispatcher.run()
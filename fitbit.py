@@ -1,83 +1,15 @@
-from datetime import datetime, timedelta, time, timezone
-import pytz
-import requests
-from collections import defaultdict
-from api_utils import *
-
-
-def get_steps(service_access_token, project_id, participant_identifier, base_url):
-    url = f"{base_url}/api/v1/administration/projects/{project_id}/devicedatapoints"
-
-    observed_after = (datetime.utcnow() - timedelta(hours=24)).replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
-
-    params = {
-        "namespace": "Fitbit",
-        "type": "Steps",
-        "participantIdentifier": participant_identifier,
-        "observedAfter": observed_after
-    }
-
-    headers = {
-        "Authorization": f"Bearer {service_access_token}",
-        "Accept": "application/json"
-    }
-
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()
-
-    return response.json().get("deviceDataPoints", [])
-
-
-def aggregate_steps_by_source(data_points):
-    step_totals = defaultdict(int)
-    today = datetime.now(timezone.utc).date()
-
-    for dp in data_points:
-        if dp.get("type") != "Steps":
-            continue
-
-        try:
-            start_date = safe_parse_iso(dp["startDate"])
-            if not start_date:
-                continue
-        except Exception as e:
-            print(f"Skipping invalid timestamp: {dp['startDate']} – {e}")
-            continue
-
-        if start_date.date() != today:
-            continue
-
-        try:
-            source_name = dp["source"]["properties"].get("SourceName", "Unknown Source")
-            step_value = int(float(dp["value"]))
-            step_totals[source_name] += step_value
-        except Exception as e:
-            print(f"Error parsing entry: {e}")
-
-    return dict(step_totals)
-
-
-def get_sleep(service_access_token, project_id, participant_identifier, base_url):
-    url = f"{base_url}/api/v1/administration/projects/{project_id}/devicedatapoints"
-
-    observed_after = (datetime.utcnow() - timedelta(hours=24)).replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
-
-    params = {
-        "namespace": "Fitbit",
-        "participantIdentifier": participant_identifier,
-        "observedAfter": observed_after
-        # Type filter optional for Fitbit sleep
-    }
-
-    headers = {
-        "Authorization": f"Bearer {service_access_token}",
-        "Accept": "application/json"
-    }
-
-    response = requests.get(url, headers=headers, params=params)
-    response.raise_for_status()
-
-    data = response.json().get("deviceDataPoints", [])
-
-    # Filter only sleep-related entries if needed
-    return [dp for dp in data if "sleep" in dp.get("type", "").lower()]
+"""Fitbit device data. A thin wrapper around the shared engine in providers."""
+from providers import PROVIDERS
+
+PROVIDER = PROVIDERS["Fitbit"]
+NAMESPACE = PROVIDER.namespace
+
+get_steps = PROVIDER.get_steps
+get_sleep = PROVIDER.get_sleep
+aggregate_steps_by_source = PROVIDER.aggregate_steps_by_source
+parse_start_date = PROVIDER.parse_start_date
+get_point_kind = PROVIDER.get_point_kind
+iter_device_data = PROVIDER.iter_device_data
+iter_device_data_bulk = PROVIDER.iter_device_data_bulk
+get_device_data = PROVIDER.get_device_data
+get_device_data_bulk = PROVIDER.get_device_data_bulk
@@ -1,77 +1,299 @@
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from jitai_utils import *
 from api_utils import *
 from notifications import *
-import apple_health as AppleHealth
-import health_connect as HealthConnect
-import google_fit as GoogleFit
-import fitbit as Fitbit
+import device_sync
+import metrics
+from device_stream import summarize_device_data, summarize_device_data_bulk
+from providers import DEVICE_NAMESPACE_MODE, get_platform_providers, has_device_data, merge_device_summaries
+from decision_calendar import DecisionCalendar
+from log_utils import get_logger
 
-def lambda_handler(event, context):
-    print("Running MRT loop...")
-    segment_ids = {
-        "iOS": "fd09bd40-a26b-42b3-86af-4a59cbba489a",
-        "Android": "2c3457ae-3c5b-4616-8480-e1e4ac750cdd",
-        "Fitbit": "e1fc5eaf-e279-4e83-8a05-69831c352bd1"
+logger = get_logger("jitai_logic")
+
+# Number of threads used to gather device data during the context phase.
+# Set to 1 to fall back to fetching participants one at a time.
+CONTEXT_FETCH_WORKERS = int(os.getenv("CONTEXT_FETCH_WORKERS", "8"))
+
+# "participant" queries /devicedatapoints once per participant and namespace;
+# "bulk" asks for all of a namespace's active participants in one paged query
+# per chunk.
+DEVICE_DATA_FETCH_MODE = os.getenv("DEVICE_DATA_FETCH_MODE", "participant")
+DEVICE_DATA_BULK_CHUNK_SIZE = int(os.getenv("DEVICE_DATA_BULK_CHUNK_SIZE", "100"))
+
+# "full" re-downloads the trailing 24h every tick; "incremental" only fetches
+# points observed since the last sync and folds them into totals persisted
+# by device_sync. Incremental sync takes precedence over bulk fetching.
+DEVICE_DATA_SYNC_MODE = os.getenv("DEVICE_DATA_SYNC_MODE", "full")
+
+# MyDataHelps participant segment of each platform.
+SEGMENT_IDS = {
+    "iOS": "fd09bd40-a26b-42b3-86af-4a59cbba489a",
+    "Android": "2c3457ae-3c5b-4616-8480-e1e4ac750cdd",
+    "Fitbit": "e1fc5eaf-e279-4e83-8a05-69831c352bd1"
+}
+
+# Each platform's decision-point calendar, kept across warm invocations.
+DECISION_CALENDARS = {}
+
+def fetch_device_summary(access_token, provider, pid, sync_state=None):
+    """Returns one namespace's (daily_steps, sleep_data) for a participant."""
+    if sync_state is not None:
+        return device_sync.sync_device_data(
+            sync_state, provider, access_token, project_id, pid, base_url
+        )
+    return summarize_device_data(provider, access_token, project_id, pid, base_url)
+
+
+def get_participant_context(access_token, platform, pid, p_obj, device_summaries=None, sync_state=None):
+    """
+    Builds a participant's context from the namespaces of their platform
+    (see providers.PLATFORM_NAMESPACES). device_summaries holds the
+    (daily_steps, sleep_data) already fetched, by namespace; if it is None,
+    the namespaces are fetched here, following DEVICE_NAMESPACE_MODE.
+    """
+    if device_summaries is None:
+        device_summaries = {}
+        for rank, provider in enumerate(get_platform_providers(platform)):
+            try:
+                summary = fetch_device_summary(access_token, provider, pid, sync_state)
+            except Exception as e:
+                if not rank or DEVICE_NAMESPACE_MODE == "merge":
+                    raise
+                # A failed fallback keeps the earlier namespaces' summaries.
+                logger.warning("Failed to fetch device data", extra={
+                    "pid": pid, "namespace": provider.namespace, "error": str(e)
+                })
+                continue
+            device_summaries[provider.namespace] = summary
+            if DEVICE_NAMESPACE_MODE != "merge" and has_device_data(summary):
+                break
+    daily_steps, sleep_data = merge_device_summaries(list(device_summaries.values()))
+
+    total_steps = max(daily_steps.values()) if daily_steps else None
+    total_sleep_ms = sum([s.get("duration", 0) for s in sleep_data])
+    total_sleep_hours = total_sleep_ms / (1000 * 60 * 60)
+
+    context = {
+        "platform": platform,
+        "total_steps": total_steps,
+        "total_sleep_hours": total_sleep_hours,
+        "active_mealtimes": p_obj.get("active_mealtimes", []) if p_obj else [],
+        "custom_fields": p_obj.get("customFields", {}) if p_obj else {},
+        "demographics": p_obj.get("demographics", {}) if p_obj else {}
     }
-    access_token = get_service_access_token()
-    active_participant_ids_by_platform = {}
+    context["needs_sync_reminder"] = (
+        total_steps is None and total_sleep_hours == 0
+    )
+    logger.debug("Participant context", extra={
+        "pid": pid, "platform": platform, "total_steps": total_steps, "total_sleep_hours": round(total_sleep_hours, 2)
+    })
+    return context
+
+
+def fetch_participant_contexts(access_token, participant_ids_by_platform, all_active_participants, max_workers=None):
+    """
+    Gathers step/sleep context for every active participant.
+
+    Device data is fetched in rounds. With DEVICE_NAMESPACE_MODE "fallback",
+    round n reads each platform's n-th namespace, only for participants with
+    no data so far; with "merge", a single round reads every namespace. A
+    failure for one participant is logged and that participant is left out;
+    the others are unaffected. A failure in a fallback round after the first
+    keeps what the earlier rounds returned instead. The returned dict has the
+    same keys, values and order as a one-at-a-time fetch.
+    """
+    if max_workers is None:
+        max_workers = CONTEXT_FETCH_WORKERS
+
+    jobs = [
+        (platform, pid)
+        for platform, participant_ids in participant_ids_by_platform.items()
+        for pid in participant_ids
+    ]
+
+    sync_state = None
+    if DEVICE_DATA_SYNC_MODE == "incremental":
+        sync_state = device_sync.load_sync_state(BUCKET)
+
+    fallback = DEVICE_NAMESPACE_MODE != "merge"
+    max_namespaces = max((len(get_platform_providers(platform)) for platform, _ in jobs), default=0)
+    rounds = range(max_namespaces) if fallback else [None]
+
+    device_summaries = {}
+    failed = set()
+    for rank in rounds:
+        participant_ids_by_provider = {}
+        for platform, pid in jobs:
+            if pid in failed:
+                continue
+            if rank and any(has_device_data(summary) for summary in device_summaries.get(pid, {}).values()):
+                continue
+            providers = get_platform_providers(platform)
+            for provider in (providers if rank is None else providers[rank:rank + 1]):
+                participant_ids_by_provider.setdefault(provider, []).append(pid)
+
+        summaries, round_failed = fetch_device_summaries(
+            access_token, participant_ids_by_provider, sync_state, max_workers
+        )
+        if rank:
+            # A failed fallback keeps the empty summaries of the earlier
+            # rounds instead of dropping the participant, so they still get
+            # their sync reminder.
+            round_failed -= device_summaries.keys()
+        failed.update(round_failed)
+        for pid, by_namespace in summaries.items():
+            device_summaries.setdefault(pid, {}).update(by_namespace)
+
+    if sync_state is not None:
+        sync_state.save()
+
     participant_context_data = {}
-    all_active_participants = {}
+    for platform, pid in jobs:
+        if pid in failed:
+            continue
+        participant_context_data[pid] = get_participant_context(
+            access_token, platform, pid, all_active_participants.get(pid), device_summaries.get(pid, {})
+        )
+    return participant_context_data
+
+
+def fetch_device_summaries(access_token, participant_ids_by_provider, sync_state=None, max_workers=None):
+    """
+    Fetches one summary per (provider, participant) pair: in bulk where
+    DEVICE_DATA_FETCH_MODE allows, the rest concurrently on a bounded
+    thread pool.
+
+    Returns:
+        ({participant ID: {namespace: (daily_steps, sleep_data)}}, set of
+        participant IDs whose fetch failed).
+    """
+    if max_workers is None:
+        max_workers = CONTEXT_FETCH_WORKERS
+
+    bulk_device_data = {}
+    if sync_state is None and DEVICE_DATA_FETCH_MODE == "bulk":
+        bulk_device_data = fetch_bulk_device_data(access_token, participant_ids_by_provider, max_workers)
+
+    fetch_jobs = [
+        (provider, pid)
+        for provider, participant_ids in participant_ids_by_provider.items()
+        for pid in participant_ids
+        if pid not in bulk_device_data.get(provider.namespace, {})
+    ]
+
+    def fetch(job):
+        provider, pid = job
+        try:
+            return fetch_device_summary(access_token, provider, pid, sync_state)
+        except Exception as e:
+            logger.warning("Failed to fetch device data", extra={
+                "pid": pid, "namespace": provider.namespace, "error": str(e)
+            })
+            return None
+
+    if max_workers <= 1 or len(fetch_jobs) <= 1:
+        results = [fetch(job) for job in fetch_jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(fetch_jobs))) as executor:
+            results = list(executor.map(metrics.bind(fetch), fetch_jobs))
+
+    device_summaries = {}
+    failed = set()
+    for (provider, pid), summary in zip(fetch_jobs, results):
+        if summary is None:
+            failed.add(pid)
+        else:
+            device_summaries.setdefault(pid, {})[provider.namespace] = summary
+    for namespace, summaries in bulk_device_data.items():
+        for pid, summary in summaries.items():
+            device_summaries.setdefault(pid, {})[namespace] = summary
+    return device_summaries, failed
+
+
+def fetch_bulk_device_data(access_token, participant_ids_by_provider, max_workers=None):
+    """
+    Fetches device data for each provider's participants in bulk, with the
+    namespaces queried side by side.
 
-    for platform, seg_id in segment_ids.items():
-        segment_participants = get_participants_by_segment(project_id, access_token, seg_id)
-        active_participants = get_active_meal_window_participants(segment_participants)
-        for p in active_participants:
-            all_active_participants[p["participantIdentifier"]] = p
-        active_ids = [p["participantIdentifier"] for p in active_participants]
-        active_participant_ids_by_platform[platform] = active_ids
-        print(f"{platform} - Active participant IDs: {active_ids}")
-
-    for platform, participant_ids in active_participant_ids_by_platform.items():
-        for pid in participant_ids:
-            daily_steps = {}
-            sleep_data = []
-            
-            if platform == "iOS":
-                steps_data = AppleHealth.get_steps(access_token, project_id, pid, base_url)
-                sleep_data = AppleHealth.get_sleep(access_token, project_id, pid, base_url)
-                daily_steps = AppleHealth.aggregate_steps_by_source(steps_data)
-            # elif platform == "Android":
-            #     steps_data = GoogleFit.get_steps(access_token, project_id, pid, base_url)
-            #     sleep_data = GoogleFit.get_sleep(access_token, project_id, pid, base_url)
-            #     daily_steps = GoogleFit.aggregate_steps_by_source(steps_data)
-            elif platform == "Fitbit":
-                steps_data = Fitbit.get_steps(access_token, project_id, pid, base_url)
-                sleep_data = Fitbit.get_sleep(access_token, project_id, pid, base_url)
-                daily_steps = Fitbit.aggregate_steps_by_source(steps_data)
-
-            total_steps = max(daily_steps.values()) if daily_steps else None
-            total_sleep_ms = sum([s.get("duration", 0) for s in sleep_data])
-            total_sleep_hours = total_sleep_ms / (1000 * 60 * 60)
-
-            p_obj = all_active_participants.get(pid)
-            participant_context_data[pid] = {
-                "platform": platform,
-                "total_steps": total_steps,
-                "total_sleep_hours": total_sleep_hours,
-                "active_mealtimes": p_obj.get("active_mealtimes", []) if p_obj else [],
-                "custom_fields": p_obj.get("customFields", {}) if p_obj else {},
-                "demographics": p_obj.get("demographics", {}) if p_obj else {}
-            }
-            participant_context_data[pid]["needs_sync_reminder"] = (
-                total_steps is None and total_sleep_hours == 0
+    Returns:
+        dict of namespace -> {participant ID: (daily_steps, sleep_data)}. A
+        namespace whose bulk query fails is left out, so its participants
+        fall back to individual fetches.
+    """
+    if max_workers is None:
+        max_workers = CONTEXT_FETCH_WORKERS
+
+    def fetch(provider):
+        try:
+            return summarize_device_data_bulk(
+                provider, access_token, project_id, participant_ids_by_provider[provider], base_url,
+                chunk_size=DEVICE_DATA_BULK_CHUNK_SIZE
             )
-            print(f"{platform} - {pid} - Steps: {total_steps}, Sleep (h): {total_sleep_hours:.2f}")
+        except Exception as e:
+            logger.warning("Bulk device data fetch failed, falling back to per-participant", extra={
+                "namespace": provider.namespace, "error": str(e)
+            })
+            return None
+
+    providers = [provider for provider, participant_ids in participant_ids_by_provider.items() if participant_ids]
+    if not providers:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(providers)))) as executor:
+        results = list(executor.map(metrics.bind(fetch), providers))
+
+    return {
+        provider.namespace: summaries
+        for provider, summaries in zip(providers, results)
+        if summaries is not None
+    }
+
+
+@metrics.instrumented("scheduler")
+def lambda_handler(event, context):
+    logger.info("Running MRT loop")
+    with metrics.phase("token"):
+        access_token = get_service_access_token()
+    active_participant_ids_by_platform = {}
+    all_active_participants = {}
+
+    with metrics.phase("rosters"):
+        rosters = get_participants_by_segments(project_id, access_token, SEGMENT_IDS)
+    with metrics.phase("calendar"):
+        for platform, segment_participants in rosters.items():
+            calendar = DECISION_CALENDARS.setdefault(platform, DecisionCalendar())
+            calendar.refresh(segment_participants)
+            active_participants = calendar.get_active_participants()
+            for p in active_participants:
+                all_active_participants[p["participantIdentifier"]] = p
+            active_ids = [p["participantIdentifier"] for p in active_participants]
+            active_participant_ids_by_platform[platform] = active_ids
+            logger.info("Active participants", extra={"platform": platform, "active": len(active_ids)})
+            logger.debug("Active participant IDs", extra={"platform": platform, "participant_ids": active_ids})
+    metrics.count("participants.roster", sum(len(r) for r in rosters.values()))
+    metrics.count("participants.active", len(all_active_participants))
+
+    with metrics.phase("contexts"):
+        participant_context_data = fetch_participant_contexts(
+            access_token, active_participant_ids_by_platform, all_active_participants
+        )
+    metrics.count("participants.context_failed", len(all_active_participants) - len(participant_context_data))
 
     assignments = randomize(participant_context_data)
     for pid, group in assignments.items():
         mealtimes = participant_context_data[pid].get("active_mealtimes", [])
-        print(f"{pid} assigned to group: {group} | Active mealtime(s): {', '.join(mealtimes) if mealtimes else 'None'}")
+        logger.debug("Assigned group", extra={"pid": pid, "group": group, "mealtimes": mealtimes})
 
-    check_and_increment_tracking(base_url, project_id, access_token, BUCKET)
-    schedule_notifications(assignments, participant_context_data)
-    schedule_sync_reminders(participant_context_data)
+    with metrics.phase("tracking"):
+        check_and_increment_tracking(base_url, project_id, access_token, BUCKET, all_active_participants)
+    with metrics.phase("schedule"):
+        state = RunState(BUCKET)
+        schedule_notifications(assignments, participant_context_data, state)
+        schedule_sync_reminders(participant_context_data, state)
+    with metrics.phase("save"):
+        state.save()
     return {"status": "completed"}
 
 if __name__ == "__main__":
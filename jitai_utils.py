@@ -1,62 +1,263 @@
-from datetime import datetime, timedelta
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 import pytz
 import api_utils
+import metrics
+from log_utils import get_logger
 
-def get_participants_by_segment(project_id, access_token, segment_id):
-    participants = []
-    page = 0
+logger = get_logger("jitai_utils")
+
+# How long a segment roster is reused before it is fetched again. Rosters are
+# kept at module scope, so warm invocations share them. 0 disables the cache.
+ROSTER_CACHE_TTL_SECONDS = int(os.getenv("ROSTER_CACHE_TTL_SECONDS", "900"))
+# Number of roster pages fetched in parallel once the total is known.
+ROSTER_PAGE_WORKERS = int(os.getenv("ROSTER_PAGE_WORKERS", "4"))
+ROSTER_PAGE_SIZE = 100
+# Query parameter that limits /participants to participants modified after a
+# timestamp. When set, a stale roster is refreshed as a delta on top of the
+# cached one; unset (default) means every refresh is a full fetch.
+ROSTER_DELTA_PARAM = os.getenv("ROSTER_DELTA_PARAM", "")
+# Delta refreshes can't see participants leaving a segment, so the roster is
+# still fetched in full at least this often.
+ROSTER_FULL_REFRESH_SECONDS = int(os.getenv("ROSTER_FULL_REFRESH_SECONDS", "86400"))
+# Up to this many participants, fetch_participants makes one GET each instead
+# of paging through the whole project.
+PARTICIPANT_GET_MAX = int(os.getenv("PARTICIPANT_GET_MAX", "20"))
+
+# segment ID -> {"participants", "fetched_at", "full_fetched_at", "modified_after"}
+_roster_cache = {}
+_roster_cache_lock = threading.Lock()
+
+
+def get_participants_page(project_id, access_token, segment_id, page, extra_params=None):
+    url = f'api/v1/administration/projects/{project_id}/participants?pageNumber={page}&pageSize={ROSTER_PAGE_SIZE}'
+    if segment_id is not None:
+        url += f'&segmentId={segment_id}'
+    response = api_utils.get_from_api(access_token, url, extra_params)
+    return response.json()
+
+
+def fetch_participants_by_segment(project_id, access_token, segment_id, extra_params=None, max_workers=None):
+    """
+    Fetches a segment roster (or the whole project's, if segment_id is None)
+    from the API. The first page tells how many participants there are, and
+    the remaining pages are fetched in parallel. Without a total, pages are
+    fetched one by one until a short page.
+    """
+    if max_workers is None:
+        max_workers = ROSTER_PAGE_WORKERS
+
+    data = get_participants_page(project_id, access_token, segment_id, 0, extra_params)
+    participants = list(data.get("participants", []))
+    if len(participants) < ROSTER_PAGE_SIZE:
+        return participants
+
+    total = data.get("totalParticipants")
+    if isinstance(total, int) and max_workers > 1:
+        pages = range(1, -(-total // ROSTER_PAGE_SIZE))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map() keeps page order, so the roster order matches a sequential fetch.
+            for page_data in executor.map(
+                metrics.bind(lambda page: get_participants_page(project_id, access_token, segment_id, page, extra_params)),
+                pages
+            ):
+                participants.extend(page_data.get("participants", []))
+        return participants
+
+    page = 1
     while True:
-        url = f'api/v1/administration/projects/{project_id}/participants?segmentId={segment_id}&pageNumber={page}&pageSize=100'
-        response = api_utils.get_from_api(access_token, url)
-        data = response.json()
-        participants.extend(data.get("participants", []))
-        if len(data.get("participants", [])) < 100:
+        page_participants = get_participants_page(project_id, access_token, segment_id, page, extra_params).get("participants", [])
+        participants.extend(page_participants)
+        if len(page_participants) < ROSTER_PAGE_SIZE:
             break
         page += 1
     return participants
 
-def is_currently_in_mealtime_window(start_time_str: str, local_time: datetime.time) -> bool:
-    
-    # TODO: Handle edge-cases: What happens if a meal window starts at 23:00 or 00:00?? --> input validation
+
+def _merge_roster(participants, updated):
+    updated_by_id = {p["participantIdentifier"]: p for p in updated}
+    merged = [updated_by_id.pop(p["participantIdentifier"], p) for p in participants]
+    merged.extend(updated_by_id.values())
+    return merged
+
+
+def get_participants_by_segment(project_id, access_token, segment_id):
+    """
+    Returns the segment roster, from the cache while it is younger than
+    ROSTER_CACHE_TTL_SECONDS. An unchanged roster is returned as the same
+    list object, so callers can skip work that depends only on the roster.
+    """
+    now = time.monotonic()
+    with _roster_cache_lock:
+        cached = _roster_cache.get(segment_id)
+    if cached and now - cached["fetched_at"] < ROSTER_CACHE_TTL_SECONDS:
+        metrics.count("roster.cache_hits")
+        return cached["participants"]
+
+    modified_after = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    if cached and ROSTER_DELTA_PARAM and now - cached["full_fetched_at"] < ROSTER_FULL_REFRESH_SECONDS:
+        try:
+            updated = fetch_participants_by_segment(
+                project_id, access_token, segment_id,
+                extra_params={ROSTER_DELTA_PARAM: cached["modified_after"]}
+            )
+        except Exception as e:
+            logger.warning("Delta roster refresh failed, fetching in full", extra={"segment_id": segment_id, "error": str(e)})
+        else:
+            metrics.count("roster.delta_refreshes")
+            entry = dict(cached, fetched_at=now, modified_after=modified_after)
+            if updated:
+                entry["participants"] = _merge_roster(cached["participants"], updated)
+            with _roster_cache_lock:
+                _roster_cache[segment_id] = entry
+            return entry["participants"]
+
+    participants = fetch_participants_by_segment(project_id, access_token, segment_id)
+    metrics.count("roster.full_fetches")
+    with _roster_cache_lock:
+        _roster_cache[segment_id] = {
+            "participants": participants,
+            "fetched_at": now,
+            "full_fetched_at": now,
+            "modified_after": modified_after
+        }
+    return participants
+
+
+def get_participants_by_segments(project_id, access_token, segment_ids):
+    """Fetches several segment rosters concurrently. segment_ids maps a name to a segment ID."""
+    if not segment_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(segment_ids)) as executor:
+        futures = {
+            name: executor.submit(metrics.bind(get_participants_by_segment), project_id, access_token, seg_id)
+            for name, seg_id in segment_ids.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def get_participant(project_id, access_token, participant_id):
+    """Returns one participant object, or None if the project has no such participant."""
+    url = f'api/v1/administration/projects/{project_id}/participants/{participant_id}'
+    response = api_utils.get_from_api(access_token, url, raise_error=False)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_participants(project_id, access_token, participant_ids):
+    """
+    Fetches the given participants, bypassing the roster cache so the
+    objects are current. Up to PARTICIPANT_GET_MAX participants are fetched
+    with one GET each, in parallel. Beyond that, one paged query over the
+    whole project is used instead, which costs a request per ROSTER_PAGE_SIZE
+    participants in the project however few are wanted.
+
+    Returns:
+        dict of participant ID -> participant object; IDs the API didn't
+        return are left out.
+    """
+    wanted = set(participant_ids)
+    if not wanted:
+        return {}
+
+    if len(wanted) <= PARTICIPANT_GET_MAX:
+        ids = sorted(wanted)
+        with ThreadPoolExecutor(max_workers=max(1, min(ROSTER_PAGE_WORKERS, len(ids)))) as executor:
+            found = list(executor.map(
+                metrics.bind(lambda pid: get_participant(project_id, access_token, pid)), ids
+            ))
+        return {pid: p for pid, p in zip(ids, found) if p is not None}
+
+    return {
+        p["participantIdentifier"]: p
+        for p in fetch_participants_by_segment(project_id, access_token, None)
+        if p.get("participantIdentifier") in wanted
+    }
+
+
+def clear_roster_cache():
+    with _roster_cache_lock:
+        _roster_cache.clear()
+
+# Max number of distinct meal-time strings and timezone names kept parsed.
+WINDOW_CACHE_SIZE = int(os.getenv("WINDOW_CACHE_SIZE", "4096"))
+
+MEAL_WINDOW_SECONDS = 2 * 60 * 60
+
+
+@lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def parse_mealtime_seconds(start_time_str: str):
+    """
+    Parses a meal time like '01:00 PM' into seconds after midnight, or None
+    if it can't be parsed. Memoized, since the same few strings come back on
+    every tick.
+    """
     try:
         # Parse '01:00 PM' correctly
         start_time = datetime.strptime(start_time_str.strip(), "%I:%M %p").time()
-        today = datetime.today()
-        start_dt = datetime.combine(today, start_time)
-        end_dt = start_dt + timedelta(hours=2)
-        local_dt = datetime.combine(today, local_time)
-        return start_dt <= local_dt <= end_dt
-    
     except Exception as e:
-        print(f"Failed to parse '{start_time_str}': {e}")
-        return False
+        logger.warning("Failed to parse meal time", extra={"start_time": start_time_str, "error": str(e)})
+        return None
+    return start_time.hour * 3600 + start_time.minute * 60 + start_time.second
+
+
+@lru_cache(maxsize=WINDOW_CACHE_SIZE)
+def get_timezone(tz_name: str):
+    """Returns the pytz timezone for tz_name, or None if it is invalid."""
+    try:
+        return pytz.timezone(tz_name)
+    except Exception as e:
+        logger.warning("Invalid timezone, defaulting to UTC", extra={"timezone": tz_name, "error": str(e)})
+        return None
+
+
+def seconds_since_midnight(local_time: datetime.time) -> float:
+    return local_time.hour * 3600 + local_time.minute * 60 + local_time.second + local_time.microsecond / 1e6
+
+
+def is_in_mealtime_window(start_seconds, now_seconds) -> bool:
+    return start_seconds is not None and start_seconds <= now_seconds <= start_seconds + MEAL_WINDOW_SECONDS
+
+
+def is_currently_in_mealtime_window(start_time_str: str, local_time: datetime.time) -> bool:
+    
+    # TODO: Handle edge-cases: What happens if a meal window starts at 23:00 or 00:00?? --> input validation
+    return is_in_mealtime_window(parse_mealtime_seconds(start_time_str), seconds_since_midnight(local_time))
 
 
 def get_active_meal_window_participants(participants):
     active_participants = []
+    # "now" is computed once per timezone rather than once per participant.
+    now_by_tz = {}
 
     for p in participants:
         custom_fields = p.get("customFields", {})
         participant_tz_name = p.get("demographics", {}).get("timeZone", "UTC")
-        try:
-            participant_tz = pytz.timezone(participant_tz_name)
-        except Exception as e:
-            print(f"Invalid timezone '{participant_tz_name}' for participant {p['id']}, defaulting to UTC: {e}")
-            participant_tz = pytz.UTC
 
-        now_local_dt = datetime.now(participant_tz)
-        now_local_time = now_local_dt.time()
-        weekday = now_local_dt.weekday()  # Monday = 0, Sunday = 6
+        if participant_tz_name not in now_by_tz:
+            participant_tz = get_timezone(participant_tz_name) or pytz.UTC
+            now_local_dt = datetime.now(participant_tz)
+            weekday = now_local_dt.weekday()  # Monday = 0, Sunday = 6
 
-        # Choose prefix based on weekday
-        if weekday < 5:
-            prefix = "mealtime_mon_"
-        else:
-            prefix = "mealtime_we_"
+            # Choose prefix based on weekday
+            if weekday < 5:
+                prefix = "mealtime_mon_"
+            else:
+                prefix = "mealtime_we_"
+
+            now_by_tz[participant_tz_name] = (prefix, seconds_since_midnight(now_local_dt.time()))
+
+        prefix, now_seconds = now_by_tz[participant_tz_name]
 
         active_mealtimes = [
             key for key, value in custom_fields.items()
-            if key.startswith(prefix) and value and is_currently_in_mealtime_window(value, now_local_time)
+            if key.startswith(prefix) and value and is_in_mealtime_window(parse_mealtime_seconds(value), now_seconds)
         ]
 
         if active_mealtimes:
@@ -64,6 +265,3 @@ def get_active_meal_window_participants(participants):
             active_participants.append(p)
 
     return active_participants
-
-
-
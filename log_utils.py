@@ -0,0 +1,191 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Lowest level written: DEBUG, INFO (default), WARNING or ERROR.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Share of participants (0-1) whose DEBUG events are kept. Sampling is by
+# participant ID, so a sampled participant's trail is complete.
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.05"))
+# Records waiting for the writer thread; once full, new records are dropped
+# instead of blocking the caller.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fields whose values are written as "[REDACTED]", at any depth. Set
+# LOG_REDACT=0 to keep them, e.g. when debugging locally.
+LOG_REDACT_FIELDS = os.getenv(
+    "LOG_REDACT_FIELDS",
+    "customFields,custom_fields,demographics,firstName,middleName,lastName,"
+    "email,phoneNumber,mobilePhone,dateOfBirth,street1,street2,city,postalCode"
+)
+LOG_REDACT = os.getenv("LOG_REDACT", "1") != "0"
+# Max seconds flush() waits for queued records to be written.
+LOG_FLUSH_TIMEOUT_SECONDS = float(os.getenv("LOG_FLUSH_TIMEOUT_SECONDS", "2"))
+
+REDACTED = "[REDACTED]"
+ROOT_LOGGER = "mrt"
+
+_REDACT_FIELDS = frozenset(field.strip() for field in LOG_REDACT_FIELDS.split(",") if field.strip())
+_RECORD_ATTRS = frozenset(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+def redact(value):
+    """Returns a copy of value with the LOG_REDACT_FIELDS replaced."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in _REDACT_FIELDS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, and every
+    field passed through extra=. Only fields are redacted, so participant
+    data belongs in extra=, not in the message.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat().replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if LOG_REDACT:
+            entry = redact(entry)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ParticipantSampler(logging.Filter):
+    """Keeps DEBUG records with a pid field for LOG_DEBUG_SAMPLE_RATE of participants."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.threshold = rate * 2 ** 32
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        pid = getattr(record, "pid", None)
+        if pid is None:
+            return True
+        return zlib.crc32(str(pid).encode()) < self.threshold
+
+
+_exception_formatter = logging.Formatter()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        """
+        Like QueueHandler.prepare, queues a copy of the record with its args
+        merged into the message and the exception rendered to text, but
+        doesn't format it: JSON formatting and redaction run on the writer
+        thread, off the hot loop.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class StdoutHandler(logging.StreamHandler):
+    """Writes to whatever sys.stdout is at the time, so redirected output is followed."""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_queue_handler = NonBlockingQueueHandler(_queue)
+_queue_handler.addFilter(ParticipantSampler(LOG_DEBUG_SAMPLE_RATE))
+_stdout_handler = StdoutHandler()
+_stdout_handler.setFormatter(JsonFormatter())
+_listener = QueueListener(_queue, _stdout_handler)
+_listener_lock = threading.Lock()
+_listener_started = False
+
+_root = logging.getLogger(ROOT_LOGGER)
+_root.setLevel(LOG_LEVEL)
+_root.addHandler(_queue_handler)
+# The Lambda runtime puts its own handler on the root logger.
+_root.propagate = False
+
+
+def _start_listener():
+    global _listener_started
+    with _listener_lock:
+        if not _listener_started:
+            _listener.start()
+            _listener_started = True
+            atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """
+    Returns a logger whose records are written as JSON lines by a
+    background thread; logging from the hot loop only costs a queue put.
+    """
+    _start_listener()
+    return _root.getChild(name)
+
+
+def flush(timeout=None):
+    """
+    Waits until queued records are written, at most timeout seconds
+    (LOG_FLUSH_TIMEOUT_SECONDS by default). Called before a handler returns,
+    since Lambda freezes the container and its threads right after.
+    """
+    if timeout is None:
+        timeout = LOG_FLUSH_TIMEOUT_SECONDS
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def get_dropped_count():
+    return _queue_handler.dropped
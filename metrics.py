@@ -0,0 +1,207 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+import log_utils
+
+# CloudWatch namespace of the per-invocation metrics record.
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "GlowupMRT")
+# Set to "0" to stop writing the metrics record to stdout.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+# Upper bounds (ms) of the latency histogram buckets; slower calls land in "+Inf".
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# CloudWatch accepts at most this many metrics per EMF directive.
+EMF_MAX_METRICS = 100
+
+_current = contextvars.ContextVar("metrics_invocation", default=None)
+
+
+class CallStats:
+    """Counters and latency histogram of one API endpoint or S3 operation."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.bytes = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, latency_ms, nbytes, error, throttled):
+        self.calls += 1
+        self.errors += bool(error)
+        self.throttled += bool(throttled)
+        self.bytes += nbytes
+        self.latency_ms_total += latency_ms
+        self.latency_ms_max = max(self.latency_ms_max, latency_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    def get_histogram(self):
+        labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"]
+        return {label: count for label, count in zip(labels, self.histogram) if count}
+
+
+class Invocation:
+    """
+    Metrics of one handler invocation: phase timers, counters, and call
+    stats per API endpoint ("api.<endpoint>") and S3 operation ("s3.<op>").
+    Safe to record into from several threads.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.started = time.time()
+        self.phases = {}
+        self.counters = Counter()
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record_call(self, name, seconds, nbytes=0, error=False, throttled=False):
+        with self.lock:
+            stats = self.calls.get(name)
+            if stats is None:
+                stats = self.calls[name] = CallStats()
+            stats.add(seconds * 1000, nbytes, error, throttled)
+
+    def to_emf(self):
+        """Returns the invocation as one CloudWatch Embedded Metric Format record."""
+        record = {"Handler": self.handler}
+        units = {}
+
+        def put(name, value, unit):
+            record[name] = value
+            units[name] = unit
+
+        with self.lock:
+            for name, seconds in self.phases.items():
+                put(f"phase.{name}", round(seconds * 1000, 3), "Milliseconds")
+            for name, value in self.counters.items():
+                put(name, value, "Count")
+            for name, stats in sorted(self.calls.items()):
+                put(f"{name}.calls", stats.calls, "Count")
+                put(f"{name}.errors", stats.errors, "Count")
+                if stats.throttled:
+                    put(f"{name}.throttled", stats.throttled, "Count")
+                put(f"{name}.bytes", stats.bytes, "Bytes")
+                put(f"{name}.latency_avg", round(stats.latency_ms_total / stats.calls, 3), "Milliseconds")
+                put(f"{name}.latency_max", round(stats.latency_ms_max, 3), "Milliseconds")
+                # Not a metric, but kept in the log record for Logs Insights.
+                record[f"{name}.latency_histogram_ms"] = stats.get_histogram()
+
+        metrics = [{"Name": name, "Unit": unit} for name, unit in units.items()]
+        record["_aws"] = {
+            "Timestamp": int(self.started * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Handler"]],
+                    "Metrics": metrics[i:i + EMF_MAX_METRICS]
+                }
+                for i in range(0, max(len(metrics), 1), EMF_MAX_METRICS)
+            ]
+        }
+        return record
+
+    def emit(self):
+        record = self.to_emf()
+        if METRICS_ENABLED:
+            print(json.dumps(record))
+        return record
+
+
+def get_invocation():
+    """Returns the Invocation being recorded in this context, or None."""
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Times a block into the current invocation; repeated phases add up."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation = _current.get()
+        if invocation is not None:
+            invocation.add_phase(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.count(name, value)
+
+
+def record_call(name, seconds, nbytes=0, error=False, throttled=False):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.record_call(name, seconds, nbytes, error, throttled)
+
+
+def bind(fn):
+    """
+    Wraps fn to record into the caller's invocation when it runs on another
+    thread (thread pools don't inherit the caller's context).
+    """
+    invocation = _current.get()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(invocation)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return run
+
+
+def instrumented(handler):
+    """
+    Decorates a Lambda handler so each call records into a fresh Invocation
+    and writes it to stdout as one EMF record when it returns or raises,
+    after the handler's queued log records.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            invocation = Invocation(handler)
+            token = _current.set(invocation)
+            dropped_before = log_utils.get_dropped_count()
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                invocation.count("errors")
+                raise
+            finally:
+                invocation.add_phase("total", time.perf_counter() - start)
+                _current.reset(token)
+                log_utils.flush()
+                dropped = log_utils.get_dropped_count() - dropped_before
+                if dropped:
+                    invocation.count("log.dropped", dropped)
+                invocation.emit()
+
+        return wrapper
+
+    return decorate
@@ -1,17 +1,27 @@
-import requests
+import api_utils
+import jitai_utils
+import metrics
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-import boto3
 import json
-from botocore.exceptions import ClientError
+from functools import lru_cache
 from dateutil import parser
 from s3_utils import *
+from schedule_index import index_scheduled_entry
 from zoneinfo import ZoneInfo
 from pytz import timezone as pytz_timezone
+from log_utils import get_logger
 
-BUCKET = "mrt-messages-logs"
+logger = get_logger("notifications")
+
+BUCKET = os.getenv("LOG_BUCKET", "mrt-messages-logs")
 SENT_LOG_KEY = "sent_log.json"
 
+# Number of TrackingCount updates sent in parallel.
+TRACKING_UPDATE_WORKERS = int(os.getenv("TRACKING_UPDATE_WORKERS", "8"))
+
 NOTIFICATION_BANK = {
     "control": ["control_00", "control_01", "control_02", "control_03", "control_04", "control_05", "control_06", "control_07", "control_08", "control_09", "control_10", "control_11", "control_12", "control_13", "control_14"],
     "dual_high": ["context_high_00", "context_high_01", "context_high_02", "context_high_03", "context_high_04", "context_high_05", "context_high_06", "context_high_07", "context_high_08", "context_high_09", "context_high_10", "context_high_11", "context_high_12", "context_high_13", "context_high_14"],
@@ -25,9 +35,33 @@ NOTIFICATION_BANK = {
     for key, ids in NOTIFICATION_BANK.items()
 }
 
+# Meal-tracking survey for each meal type
+# MEAL_TRACKING_SURVEYS = {
+#     "breakfast": "meal_tracking_breakfast",
+#     "lunch": "meal_tracking_lunch",
+#     "dinner": "meal_tracking_dinner"
+# }
+
+## IF ENGLISH
+MEAL_TRACKING_SURVEYS = {
+    "breakfast": "log_breakfast_en",
+    "lunch": "log_lunch_en",
+    "dinner": "log_dinner_en"
+}
+
+@lru_cache(maxsize=4096)
+def parse_send_window_start(start_str):
+    return parser.parse(start_str).time()
+
+
+@lru_cache(maxsize=1024)
+def get_send_timezone(tz_str):
+    return pytz_timezone(tz_str)
+
+
 def get_random_send_time(start_str, tz_str="Europe/Zurich"):
-    parsed_time = parser.parse(start_str).time()
-    tz = pytz_timezone(tz_str)
+    parsed_time = parse_send_window_start(start_str)
+    tz = get_send_timezone(tz_str)
     today = datetime.now(tz).date()
     start_dt = tz.localize(datetime.combine(today, parsed_time))
     end_dt = start_dt + timedelta(minutes=30)
@@ -44,52 +78,40 @@ def get_random_send_time(start_str, tz_str="Europe/Zurich"):
     return send_time_local.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
 
 
+# Notification log entries waiting to be written, keyed by log key.
+_notification_log_buffers = {}
+
+
 def log_notification_to_s3(record):
+    """
+    Buffers a notification log entry; flush_notification_log() writes the
+    run's entries as one new part of the day's log.
+    """
     date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     log_key = f"logs/{date_str}.json"
-    s3 = boto3.client('s3')
-    line = json.dumps(record) + "\n"
-    try:
-        obj = s3.get_object(Bucket=BUCKET, Key=log_key)
-        existing = obj['Body'].read().decode('utf-8')
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            existing = ""
-        else:
-            raise
-    updated = existing + line
-    s3.put_object(Body=updated.encode('utf-8'), Bucket=BUCKET, Key=log_key)
+    buffer = _notification_log_buffers.setdefault(log_key, LogBuffer(BUCKET, log_key))
+    buffer.append(record)
+
+
+def flush_notification_log():
+    for buffer in list(_notification_log_buffers.values()):
+        buffer.flush()
 
 
 def load_tracking_log(bucket, log_key):
-    s3 = boto3.client('s3')
-    try:
-        obj = s3.get_object(Bucket=bucket, Key=log_key)
-        log = obj['Body'].read().decode('utf-8').splitlines()
-        return [json.loads(line) for line in log]
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            return []
-        else:
-            raise
+    return list(iter_log_entries(bucket, log_key))
 
 
 def log_tracking_update(bucket, log_key, entry):
-    s3 = boto3.client('s3')
-    try:
-        obj = s3.get_object(Bucket=bucket, Key=log_key)
-        existing = obj['Body'].read().decode('utf-8')
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            existing = ""
-        else:
-            raise
-    updated = existing + json.dumps(entry) + "\n"
-    s3.put_object(Body=updated.encode('utf-8'), Bucket=bucket, Key=log_key)
+    log_tracking_updates(bucket, log_key, [entry])
+
+
+def log_tracking_updates(bucket, log_key, entries):
+    append_log_part(bucket, log_key, entries)
 
 
 def send_notifications(service_access_token, project_id, participant_context_data):
-    url = f"https://mydatahelps.org/api/v1/administration/projects/{project_id}/notifications"
+    url = f"{api_utils.base_url}/api/v1/administration/projects/{project_id}/notifications"
     headers = {
         "Authorization": f"Bearer {service_access_token}",
         "Content-Type": "application/json"
@@ -103,7 +125,7 @@ def send_notifications(service_access_token, project_id, participant_context_dat
         try:
             scheduled_time = datetime.fromisoformat(scheduled_time_str["send_time"].replace("Z", "+00:00")) if isinstance(scheduled_time_str, dict) else datetime.fromisoformat(scheduled_time_str.replace("Z", "+00:00"))
         except Exception as e:
-            print(f"Invalid time format for {key}: {scheduled_time_str} – {e}")
+            logger.warning("Invalid send time", extra={"key": key, "send_time": scheduled_time_str, "error": str(e)})
             continue
 
         if scheduled_time > now_utc:
@@ -115,7 +137,7 @@ def send_notifications(service_access_token, project_id, participant_context_dat
         context = participant_context_data.get(pid, {})
         group = context.get("group") or scheduled_log[key].get("group")
         if not group:
-            print(f"No group assignment found for {pid} – skipping")
+            logger.warning("No group assignment, skipping", extra={"pid": pid})
             continue
 
         notification_options = NOTIFICATION_BANK.get(group, [])
@@ -125,7 +147,7 @@ def send_notifications(service_access_token, project_id, participant_context_dat
                 # IF ENGLISH
                 notification_options = ["sync_reminder_en"]
             else:
-                print(f"No messages available for group '{group}' – skipping {key}")
+                logger.warning("No messages for group, skipping", extra={"key": key, "group": group})
                 continue
 
         notification_id = scheduled_log[key].get("notification_id") or random.choice(notification_options)
@@ -136,9 +158,9 @@ def send_notifications(service_access_token, project_id, participant_context_dat
             "sendTime": now_utc.isoformat() + "Z"
         }]
 
-        response = requests.post(url, headers=headers, json=payload)
+        response = api_utils.http_session.post(url, headers=headers, json=payload)
         if response.status_code == 200:
-            print(f"Sent '{notification_id}' to '{pid}' for {mealtime}")
+            logger.info("Sent notification", extra={"pid": pid, "mealtime": mealtime, "notification_id": notification_id})
             sent_log[key] = now_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
             log_record = {
                 "participant_id": pid,
@@ -151,11 +173,16 @@ def send_notifications(service_access_token, project_id, participant_context_dat
             }
             save_log(BUCKET, "sent_log.json", sent_log)
         else:
-            print(f"Failed to send to '{pid}' ({group}): {response.status_code} - {response.text}")
+            logger.error("Failed to send notification", extra={
+                "pid": pid, "group": group, "status": response.status_code, "error": response.text
+            })
 
 
-def schedule_sync_reminders(participant_context_data):
-    scheduled_log = load_log(BUCKET, "scheduled_log.json", dated=True)
+def schedule_sync_reminders(participant_context_data, state=None):
+    owns_state = state is None
+    if owns_state:
+        state = RunState(BUCKET)
+    scheduled_log = state.get("scheduled_log.json")
     now_utc = datetime.now(timezone.utc)
 
     for pid, context in participant_context_data.items():
@@ -169,19 +196,19 @@ def schedule_sync_reminders(participant_context_data):
             try:
                 # Ensure we always treat scheduled_log[key] as a dict
                 if not isinstance(existing_entry, dict) or "send_time" not in existing_entry:
-                    print(f"Malformed existing entry for {key}, skipping scheduling.")
+                    logger.warning("Malformed existing entry, skipping scheduling", extra={"key": key})
                     continue
 
                 last_time = datetime.fromisoformat(existing_entry["send_time"].replace("Z", "+00:00"))
 
                 if last_time > now_utc:
-                    print(f"{key} already scheduled in the future at {last_time} — skipping")
+                    logger.debug("Already scheduled in the future", extra={"pid": pid, "key": key, "send_time": last_time})
                     continue
                 elif (now_utc - last_time) < timedelta(hours=4):
-                    print(f"{key} was sent less than 4h ago at {last_time} — skipping")
+                    logger.debug("Sent less than 4h ago", extra={"pid": pid, "key": key, "send_time": last_time})
                     continue
             except Exception as e:
-                print(f"Error parsing send_time for {key}: {e}")
+                logger.warning("Invalid send time", extra={"key": key, "error": str(e)})
                 continue
 
         send_time = (now_utc + timedelta(minutes=random.randint(0, 10))).isoformat().replace("+00:00", "Z")
@@ -195,46 +222,52 @@ def schedule_sync_reminders(participant_context_data):
         # }
 
         # IF ENGLISH
-        scheduled_log[key] = {
+        state.set("scheduled_log.json", key, {
             "participant_id": pid,
             "mealtime": "NA",
             "group": "sync_reminder",
             "notification_id": "sync_reminder_en",
             "send_time": send_time
-        }
-        print(f"Scheduled sync_reminder for {pid} at {send_time}")
+        })
+        index_scheduled_entry(state, key, send_time)
+        logger.info("Scheduled sync reminder", extra={"pid": pid, "key": key, "send_time": send_time})
 
-    save_log(BUCKET, "scheduled_log.json", scheduled_log)
+    if owns_state:
+        state.save()
 
 
 
-def schedule_notifications(assignments, participant_context_data):
-    scheduled_log = load_log(BUCKET, "scheduled_log.json", dated=True)
+def schedule_notifications(assignments, participant_context_data, state=None):
+    owns_state = state is None
+    if owns_state:
+        state = RunState(BUCKET)
+    scheduled_log = state.get("scheduled_log.json")
     for pid, group in assignments.items():
-        print(participant_context_data[pid])
         tz_str = participant_context_data[pid].get("demographics", {}).get("timeZone")
-        print(f"[DEBUG] Timezone for scheduling for participant {pid}: {tz_str}")
-        
         participant_context_data[pid]["group"] = group
+        # Sampled and redacted; see log_utils.
+        logger.debug("Scheduling participant", extra={
+            "pid": pid, "timezone": tz_str, "context": participant_context_data[pid]
+        })
+
         mealtimes = participant_context_data.get(pid, {}).get("active_mealtimes", [])
         if not mealtimes:
-            print(f"{pid} has no active mealtime(s) – skipping scheduling.")
+            logger.debug("No active mealtime(s), skipping scheduling", extra={"pid": pid})
             continue
         custom_fields = participant_context_data[pid].get("custom_fields", {})
         for mealtime in mealtimes:
             key = f"{pid}::{mealtime}"
             if key in scheduled_log:
-                print(f"{key} already scheduled.")
+                logger.debug("Already scheduled", extra={"pid": pid, "key": key})
                 continue
             mealtime_value = custom_fields.get(mealtime)
             if not mealtime_value:
-                print(f"{key} missing mealtime value in custom fields — skipping.")
+                logger.warning("Missing mealtime value in custom fields, skipping", extra={"pid": pid, "key": key})
                 continue
             try:
                 send_time = get_random_send_time(mealtime_value, tz_str=tz_str)
-                print(f"[DEBUG] Scheduled time for participant {participant_context_data[pid]}: {send_time}")
             except Exception as e:
-                print(f"{key} invalid time format '{mealtime_value}' — {e}")
+                logger.warning("Invalid mealtime, skipping", extra={"pid": pid, "key": key, "error": str(e)})
                 continue
             tracking_count = participant_context_data[pid]['custom_fields'].get("TrackingCount")
             if not tracking_count:
@@ -254,18 +287,22 @@ def schedule_notifications(assignments, participant_context_data):
                     group = "dual_low"
             notification_options = NOTIFICATION_BANK.get(group, [])
             if not notification_options:
-                print(f"No notification for group '{group}' — skipping {key}")
+                logger.warning("No notification for group, skipping", extra={"key": key, "group": group})
                 continue
             notification_id = random.choice(notification_options)
-            scheduled_log[key] = {
+            state.set("scheduled_log.json", key, {
                 "participant_id": pid,
                 "mealtime": mealtime,
                 "group": group,
                 "notification_id": notification_id,
                 "send_time": send_time
-            }
-            print(f"Scheduled: {key} at {send_time} with '{notification_id}' ({group})")
-    save_log(BUCKET, "scheduled_log.json", scheduled_log)
+            })
+            index_scheduled_entry(state, key, send_time)
+            logger.info("Scheduled notification", extra={
+                "pid": pid, "key": key, "send_time": send_time, "notification_id": notification_id, "group": group
+            })
+    if owns_state:
+        state.save()
 
 def randomize(participant_context_data):
     """
@@ -287,46 +324,62 @@ def randomize(participant_context_data):
     return assignments
 
 
-def check_and_increment_tracking(base_url, project_id, access_token, bucket):
+def check_and_increment_tracking(base_url, project_id, access_token, bucket, participants=None):
+    """
+    Increments each participant's TrackingCount by the number of meal-tracking
+    surveys they completed today that are not in the tracking log yet.
+
+    Increments are summed per participant first, so each participant gets a
+    single update, and the updates are sent in parallel. Current counts are
+    fetched fresh with one paged participants query right before the
+    updates: roster objects may be cached for minutes, or held by another
+    container, and counts can be changed outside this code. Updated counts
+    are written back into `participants` (participant ID -> participant
+    object, e.g. the active roster), so the rest of the run sees them.
+    """
     url = f"{base_url}/api/v1/administration/projects/{project_id}/surveytasks"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Accept": "application/json"
     }
+    if participants is None:
+        participants = {}
 
-    params = {
-        "pageSize": 200  # Adjust as needed
-    }
+    # survey_names = {"meal_tracking_breakfast", "meal_tracking_lunch", "meal_tracking_dinner"}
 
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code != 200:
-        print(f"Failed to fetch survey tasks: {response.status_code}, {response.text}")
-        return
+    # IF ENGLISH
+    survey_names = {"log_breakfast_en", "log_lunch_en", "log_dinner_en"}
 
     today = datetime.now(timezone.utc).date()
 
-    print(f"[DEBUG] For task completion, today is {today}")
+    # Completing a task modifies it, so only tasks modified since the start of
+    # yesterday (UTC) can have been completed today, however long ago they were
+    # inserted. endDate is compared in its own offset, up to 14h ahead of UTC,
+    # hence the extra day. The query doesn't grow with the length of the study.
+    params = {
+        "pageSize": 200,
+        "status": "complete",
+        "surveyName": sorted(survey_names),
+        "modifiedAfter": datetime.combine(today - timedelta(days=1), datetime.min.time()).isoformat() + "Z"
+    }
 
-    # completed_tasks = [
-    #     t for t in response.json().get("surveyTasks", [])
-    #     if (
-    #         t.get("status", "").lower() == "complete" and
-    #         t.get("surveyName") in {"meal_tracking_breakfast", "meal_tracking_lunch", "meal_tracking_dinner"} and
-    #         t.get("endDate") and
-    #         parser.parse(t["endDate"]).date() == today
-    #     )
-    # ]
+    logger.debug("Counting meal-tracking completions", extra={"day": today})
 
-    # IF ENGLISH
-    completed_tasks = [
-        t for t in response.json().get("surveyTasks", [])
-        if (
-            t.get("status", "").lower() == "complete" and
-            t.get("surveyName") in {"log_breakfast_en", "log_lunch_en", "log_dinner_en"} and
-            t.get("endDate") and
-            parser.parse(t["endDate"]).date() == today
-        )
-    ]
+    completed_tasks = []
+    try:
+        for tasks in api_utils.iter_api_pages(access_token, url, params, "surveyTasks"):
+            completed_tasks.extend(
+                t for t in tasks
+                if (
+                    t.get("status", "").lower() == "complete" and
+                    t.get("surveyName") in survey_names and
+                    t.get("endDate") and
+                    parser.parse(t["endDate"]).date() == today
+                )
+            )
+    except Exception as e:
+        logger.error("Failed to fetch survey tasks", extra={"error": str(e)})
+        return
 
     today_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     log_key = f"logs/tracking_{today_str}.json"
@@ -336,13 +389,12 @@ def check_and_increment_tracking(base_url, project_id, access_token, bucket):
         for entry in log_entries
         if "completedDate" in entry
     )
-    # print(f"Completed tasks: {completed_tasks}")
-    # print(f"Already logged: {already_logged}")
 
+    new_completions = {}
     for task in completed_tasks:
         pid = task.get("participantIdentifier")
         survey_name = task.get("surveyName")
-        completed_time = task.get("endDate") or task.get("endDate")
+        completed_time = task.get("endDate")
 
         if not pid or not survey_name or not completed_time:
             continue
@@ -351,22 +403,38 @@ def check_and_increment_tracking(base_url, project_id, access_token, bucket):
 
         if (pid, survey_name, completion_day) in already_logged:
             continue
+        already_logged.add((pid, survey_name, completion_day))
 
-        # Fetch current custom field
-        participant_url = f"{base_url}/api/v1/administration/projects/{project_id}/participants/{pid}"
-        participant_resp = requests.get(participant_url, headers=headers)
-        if participant_resp.status_code != 200:
-            print(f"Failed to fetch participant {pid}: {participant_resp.status_code}")
-            continue
+        new_completions.setdefault(pid, []).append((survey_name, completion_day))
+
+    if not new_completions:
+        return
+
+    try:
+        current = jitai_utils.fetch_participants(project_id, access_token, new_completions)
+    except Exception as e:
+        # Without current counts, an increment could overwrite a newer value.
+        logger.error("Failed to fetch participants, TrackingCount not updated", extra={
+            "participants": len(new_completions), "error": str(e)
+        })
+        return
+
+    update_url = f"{base_url}/api/v1/administration/projects/{project_id}/participants"
+
+    def update(item):
+        pid, completions = item
+        participant_data = current.get(pid)
+        if participant_data is None:
+            logger.error("Participant not found, TrackingCount not updated", extra={"pid": pid})
+            return []
 
-        participant_data = participant_resp.json()
         current_val = participant_data.get("customFields", {}).get("TrackingCount", 0)
         try:
-            new_val = int(current_val) + 1
+            current_val = int(current_val)
         except:
-            new_val = 1
+            current_val = 0
+        new_val = current_val + len(completions)
 
-        update_url = f"{base_url}/api/v1/administration/projects/{project_id}/participants"
         update_payload = {
             "participantIdentifier": pid,
             "customFields": {
@@ -374,20 +442,80 @@ def check_and_increment_tracking(base_url, project_id, access_token, bucket):
             }
         }
 
-        update_resp = requests.put(update_url, headers=headers, json=update_payload)
-        if update_resp.status_code == 200:
-            print(f"Updated TrackingCount for {pid} to {new_val}")
-            log_tracking_update(bucket, log_key, {
-                "participantIdentifier": pid,
-                "surveyName": survey_name,
-                "completedDate": completion_day,
-                "newTrackingCount": new_val
+        try:
+            update_resp = api_utils.http_session.put(update_url, headers=headers, json=update_payload)
+        except Exception as e:
+            logger.error("Failed to update TrackingCount", extra={"pid": pid, "error": str(e)})
+            return []
+        if update_resp.status_code != 200:
+            logger.error("Failed to update TrackingCount", extra={
+                "pid": pid, "status": update_resp.status_code, "error": update_resp.text
             })
-        else:
-            print(f"Failed to update TrackingCount for {pid}: {update_resp.status_code}, {update_resp.text}")
+            return []
+
+        logger.info("Updated TrackingCount", extra={"pid": pid, "tracking_count": new_val})
+        if pid in participants:
+            participants[pid].setdefault("customFields", {})["TrackingCount"] = new_val
+        return [{
+            "participantIdentifier": pid,
+            "surveyName": survey_name,
+            "completedDate": completion_day,
+            "newTrackingCount": current_val + i
+        } for i, (survey_name, completion_day) in enumerate(completions, start=1)]
+
+    items = list(new_completions.items())
+    if TRACKING_UPDATE_WORKERS <= 1 or len(items) <= 1:
+        results = [update(item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=min(TRACKING_UPDATE_WORKERS, len(items))) as executor:
+            results = list(executor.map(metrics.bind(update), items))
+
+    new_log_entries = [entry for entries in results for entry in entries]
+    log_tracking_updates(bucket, log_key, new_log_entries)
+
 
+def build_survey_task_index(project_id, access_token):
+    """
+    Fetches today's meal-tracking survey tasks for the whole project in one
+    paged query and indexes them for has_incomplete_task_today.
 
-def has_incomplete_task_today(pid, mealtime, project_id, access_token):
+    Returns:
+        dict of (participant ID, survey name, UTC day 'YYYY-MM-DD') -> True if
+        any of those tasks is still incomplete, else False.
+    """
+    url = f"{api_utils.base_url}/api/v1/administration/projects/{project_id}/surveytasks"
+    today_utc = datetime.now(timezone.utc).date() # TODO adapt to participants' timezone
+    params = {
+        "pageSize": 100,
+        "surveyName": list(MEAL_TRACKING_SURVEYS.values()),
+        "insertedAfter": datetime.combine(today_utc, datetime.min.time()).isoformat() + "Z"
+    }
+
+    task_index = {}
+    for tasks in api_utils.iter_api_pages(access_token, url, params, "surveyTasks"):
+        for task in tasks:
+            pid = task.get("participantIdentifier")
+            inserted_str = task.get("insertedDate")
+            if not pid or not inserted_str:
+                continue
+
+            try:
+                inserted_dt = parser.parse(inserted_str).astimezone(timezone.utc)
+            except Exception:
+                continue
+
+            if inserted_dt.date() != today_utc:
+                continue
+
+            key = (pid, task.get("surveyName"), today_utc.isoformat())
+            is_incomplete = task.get("status", "").lower() == "incomplete"
+            task_index[key] = task_index.get(key, False) or is_incomplete
+
+    logger.info("Indexed meal-tracking tasks", extra={"tasks": len(task_index), "day": today_utc})
+    return task_index
+
+
+def has_incomplete_task_today(pid, mealtime, project_id, access_token, task_index=None):
 
     # Extract just the part indicating the meal type
     if mealtime and mealtime.startswith("mealtime_"):
@@ -396,25 +524,19 @@ def has_incomplete_task_today(pid, mealtime, project_id, access_token):
     else:
         mealtime_type = mealtime
 
-    # survey_map = {
-    #     "breakfast": "meal_tracking_breakfast",
-    #     "lunch": "meal_tracking_lunch",
-    #     "dinner": "meal_tracking_dinner"
-    # }
-
-    ## IF ENGLISH
-    survey_map = {
-        "breakfast": "log_breakfast_en",
-        "lunch": "log_lunch_en",
-        "dinner": "log_dinner_en"
-    }
+    survey_map = MEAL_TRACKING_SURVEYS
 
     if mealtime_type not in survey_map:
-        print(f"[WARN] Unknown or irrelevant mealtime '{mealtime}' for participant {pid} — skipping check")
+        logger.warning("Unknown mealtime, skipping task check", extra={"pid": pid, "mealtime": mealtime})
         return True  # Fallback: treat as incomplete to be safe
 
     survey_name = survey_map[mealtime_type]
-    url = f"https://mydatahelps.org/api/v1/administration/projects/{project_id}/surveytasks"
+
+    if task_index is not None:
+        today_str = datetime.now(timezone.utc).date().isoformat()
+        return task_index.get((pid, survey_name, today_str), False)
+
+    url = f"{api_utils.base_url}/api/v1/administration/projects/{project_id}/surveytasks"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Accept": "application/json"
@@ -424,15 +546,15 @@ def has_incomplete_task_today(pid, mealtime, project_id, access_token):
         "participantIdentifier": pid
     }
 
-    response = requests.get(url, headers=headers, params=params)
+    response = api_utils.http_session.get(url, headers=headers, params=params)
     if response.status_code != 200:
-        print(f"[ERROR] Failed to fetch tasks for {pid}: {response.status_code}")
+        logger.error("Failed to fetch survey tasks", extra={"pid": pid, "status": response.status_code})
         return True  # Fallback to 'incomplete'
 
     try:
         tasks = response.json().get("surveyTasks", [])
     except Exception as e:
-        print(f"[ERROR] Failed to parse surveyTasks for {pid}: {e}")
+        logger.error("Failed to parse survey tasks", extra={"pid": pid, "error": str(e)})
         return True
 
     today_utc = datetime.now(timezone.utc).date() # TODO adapt to participants' timezone
@@ -455,14 +577,16 @@ def has_incomplete_task_today(pid, mealtime, project_id, access_token):
 
         found_task = True
         task_status = task.get("status", "").lower()
-        print(f"[DEBUG] {pid} — found '{survey_name}' inserted at {inserted_dt.isoformat()} with status '{task_status}'")
+        logger.debug("Found survey task", extra={
+            "pid": pid, "survey": survey_name, "inserted": inserted_dt, "status": task_status
+        })
 
         if task_status == "incomplete":
             return True  # eligible to send
 
     if not found_task:
-        print(f"[DEBUG] No {survey_name} task found for {pid} today.")
+        logger.debug("No survey task today", extra={"pid": pid, "survey": survey_name})
     else:
-        print(f"[DEBUG] {pid} already completed {survey_name} today.")
+        logger.debug("Survey already completed today", extra={"pid": pid, "survey": survey_name})
 
     return False  # default: do not send
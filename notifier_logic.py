@@ -1,63 +1,185 @@
-import requests
 from datetime import datetime, timezone
 from notifications import *
 from api_utils import *
 from jitai_utils import *
+from schedule_index import *
+import metrics
+from log_utils import get_logger
 
-BUCKET = "mrt-messages-logs"
+logger = get_logger("notifier_logic")
 
+BUCKET = os.getenv("LOG_BUCKET", "mrt-messages-logs")
+
+# Max number of notifications sent in one POST to /notifications.
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "50"))
+
+# Statuses that reject the batch's content, so a smaller batch may pass.
+# Any other failure (401/403/404, 429, 5xx) would fail every half the same way.
+SPLIT_STATUSES = {400, 413, 422}
+
+
+def _record_failed(result):
+    if not isinstance(result, dict):
+        return False
+    if result.get("success") is False:
+        return True
+    return bool(result.get("error") or result.get("errors"))
+
+
+def post_notifications(url, headers, records):
+    """
+    POSTs the given (key, record) pairs as a single list payload.
+
+    Returns:
+        dict of key -> None if the notification was accepted, or an error
+        message. A batch rejected as invalid or too large (SPLIT_STATUSES) is
+        split in half and retried until the failing records are isolated, so
+        one bad record does not block the rest. Any other failure fails the
+        whole batch: auth and not-found errors would fail every half too, and
+        after throttling, 5xx responses or connection errors the server may
+        already have accepted it, so resending could notify participants twice.
+    """
+    payload = [{
+        "participantIdentifier": record["participant_id"],
+        "notificationIdentifier": record["notification_id"]
+    } for _, record in records]
+
+    try:
+        response = http_session.post(url, headers=headers, json=payload)
+    except Exception as e:
+        response = None
+        error = str(e)
+    else:
+        error = f"{response.status_code} - {response.text}"
+
+    if response is not None and response.status_code == 200:
+        try:
+            results = response.json()
+        except ValueError:
+            results = None
+        if not isinstance(results, list) or len(results) != len(records):
+            results = [None] * len(records)
+        return {
+            key: (f"rejected: {json.dumps(result)}" if _record_failed(result) else None)
+            for (key, _), result in zip(records, results)
+        }
+
+    if len(records) == 1:
+        return {records[0][0]: error}
+
+    # Splitting any other failure only multiplies requests, about 2N-1 for
+    # an expired token, and may resend accepted notifications; the batch
+    # stays pending instead.
+    if response is None or response.status_code not in SPLIT_STATUSES:
+        return {key: error for key, _ in records}
+
+    middle = len(records) // 2
+    outcome = post_notifications(url, headers, records[:middle])
+    outcome.update(post_notifications(url, headers, records[middle:]))
+    return outcome
+
+
+def dispatch_notifications(url, headers, records, batch_size=None):
+    """
+    Sends the due (key, record) pairs in chunks of batch_size.
+
+    Returns:
+        dict of key -> None on success or an error message on failure.
+    """
+    if batch_size is None:
+        batch_size = NOTIFICATION_BATCH_SIZE
+
+    outcome = {}
+    for i in range(0, len(records), batch_size):
+        chunk = records[i:i + batch_size]
+        logger.info("Sending notification batch", extra={"notifications": len(chunk)})
+        outcome.update(post_notifications(url, headers, chunk))
+    return outcome
+
+
+@metrics.instrumented("notifier")
 def lambda_handler(event=None, context=None):
-    print("Running notifier...")
+    logger.info("Running notifier")
 
-    scheduled_log = load_log(BUCKET, "scheduled_log.json", dated=True)
-    sent_log = load_log(BUCKET, "sent_log.json", dated=True)
+    state = RunState(BUCKET)
+    with metrics.phase("load"):
+        scheduled_log = state.get("scheduled_log.json")
+        sent_log = state.get("sent_log.json")
     now_utc = datetime.now(timezone.utc)
 
-    print(f"project_id: {project_id}")
-    access_token = get_service_access_token()
+    logger.debug("Project", extra={"project_id": project_id})
+    with metrics.phase("token"):
+        access_token = get_service_access_token()
 
-    url = f"https://mydatahelps.org/api/v1/administration/projects/{project_id}/notifications"
+    url = f"{base_url}/api/v1/administration/projects/{project_id}/notifications"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
     }
 
     if not scheduled_log:
-        print("No notifications scheduled for today.")
+        logger.info("No notifications scheduled for today")
         return
 
+    now_epoch = now_utc.timestamp()
+    with metrics.phase("load"):
+        index = get_schedule_index(state, scheduled_log)
+
+        # Only entries due since the last run (plus earlier failures) are visited.
+        cursor_state = state.get(NOTIFIER_CURSOR_LOG)
+    pending = dict(cursor_state.get("pending", {}))
+    candidate_keys = list(pending) + [
+        key for key in get_due_keys(index, cursor_state.get("cursor"), now_epoch)
+        if key not in pending
+    ]
+
     total = len(scheduled_log)
-    future_count = 0
-    already_sent_count = 0
+    future_count = count_future_entries(index, now_epoch)
+    already_sent_count = len(sent_log)
     sent_now_count = 0
+    due_records = []
+    task_index = None
+    task_prefetch_failed = False
+
+    for key in candidate_keys:
+        record = scheduled_log.get(key)
+        if not isinstance(record, dict) or key in sent_log:
+            pending.pop(key, None)
+            continue
 
-    for key, record in scheduled_log.items():
         pid = record["participant_id"]
         mealtime = record["mealtime"]
         group = record["group"]
         notification_id = record["notification_id"]
         scheduled_time_str = record["send_time"]
 
-        if key in sent_log:
-            already_sent_count += 1
-            continue
-
         try:
             scheduled_time = datetime.fromisoformat(scheduled_time_str.replace("Z", "+00:00"))
         except Exception as e:
-            print(f"Invalid timestamp for {key}: {scheduled_time_str} – {e}")
+            logger.warning("Invalid send time", extra={"key": key, "send_time": scheduled_time_str, "error": str(e)})
+            pending.pop(key, None)
             continue
 
         if scheduled_time > now_utc:
-            future_count += 1
+            # Rescheduled to a later time; its new bucket will pick it up.
+            pending.pop(key, None)
             continue
 
-        has_incomplete_tasks = has_incomplete_task_today(pid, mealtime, project_id, access_token)
-        print(f"Key: {key}")
-        print(f"Has incomplete: {has_incomplete_tasks}")
+        with metrics.phase("tasks"):
+            if task_index is None and not task_prefetch_failed:
+                try:
+                    task_index = build_survey_task_index(project_id, access_token)
+                except Exception as e:
+                    logger.warning("Failed to prefetch survey tasks, checking per participant", extra={"error": str(e)})
+                    task_prefetch_failed = True
+
+            has_incomplete_tasks = has_incomplete_task_today(
+                pid, mealtime, project_id, access_token, task_index=task_index
+            )
+        logger.debug("Checked survey task", extra={"pid": pid, "key": key, "has_incomplete": has_incomplete_tasks})
 
         if not has_incomplete_tasks:
-            print(f"{pid} already completed {mealtime} today. Skipping notification.")
+            logger.info("Meal already tracked today, skipping notification", extra={"pid": pid, "key": key})
             log_entry = {
                 "participant_id": pid,
                 "group": group,
@@ -67,54 +189,74 @@ def lambda_handler(event=None, context=None):
                 "actual_send_time": None,
                 "skipped_due_to_completion": True
             }
-            sent_log[key] = log_entry
+            state.set("sent_log.json", key, log_entry)
+            pending.pop(key, None)
+            metrics.count("notifications.skipped_completed")
             continue
 
-        # Time to send
-        payload = [{
-            "participantIdentifier": pid,
-            "notificationIdentifier": notification_id
-            }]
+        due_records.append((key, record))
+
+    # Time to send
+    metrics.count("notifications.due", len(due_records))
+    with metrics.phase("send"):
+        outcome = dispatch_notifications(url, headers, due_records)
 
-        print(f"Sending payload: {json.dumps(payload, indent=2)}")
-        response = requests.post(url, headers=headers, json=payload)
+    for key, record in due_records:
+        pid = record["participant_id"]
+        group = record["group"]
+        mealtime = record["mealtime"]
+        notification_id = record["notification_id"]
+        error = outcome.get(key, "not sent")
 
-        if response.status_code == 200:
-            print(f"Sent {notification_id} to {pid} ({group}) [{mealtime}]")
+        if error is None:
+            logger.info("Sent notification", extra={
+                "pid": pid, "key": key, "notification_id": notification_id, "group": group
+            })
 
             log_entry = {
                 "participant_id": pid,
                 "group": group,
                 "mealtime": mealtime,
                 "notification_id": notification_id,
-                "scheduled_time": scheduled_time_str,
+                "scheduled_time": record["send_time"],
                 "actual_send_time": now_utc.isoformat() + "Z",
                 "skipped_due_to_completion": False
             }
 
-            sent_log[key] = log_entry
+            state.set("sent_log.json", key, log_entry)
             # log_notification_to_s3(log_entry)
             sent_now_count += 1
+            pending.pop(key, None)
 
         else:
-            print(f"Failed to send to {pid}: {response.status_code} - {response.text}")
+            # Left out of sent_log and kept pending so the next run retries it.
+            logger.warning("Failed to send notification", extra={"pid": pid, "key": key, "error": error})
+            pending[key] = parse_send_time(record["send_time"])
+
+    metrics.count("notifications.sent", sent_now_count)
+    metrics.count("notifications.failed", len(due_records) - sent_now_count)
 
-    save_log(BUCKET, "sent_log.json", sent_log)
+    state.set(NOTIFIER_CURSOR_LOG, "cursor", now_epoch)
+    state.set(NOTIFIER_CURSOR_LOG, "pending", pending)
+    with metrics.phase("save"):
+        state.save()
+        flush_notification_log()
 
     # Final summary
-    print("Notifier run complete.")
-    print(f"Total scheduled entries: {total}")
-    print(f"Already sent: {already_sent_count}")
-    print(f"Scheduled for future: {future_count}")
-    print(f"Sent now: {sent_now_count}")
+    logger.info("Notifier run complete", extra={
+        "scheduled": total,
+        "already_sent": already_sent_count,
+        "future": future_count,
+        "sent_now": sent_now_count
+    })
 
     if sent_now_count == 0:
         if already_sent_count == total:
-            print("All notifications already sent.")
+            logger.info("All notifications already sent")
         elif future_count == total:
-            print("All scheduled notifications are for the future.")
+            logger.info("All scheduled notifications are for the future")
         else:
-            print("No eligible notifications to send at this time.")
+            logger.info("No eligible notifications to send at this time")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,242 @@
+import os
+from datetime import datetime, timedelta, timezone
+import api_utils
+import step_columns
+from api_utils import safe_parse_iso
+
+
+def type_equals(value):
+    return lambda dp_type: dp_type == value
+
+
+def type_equals_ignore_case(value):
+    return lambda dp_type: dp_type.lower() == value.lower()
+
+
+def type_contains(fragment):
+    return lambda dp_type: fragment in dp_type.lower()
+
+
+def parse_iso_strict(start_date_str):
+    # Parse the start date and convert to UTC-aware datetime
+    return datetime.fromisoformat(start_date_str.replace("Z", "+00:00"))
+
+
+def get_default_observed_after():
+    return (datetime.utcnow() - timedelta(hours=24)).replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class DeviceProvider:
+    """
+    One MyDataHelps device data namespace. Everything that differs between
+    namespaces is declared here; fetching, paging, parsing and aggregating
+    are shared.
+
+    Args:
+        namespace: the devicedatapoints namespace, e.g. "Fitbit".
+        api_version: "v1" or "v2".
+        steps_type: the server-side type filter for Steps points.
+        is_steps: predicate on a point's type for Steps points.
+        is_sleep: predicate on a point's type for sleep points.
+        parse_start_date: parser for timestamps off the step_columns fast path.
+    """
+
+    def __init__(self, namespace, api_version, steps_type, is_steps, is_sleep, parse_start_date=safe_parse_iso):
+        self.namespace = namespace
+        self.api_version = api_version
+        self.steps_type = steps_type
+        self.is_steps = is_steps
+        self.is_sleep = is_sleep
+        self.parse_start_date = parse_start_date
+
+    def __repr__(self):
+        return f"DeviceProvider({self.namespace!r})"
+
+    def get_url(self, project_id, base_url):
+        return f"{base_url}/api/{self.api_version}/administration/projects/{project_id}/devicedatapoints"
+
+    def get_point_kind(self, dp):
+        """Returns "steps", "sleep" or None for one data point."""
+        dp_type = dp.get("type", "")
+        if self.is_steps(dp_type):
+            return "steps"
+        if self.is_sleep(dp_type):
+            return "sleep"
+        return None
+
+    def iter_device_data(self, service_access_token, project_id, participant_identifier, base_url,
+                         observed_after=None, point_type=None):
+        """
+        Yields the participant's points of the last 24h (or observed after
+        observed_after) one at a time, holding at most one page in memory.
+        """
+        params = {
+            "namespace": self.namespace,
+            "participantIdentifier": participant_identifier,
+            "observedAfter": observed_after or get_default_observed_after()
+        }
+        if point_type:
+            params["type"] = point_type
+
+        url = self.get_url(project_id, base_url)
+        for page in api_utils.iter_api_pages(service_access_token, url, params, "deviceDataPoints"):
+            yield from page
+
+    def iter_device_data_bulk(self, service_access_token, project_id, participant_identifiers, base_url, chunk_size=100):
+        """
+        Yields the last 24h of points for many participants, with one paged
+        query per chunk of participant identifiers (or for the whole project
+        if participant_identifiers is None).
+        """
+        observed_after = get_default_observed_after()
+
+        if participant_identifiers is None:
+            chunks = [None]
+        else:
+            participant_identifiers = list(participant_identifiers)
+            chunks = [participant_identifiers[i:i + chunk_size] for i in range(0, len(participant_identifiers), chunk_size)]
+
+        url = self.get_url(project_id, base_url)
+        for chunk in chunks:
+            params = {
+                "namespace": self.namespace,
+                "observedAfter": observed_after
+            }
+            if chunk is not None:
+                params["participantIdentifier"] = chunk
+
+            for page in api_utils.iter_api_pages(service_access_token, url, params, "deviceDataPoints"):
+                yield from page
+
+    def get_steps(self, service_access_token, project_id, participant_identifier, base_url):
+        return list(self.iter_device_data(
+            service_access_token, project_id, participant_identifier, base_url, point_type=self.steps_type
+        ))
+
+    def get_sleep(self, service_access_token, project_id, participant_identifier, base_url):
+        return [
+            dp for dp in self.iter_device_data(service_access_token, project_id, participant_identifier, base_url)
+            if self.is_sleep(dp.get("type", ""))
+        ]
+
+    def get_device_data(self, service_access_token, project_id, participant_identifier, base_url, observed_after=None):
+        """
+        Downloads the last 24h (or everything observed after observed_after)
+        once and splits it locally.
+
+        Returns:
+            (steps_data, sleep_data), the same points get_steps and get_sleep return.
+        """
+        steps_data = []
+        sleep_data = []
+        for dp in self.iter_device_data(service_access_token, project_id, participant_identifier, base_url, observed_after):
+            kind = self.get_point_kind(dp)
+            if kind == "steps":
+                steps_data.append(dp)
+            elif kind == "sleep":
+                sleep_data.append(dp)
+
+        return steps_data, sleep_data
+
+    def get_device_data_bulk(self, service_access_token, project_id, participant_identifiers, base_url, chunk_size=100):
+        """
+        Downloads the last 24h of data for many participants and groups it by
+        participantIdentifier.
+
+        Returns:
+            dict of participant ID -> (steps_data, sleep_data); every requested
+            participant is present, with empty lists if no data came back.
+        """
+        if participant_identifiers is None:
+            device_data = {}
+        else:
+            participant_identifiers = list(participant_identifiers)
+            device_data = {pid: ([], []) for pid in participant_identifiers}
+
+        for dp in self.iter_device_data_bulk(service_access_token, project_id, participant_identifiers, base_url, chunk_size):
+            pid = dp.get("participantIdentifier")
+            if participant_identifiers is None:
+                steps_data, sleep_data = device_data.setdefault(pid, ([], []))
+            elif pid in device_data:
+                steps_data, sleep_data = device_data[pid]
+            else:
+                continue
+
+            kind = self.get_point_kind(dp)
+            if kind == "steps":
+                steps_data.append(dp)
+            elif kind == "sleep":
+                sleep_data.append(dp)
+
+        return device_data
+
+    def aggregate_steps_by_source(self, data_points):
+        today = datetime.now(timezone.utc).date()
+        return step_columns.aggregate_steps(
+            (dp for dp in data_points if self.is_steps(dp.get("type", ""))), today, self.parse_start_date
+        )
+
+
+PROVIDERS = {
+    "AppleHealth": DeviceProvider(
+        "AppleHealth", "v1", steps_type="Steps",
+        is_steps=type_equals("Steps"),
+        is_sleep=type_equals("Sleep Analysis"),
+        parse_start_date=parse_iso_strict
+    ),
+    "Fitbit": DeviceProvider(
+        "Fitbit", "v1", steps_type="Steps",
+        is_steps=type_equals("Steps"),
+        is_sleep=type_contains("sleep")
+    ),
+    "GoogleFit": DeviceProvider(
+        "GoogleFit", "v1", steps_type="Steps",
+        is_steps=type_equals_ignore_case("steps"),
+        is_sleep=type_contains("sleep")
+    ),
+    "HealthConnect": DeviceProvider(
+        "HealthConnect", "v2", steps_type="Steps",
+        is_steps=type_equals_ignore_case("steps"),
+        is_sleep=type_contains("sleep")
+    ),
+}
+
+# Namespaces read for each participant segment, in order of preference.
+# GoogleFit (/api/v1) and HealthConnect (/api/v2) can't share a request.
+PLATFORM_NAMESPACES = {
+    "iOS": ["AppleHealth"],
+    "Android": ["HealthConnect", "GoogleFit"],
+    "Fitbit": ["Fitbit"],
+}
+
+# "fallback" reads a platform's namespaces in order and stops at the first
+# one with data, so an Android participant normally costs one request;
+# "merge" reads every namespace (one request each) and merges the results.
+DEVICE_NAMESPACE_MODE = os.getenv("DEVICE_NAMESPACE_MODE", "fallback")
+
+
+def get_platform_providers(platform):
+    return [PROVIDERS[namespace] for namespace in PLATFORM_NAMESPACES.get(platform, [])]
+
+
+def has_device_data(summary):
+    """True if a (daily_steps, sleep_data) summary holds any steps or sleep."""
+    daily_steps, sleep_data = summary
+    return bool(daily_steps) or bool(sleep_data)
+
+
+def merge_device_summaries(summaries):
+    """
+    Combines the (daily_steps, sleep_data) of several namespaces for one
+    participant. Phones often mirror the same data into both Android
+    namespaces, so a source's steps are the larger of the two counts rather
+    than their sum, and sleep comes from the namespace reporting the most.
+    """
+    daily_steps = {}
+    sleep_data = []
+    for steps, sleep in summaries:
+        for source, total in steps.items():
+            daily_steps[source] = max(daily_steps.get(source, 0), total)
+        if sum(s.get("duration", 0) for s in sleep) > sum(s.get("duration", 0) for s in sleep_data):
+            sleep_data = sleep
+    return daily_steps, sleep_data
@@ -0,0 +1,244 @@
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+import metrics
+from log_utils import get_logger
+
+logger = get_logger("rate_limit")
+
+# Default request budget per endpoint (requests/second) and burst size.
+API_RATE_PER_SECOND = float(os.getenv("API_RATE_PER_SECOND", "10"))
+API_RATE_BURST = int(os.getenv("API_RATE_BURST", "20"))
+# Per-endpoint overrides, e.g. "devicedatapoints=20,notifications=5".
+API_RATE_LIMITS = os.getenv("API_RATE_LIMITS", "")
+# Upper bound on requests in flight per endpoint; halved on every throttle
+# and grown back by one after a run of successes.
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "16"))
+
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "4"))
+API_BACKOFF_BASE_SECONDS = float(os.getenv("API_BACKOFF_BASE_SECONDS", "0.5"))
+API_BACKOFF_MAX_SECONDS = float(os.getenv("API_BACKOFF_MAX_SECONDS", "30"))
+# A Retry-After longer than this is cut short, so one throttle can't eat the
+# whole Lambda timeout.
+API_RETRY_AFTER_MAX_SECONDS = float(os.getenv("API_RETRY_AFTER_MAX_SECONDS", "60"))
+
+THROTTLE_STATUSES = (429, 503)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+def parse_rate_limits(spec):
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            endpoint, rate = part.split("=", 1)
+            limits[endpoint.strip()] = float(rate)
+    return limits
+
+
+def get_endpoint(url):
+    """Groups URLs by API resource, e.g. "devicedatapoints" or "token"."""
+    path = urlsplit(url).path
+    match = re.search(r"/projects/[^/]+/([^/]+)", path)
+    if match:
+        return match.group(1).lower()
+    if path.endswith("/connect/token"):
+        return "token"
+    return "default"
+
+
+def get_retry_after(response):
+    """Returns the Retry-After header in seconds, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def get_backoff(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(API_BACKOFF_MAX_SECONDS, API_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EndpointLimiter:
+    """
+    Request budget for one endpoint: a token bucket for the rate, plus an
+    AIMD concurrency limit that halves on 429/503 and grows back by one
+    after as many successes as the current limit. A Retry-After pauses the
+    whole endpoint, not just the request that got it.
+    """
+
+    def __init__(self, rate, burst, max_concurrency):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "errors": 0}
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= self.limit:
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            self.stats["requests"] += 1
+        self.bucket.acquire()
+
+    def count(self, stat):
+        with self.condition:
+            self.stats[stat] += 1
+
+    def release(self, throttled=False, retry_after=None, failed=False):
+        """
+        Gives the slot back. A throttled request shrinks the limit; a failed
+        one (an exception or a 5xx) only frees the slot, without counting
+        towards growing it back.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.stats["throttled"] += 1
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif not failed:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+class RateLimitedSession(requests.Session):
+    """
+    requests.Session that spends each request against its endpoint's
+    budget and retries throttled and failed requests.
+
+    429 is retried for every method, since the request was not processed.
+    Other 5xx responses and connection errors are only retried for
+    idempotent methods, so a notification is never sent twice.
+    """
+
+    def __init__(self, rate=API_RATE_PER_SECOND, burst=API_RATE_BURST, rate_limits=None,
+                 max_concurrency=API_MAX_CONCURRENCY, max_retries=API_MAX_RETRIES):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.rate_limits = parse_rate_limits(API_RATE_LIMITS) if rate_limits is None else rate_limits
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+
+    def get_limiter(self, endpoint):
+        with self.limiters_lock:
+            limiter = self.limiters.get(endpoint)
+            if limiter is None:
+                rate = self.rate_limits.get(endpoint, self.rate)
+                limiter = self.limiters[endpoint] = EndpointLimiter(
+                    rate, max(self.burst, int(rate)), self.max_concurrency
+                )
+            return limiter
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = self.get_limiter(get_endpoint(url))
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        metric_name = f"api.{get_endpoint(url)}"
+        attempt = 0
+        while True:
+            limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                nbytes = int(response.headers.get("Content-Length") or 0) if kwargs.get("stream") else len(response.content)
+            except Exception as e:
+                # Any failure must give the slot back: the session outlives the
+                # invocation, and a leaked slot can block the endpoint for good.
+                metrics.record_call(metric_name, time.perf_counter() - start, error=True)
+                limiter.release(failed=True)
+                retryable = idempotent and isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if not retryable or attempt >= self.max_retries:
+                    limiter.count("errors")
+                    raise
+                delay = get_backoff(attempt)
+            else:
+                status = response.status_code
+                throttled = status in THROTTLE_STATUSES
+                metrics.record_call(
+                    metric_name, time.perf_counter() - start, nbytes, error=status >= 400, throttled=throttled
+                )
+                retry_after = get_retry_after(response) if throttled else None
+                if retry_after is not None:
+                    retry_after = min(retry_after, API_RETRY_AFTER_MAX_SECONDS)
+                limiter.release(throttled, retry_after, failed=status >= 500)
+
+                retryable = status == 429 or (status in RETRY_STATUSES and idempotent)
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                delay = retry_after if retry_after is not None else get_backoff(attempt)
+                response.close()
+
+            attempt += 1
+            limiter.count("retries")
+            metrics.count(f"{metric_name}.retries")
+            logger.info("Retrying request", extra={
+                "method": method, "endpoint": get_endpoint(url), "delay": round(delay, 1),
+                "attempt": attempt, "max_retries": self.max_retries
+            })
+            time.sleep(delay)
+
+    def get_stats(self):
+        """Returns {endpoint: {"requests", "throttled", "retries", "errors", "concurrency"}}."""
+        with self.limiters_lock:
+            limiters = dict(self.limiters)
+        stats = {}
+        for endpoint, limiter in limiters.items():
+            with limiter.condition:
+                stats[endpoint] = dict(limiter.stats, concurrency=limiter.limit)
+        return stats
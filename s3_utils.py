@@ -1,7 +1,11 @@
 from datetime import datetime, timezone
-import boto3
+from uuid import uuid4
+import threading
 import json
-from botocore.exceptions import ClientError
+from storage import get_storage, PreconditionFailed
+from log_utils import get_logger
+
+logger = get_logger("s3_utils")
 
 def get_month_folder():
     return datetime.now(timezone.utc).strftime("%Y_%m_notification_logs")
@@ -10,27 +14,184 @@ def get_dated_filename(base_name):  # e.g., "scheduled_log.json"
     date_prefix = datetime.now(timezone.utc).strftime("%Y_%m_%d")
     return f"{date_prefix}_{base_name}"
 
-def load_log(bucket, base_filename, dated=True):
+# Number of times a conditional write is retried after losing a race.
+SAVE_RETRIES = 5
+
+def get_log_key(base_filename, dated=True):
     folder = get_month_folder()
     filename = get_dated_filename(base_filename) if dated else base_filename
-    key = f"{folder}/{filename}"
-
-    s3 = boto3.client('s3')
-    try:
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        return json.loads(obj['Body'].read())
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            print(f"No log found at {key}")
-            return {}
-        else:
-            raise
+    return f"{folder}/{filename}"
+
+def load_log_with_etag(bucket, key):
+    body, etag = get_storage(bucket).get(key)
+    if body is None:
+        logger.debug("No log found", extra={"key": key})
+        return {}, None
+    return json.loads(body), etag
+
+def load_log(bucket, base_filename, dated=True):
+    log_data, _ = load_log_with_etag(bucket, get_log_key(base_filename, dated))
+    return log_data
 
 def save_log(bucket, base_filename, log_data, dated=True):
-    folder = get_month_folder()
-    filename = get_dated_filename(base_filename) if dated else base_filename
-    key = f"{folder}/{filename}"
+    key = get_log_key(base_filename, dated)
+    get_storage(bucket).put(key, json.dumps(log_data).encode('utf-8'))
+
+def _copy_entry(value):
+    return dict(value) if isinstance(value, dict) else value
+
+class RunState:
+    """
+    Run-scoped view of the dated JSON logs (scheduled_log, sent_log, ...).
+
+    Each log is loaded at most once per run. Entries changed through set()
+    are remembered, and save() writes each changed log once with a
+    conditional put (If-Match on the loaded ETag, or If-None-Match for a new
+    object). If another invocation wrote the log in between, the latest copy is
+    re-read, this run's changed entries are applied on top and the write is
+    retried. Dict entries are merged one level deep: only the fields this run
+    added, changed or removed since loading are applied, so set() a new dict
+    rather than the loaded one changed in place.
+    """
+
+    def __init__(self, bucket, dated=True):
+        self.bucket = bucket
+        self.dated = dated
+        self.keys = {}
+        self.logs = {}
+        self.etags = {}
+        self.dirty = {}
+        # base filename -> {entry key: value as loaded, before this run's set()}
+        self.originals = {}
+        self.lock = threading.Lock()
+
+    def get(self, base_filename):
+        with self.lock:
+            if base_filename not in self.logs:
+                key = get_log_key(base_filename, self.dated)
+                self.keys[base_filename] = key
+                self.logs[base_filename], self.etags[base_filename] = load_log_with_etag(self.bucket, key)
+                self.dirty[base_filename] = set()
+                self.originals[base_filename] = {}
+            return self.logs[base_filename]
+
+    def set(self, base_filename, entry_key, value):
+        log_data = self.get(base_filename)
+        with self.lock:
+            if entry_key not in self.dirty[base_filename]:
+                self.originals[base_filename][entry_key] = _copy_entry(log_data.get(entry_key))
+            log_data[entry_key] = value
+            self.dirty[base_filename].add(entry_key)
+
+    def save(self):
+        for base_filename in list(self.logs):
+            self._save_log(base_filename)
+
+    def _save_log(self, base_filename):
+        with self.lock:
+            dirty = self.dirty.get(base_filename)
+            if not dirty:
+                return
+            key = self.keys[base_filename]
+            storage = get_storage(self.bucket)
+
+            for attempt in range(SAVE_RETRIES + 1):
+                etag = self.etags[base_filename]
+                try:
+                    new_etag = storage.put(
+                        key, json.dumps(self.logs[base_filename]).encode('utf-8'),
+                        if_match=etag, if_none_match=etag is None
+                    )
+                except PreconditionFailed:
+                    if attempt == SAVE_RETRIES:
+                        raise
+                    logger.info("Log changed since it was loaded, merging and retrying", extra={
+                        "key": key, "entries": len(dirty), "attempt": attempt + 1
+                    })
+                    latest, etag = load_log_with_etag(self.bucket, key)
+                    originals = self.originals[base_filename]
+                    for entry_key in dirty:
+                        value = self.logs[base_filename][entry_key]
+                        current = latest.get(entry_key)
+                        original = originals.get(entry_key)
+                        originals[entry_key] = _copy_entry(current)
+                        if isinstance(value, dict) and isinstance(current, dict):
+                            # Dict entries (e.g. index buckets) are merged field by field.
+                            # Fields this run removed (e.g. a sent key dropped from the
+                            # notifier's "pending") must not come back from the other copy.
+                            original = original if isinstance(original, dict) else {}
+                            merged = dict(current)
+                            for field, item in value.items():
+                                if field not in original or original[field] != item:
+                                    merged[field] = item
+                            for field in original.keys() - value.keys():
+                                merged.pop(field, None)
+                            latest[entry_key] = merged
+                        else:
+                            latest[entry_key] = value
+                    self.logs[base_filename].clear()
+                    self.logs[base_filename].update(latest)
+                    self.etags[base_filename] = etag
+                    continue
+
+                self.etags[base_filename] = new_etag
+                dirty.clear()
+                self.originals[base_filename].clear()
+                return
+
+
+def get_log_parts_prefix(log_key):  # e.g., "logs/tracking_2025_01_01.json" -> "logs/tracking_2025_01_01/"
+    base = log_key[:-len(".json")] if log_key.endswith(".json") else log_key
+    return f"{base}/"
+
+def append_log_part(bucket, log_key, entries):
+    """
+    Writes entries as a new JSONL part object under the log's parts prefix
+    instead of rewriting the whole log. Part keys sort in write order.
+
+    Returns:
+        the key of the new part, or None if there was nothing to write.
+    """
+    if not entries:
+        return None
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    key = f"{get_log_parts_prefix(log_key)}part-{timestamp}-{uuid4().hex[:8]}.jsonl"
+    body = "".join(json.dumps(entry) + "\n" for entry in entries)
+
+    get_storage(bucket).put(key, body.encode('utf-8'))
+    return key
+
+def iter_log_entries(bucket, log_key):
+    """
+    Streams the entries of an append-only log: first the legacy single
+    object at log_key (if any), then every part in write order. Parts are
+    never rewritten, so a cached part is read without a request.
+    """
+    storage = get_storage(bucket)
+    keys = [(log_key, False)] + [(key, True) for key in storage.list_keys(get_log_parts_prefix(log_key))]
+
+    for key, immutable in keys:
+        for line in storage.iter_lines(key, immutable):
+            if line.strip():
+                yield json.loads(line)
+
+class LogBuffer:
+    """
+    Collects log entries in memory and writes them as one part per flush().
+    Safe to append to from several threads.
+    """
+
+    def __init__(self, bucket, log_key):
+        self.bucket = bucket
+        self.log_key = log_key
+        self.entries = []
+        self.lock = threading.Lock()
 
-    s3 = boto3.client('s3')
-    s3.put_object(Body=json.dumps(log_data), Bucket=bucket, Key=key)
+    def append(self, entry):
+        with self.lock:
+            self.entries.append(entry)
 
+    def flush(self):
+        with self.lock:
+            entries, self.entries = self.entries, []
+        return append_log_part(self.bucket, self.log_key, entries)
@@ -0,0 +1,99 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+SCHEDULE_INDEX_LOG = "schedule_index.json"
+NOTIFIER_CURSOR_LOG = "notifier_cursor.json"
+
+# The notifier re-checks entries due this many seconds before its cursor, so an
+# entry written by a long-running scheduler tick after the notifier already
+# moved past its send_time is still picked up.
+SCHEDULE_LOOKBACK_SECONDS = int(os.getenv("SCHEDULE_LOOKBACK_SECONDS", "900"))
+
+
+def parse_send_time(send_time_str):
+    try:
+        return datetime.fromisoformat(send_time_str.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+
+def get_hour_bucket(epoch):  # e.g., "2025-01-01T13"
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H")
+
+
+def index_scheduled_entry(state, key, send_time_str):
+    """
+    Adds a scheduled_log entry to the day's send-time index, which buckets
+    entries by UTC hour: {"YYYY-MM-DDTHH": {entry key: send epoch}}.
+    """
+    epoch = parse_send_time(send_time_str)
+    if epoch is None:
+        return
+    bucket_key = get_hour_bucket(epoch)
+    bucket = dict(state.get(SCHEDULE_INDEX_LOG).get(bucket_key, {}))
+    bucket[key] = epoch
+    state.set(SCHEDULE_INDEX_LOG, bucket_key, bucket)
+
+
+def build_schedule_index(scheduled_log):
+    """Builds the index in memory for a scheduled_log written without one."""
+    index = {}
+    for key, record in scheduled_log.items():
+        epoch = parse_send_time(record.get("send_time", "")) if isinstance(record, dict) else None
+        if epoch is not None:
+            index.setdefault(get_hour_bucket(epoch), {})[key] = epoch
+    return index
+
+
+def get_schedule_index(state, scheduled_log):
+    """
+    Returns the day's send-time index from state, plus entries built in
+    memory for any scheduled_log keys it is missing. scheduled_log and the
+    index are separate objects, so a scheduler run can save one and fail
+    before the other; a log written before the index existed misses them all.
+    """
+    index = state.get(SCHEDULE_INDEX_LOG)
+    indexed = {key for bucket in index.values() for key in bucket}
+    missing = {key: record for key, record in scheduled_log.items() if key not in indexed}
+    if not missing:
+        return index
+
+    merged = {bucket_key: dict(bucket) for bucket_key, bucket in index.items()}
+    for bucket_key, bucket in build_schedule_index(missing).items():
+        merged.setdefault(bucket_key, {}).update(bucket)
+    return merged
+
+
+def get_due_keys(index, cursor, now_epoch, lookback=SCHEDULE_LOOKBACK_SECONDS):
+    """
+    Returns the keys with cursor - lookback < send epoch <= now_epoch, in
+    send-time order. Only the hour buckets in that range are read.
+    """
+    lower = (cursor - lookback) if cursor is not None else None
+    if lower is None:
+        bucket_keys = sorted(b for b in index if b <= get_hour_bucket(now_epoch))
+    else:
+        bucket_keys = []
+        hour = datetime.fromtimestamp(lower, timezone.utc).replace(minute=0, second=0, microsecond=0)
+        while hour.timestamp() <= now_epoch:
+            bucket_keys.append(hour.strftime("%Y-%m-%dT%H"))
+            hour += timedelta(hours=1)
+
+    due = []
+    for bucket_key in bucket_keys:
+        for key, epoch in index.get(bucket_key, {}).items():
+            if epoch <= now_epoch and (lower is None or epoch > lower):
+                due.append((epoch, key))
+    due.sort()
+    return [key for _, key in due]
+
+
+def count_future_entries(index, now_epoch):
+    now_bucket = get_hour_bucket(now_epoch)
+    count = 0
+    for bucket_key, bucket in index.items():
+        if bucket_key > now_bucket:
+            count += len(bucket)
+        elif bucket_key == now_bucket:
+            count += sum(1 for epoch in bucket.values() if epoch > now_epoch)
+    return count
@@ -0,0 +1,133 @@
+import os
+import re
+from array import array
+from datetime import date
+from functools import lru_cache
+import numpy as np
+from log_utils import get_logger
+
+logger = get_logger("step_columns")
+
+# Below this many buffered points a Python loop beats the NumPy round trip.
+NUMPY_MIN_POINTS = int(os.getenv("STEP_NUMPY_MIN_POINTS", "256"))
+
+# Timestamps MyDataHelps sends, e.g. "2025-01-01T13:05:00Z" or
+# "2025-01-01T13:05:00.123+02:00". For these the calendar day is simply the
+# first ten characters, which is what parsing and calling .date() gives.
+_FAST_ISO = re.compile(
+    r"\d{4}-\d{2}-\d{2}"
+    r"(?:[T ](?:[01]\d|2[0-3]):[0-5]\d(?::[0-5]\d(?:\.\d{1,6})?)?)?"
+    r"(?:Z|[+-](?:[01]\d|2[0-3]):?[0-5]\d)?"
+)
+
+
+@lru_cache(maxsize=4096)
+def _day_ordinal(day_str):
+    try:
+        return date(int(day_str[0:4]), int(day_str[5:7]), int(day_str[8:10])).toordinal()
+    except ValueError:
+        return None
+
+
+def get_day_ordinal(timestamp, parse_fallback):
+    """
+    Returns the proleptic ordinal of the timestamp's calendar day, or None if
+    it can't be parsed. Anything off the fast path goes through
+    parse_fallback, which returns a datetime or None, or raises.
+    """
+    if isinstance(timestamp, str) and _FAST_ISO.fullmatch(timestamp):
+        ordinal = _day_ordinal(timestamp[:10])
+        if ordinal is not None:
+            return ordinal
+    try:
+        parsed = parse_fallback(timestamp)
+    except Exception as e:
+        logger.debug("Skipping invalid timestamp", extra={"timestamp": timestamp, "error": str(e)})
+        return None
+    return parsed.date().toordinal() if parsed else None
+
+
+class StepColumns:
+    """
+    Steps points as three compact columns: source code, day ordinal and
+    value. sum_by_source() group-sums one day's values per source, with
+    NumPy from NUMPY_MIN_POINTS points on.
+    """
+
+    def __init__(self, parse_fallback):
+        self.parse_fallback = parse_fallback
+        self.source_codes = {}
+        self.sources = []
+        self.codes = array("i")
+        self.days = array("i")
+        self.values = array("q")
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, dp):
+        try:
+            start_date = dp["startDate"]
+        except Exception as e:
+            logger.debug("Skipping data point without a start date", extra={"error": str(e)})
+            return
+        day = get_day_ordinal(start_date, self.parse_fallback)
+        if day is None:
+            return
+
+        try:
+            source_name = dp["source"]["properties"].get("SourceName", "Unknown Source")
+            step_value = int(float(dp["value"]))
+        except Exception as e:
+            logger.debug("Skipping unparseable steps entry", extra={"error": str(e)})
+            return
+
+        code = self.source_codes.get(source_name)
+        if code is None:
+            code = self.source_codes[source_name] = len(self.sources)
+            self.sources.append(source_name)
+        self.codes.append(code)
+        self.days.append(day)
+        self.values.append(step_value)
+
+    def extend(self, data_points):
+        for dp in data_points:
+            self.add(dp)
+
+    def sum_by_source(self, day):
+        """Returns {source name: total steps} for the points on the given date."""
+        day_ordinal = day.toordinal()
+        if len(self.values) >= NUMPY_MIN_POINTS:
+            codes = np.frombuffer(self.codes, dtype=np.intc)
+            days = np.frombuffer(self.days, dtype=np.intc)
+            values = np.frombuffer(self.values, dtype=np.int64)
+            mask = days == day_ordinal
+            day_codes = codes[mask]
+            counts = np.bincount(day_codes, minlength=len(self.sources))
+            totals = np.bincount(day_codes, weights=values[mask], minlength=len(self.sources))
+            return {self.sources[i]: int(totals[i]) for i in np.flatnonzero(counts)}
+
+        totals = {}
+        for code, point_day, value in zip(self.codes, self.days, self.values):
+            if point_day == day_ordinal:
+                source_name = self.sources[code]
+                totals[source_name] = totals.get(source_name, 0) + value
+        return totals
+
+    def sum_into(self, step_totals, day):
+        """Adds the day's totals to step_totals and empties the columns."""
+        for source_name, total in self.sum_by_source(day).items():
+            step_totals[source_name] = step_totals.get(source_name, 0) + total
+        self.clear()
+
+    def clear(self):
+        self.codes = array("i")
+        self.days = array("i")
+        self.values = array("q")
+
+
+def aggregate_steps(data_points, day, parse_fallback):
+    """Sums the Steps points' values per source for the given date."""
+    columns = StepColumns(parse_fallback)
+    columns.extend(data_points)
+    return columns.sum_by_source(day)
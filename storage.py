@@ -0,0 +1,283 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import boto3
+from botocore.exceptions import ClientError
+import metrics
+
+# Where the JSON/JSONL logs live: "s3" (default), "local" or "memory".
+LOG_STORAGE_BACKEND = os.getenv("LOG_STORAGE_BACKEND", "s3")
+# Root directory for the local backend; each bucket is a sub-directory.
+LOG_STORAGE_DIR = os.getenv("LOG_STORAGE_DIR", "./log_storage")
+# Max number of objects kept in the S3 read-through cache. Log parts are
+# cached too, and a busy day writes a few hundred of them.
+LOG_CACHE_MAX_ENTRIES = int(os.getenv("LOG_CACHE_MAX_ENTRIES", "1024"))
+
+
+class PreconditionFailed(Exception):
+    """Raised when a conditional put loses against a concurrent writer."""
+
+
+def _etag(body):
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+class LogStorage(ABC):
+    """
+    Minimal object store used for the scheduler/notifier logs.
+
+    Keys are '/'-separated paths. Bodies are bytes. ETags are opaque strings
+    that change whenever an object changes.
+    """
+
+    @abstractmethod
+    def get(self, key, immutable=False):
+        """
+        Returns (body, etag), or (None, None) if the key does not exist.
+        immutable=True promises the object is never rewritten (e.g. a log
+        part), so a cached copy may be returned without revalidating it.
+        """
+
+    @abstractmethod
+    def put(self, key, body, if_match=None, if_none_match=False):
+        """
+        Writes body to key and returns the new ETag. With if_match, the write
+        only happens if the current ETag matches; with if_none_match, only if
+        the key does not exist yet. Otherwise PreconditionFailed is raised.
+        """
+
+    @abstractmethod
+    def list_keys(self, prefix):
+        """Returns all keys starting with prefix, sorted."""
+
+    def iter_lines(self, key, immutable=False):
+        body, _ = self.get(key, immutable)
+        if body is None:
+            return iter(())
+        return iter(body.splitlines())
+
+
+class S3Storage(LogStorage):
+    """
+    S3 bucket with a read-through cache. Cached objects are revalidated
+    with If-None-Match, so an unchanged object costs a 304 instead of a
+    full download; immutable ones are served from the cache as they are.
+    """
+
+    def __init__(self, bucket, client=None, max_cache_entries=LOG_CACHE_MAX_ENTRIES):
+        self.bucket = bucket
+        self.client = client or boto3.client('s3')
+        self.max_cache_entries = max_cache_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _cache_put(self, key, body, etag):
+        if not etag:
+            return
+        with self.lock:
+            self.cache[key] = (body, etag)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cache_entries:
+                self.cache.popitem(last=False)
+
+    def get(self, key, immutable=False):
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and immutable:
+                self.cache.move_to_end(key)
+        if cached and immutable:
+            metrics.count("s3.get.cache_hit")
+            return cached
+
+        params = {'Bucket': self.bucket, 'Key': key}
+        if cached:
+            params['IfNoneMatch'] = cached[1]
+
+        start = time.perf_counter()
+        try:
+            obj = self.client.get_object(**params)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if cached and code in ('304', 'NotModified'):
+                metrics.record_call("s3.get", time.perf_counter() - start)
+                metrics.count("s3.get.not_modified")
+                with self.lock:
+                    if key in self.cache:
+                        self.cache.move_to_end(key)
+                return cached
+            if code == 'NoSuchKey':
+                metrics.record_call("s3.get", time.perf_counter() - start)
+                metrics.count("s3.get.missing")
+                with self.lock:
+                    self.cache.pop(key, None)
+                return None, None
+            metrics.record_call("s3.get", time.perf_counter() - start, error=True)
+            raise
+
+        body = obj['Body'].read()
+        metrics.record_call("s3.get", time.perf_counter() - start, len(body))
+        etag = obj.get('ETag')
+        self._cache_put(key, body, etag)
+        return body, etag
+
+    def put(self, key, body, if_match=None, if_none_match=False):
+        params = {'Body': body, 'Bucket': self.bucket, 'Key': key}
+        if if_match:
+            params['IfMatch'] = if_match
+        elif if_none_match:
+            params['IfNoneMatch'] = '*'
+
+        start = time.perf_counter()
+        try:
+            response = self.client.put_object(**params)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                metrics.record_call("s3.put", time.perf_counter() - start)
+                metrics.count("s3.put.conflict")
+                raise PreconditionFailed(key) from e
+            metrics.record_call("s3.put", time.perf_counter() - start, error=True)
+            raise
+        metrics.record_call("s3.put", time.perf_counter() - start, len(body))
+
+        etag = response.get('ETag')
+        self._cache_put(key, body, etag)
+        return etag
+
+    def list_keys(self, prefix):
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        start = time.perf_counter()
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        metrics.record_call("s3.list", time.perf_counter() - start)
+        return sorted(keys)
+
+
+class LocalStorage(LogStorage):
+    """
+    Directory on the local filesystem, for running and profiling the
+    schedule/notify cycle offline. Conditional writes are atomic within one
+    process.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get(self, key, immutable=False):
+        body = self._read(key)
+        if body is None:
+            return None, None
+        return body, _etag(body)
+
+    def put(self, key, body, if_match=None, if_none_match=False):
+        path = self._path(key)
+        with self.lock:
+            if if_match or if_none_match:
+                current = self._read(key)
+                if if_none_match and current is not None:
+                    raise PreconditionFailed(key)
+                if if_match and (current is None or _etag(current) != if_match):
+                    raise PreconditionFailed(key)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        return _etag(body)
+
+    def list_keys(self, prefix):
+        # Only the prefix's directory is walked, skipping sub-directories
+        # that can't hold a matching key.
+        directory = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(self._path(directory) if directory else self.root):
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            base = '' if rel == '.' else f"{rel}/"
+            dirnames[:] = [name for name in dirnames if f"{base}{name}/".startswith(prefix)]
+            keys.extend(base + filename for filename in filenames if (base + filename).startswith(prefix))
+        return sorted(keys)
+
+    def iter_lines(self, key, immutable=False):
+        try:
+            with open(self._path(key), 'rb') as f:
+                for line in f:
+                    yield line.rstrip(b'\r\n')
+        except FileNotFoundError:
+            return
+
+
+class MemoryStorage(LogStorage):
+    """In-process dict, for tests and benchmarks."""
+
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, immutable=False):
+        with self.lock:
+            body = self.objects.get(key)
+        if body is None:
+            return None, None
+        return body, _etag(body)
+
+    def put(self, key, body, if_match=None, if_none_match=False):
+        with self.lock:
+            current = self.objects.get(key)
+            if if_none_match and current is not None:
+                raise PreconditionFailed(key)
+            if if_match and (current is None or _etag(current) != if_match):
+                raise PreconditionFailed(key)
+            self.objects[key] = body
+        return _etag(body)
+
+    def list_keys(self, prefix):
+        with self.lock:
+            return sorted(key for key in self.objects if key.startswith(prefix))
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def create_storage(bucket, backend=None):
+    backend = backend or LOG_STORAGE_BACKEND
+    if backend == "s3":
+        return S3Storage(bucket)
+    if backend == "local":
+        return LocalStorage(os.path.join(LOG_STORAGE_DIR, bucket))
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown LOG_STORAGE_BACKEND '{backend}'")
+
+
+def get_storage(bucket):
+    """
+    Returns the configured backend for bucket. Instances are kept for the
+    life of the container, so caches survive warm invocations.
+    """
+    with _storages_lock:
+        if bucket not in _storages:
+            _storages[bucket] = create_storage(bucket)
+        return _storages[bucket]
+
+
+def set_storage(bucket, storage):
+    """Overrides the backend used for bucket (e.g. a MemoryStorage in benchmarks)."""
+    with _storages_lock:
+        _storages[bucket] = storage
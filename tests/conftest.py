@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules live at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_STORAGE_BACKEND", "memory")
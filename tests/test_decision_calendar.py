@@ -0,0 +1,118 @@
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+import jitai_utils
+from decision_calendar import DecisionCalendar, compute_participant_intervals
+
+
+def participant(pid, tz, **mealtimes):
+    return {
+        "participantIdentifier": pid,
+        "demographics": {"timeZone": tz},
+        "customFields": dict(mealtimes),
+    }
+
+
+def active_ids(calendar, roster, now):
+    calendar.refresh(roster, now)
+    return [p["participantIdentifier"] for p in calendar.get_active_participants(now)]
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_window_is_clamped_at_local_midnight():
+    # 2025-01-06 is a Monday; the dinner window would run to 01:00 Tuesday.
+    roster = [participant("p1", "UTC", mealtime_mon_dinner="11:00 PM")]
+    calendar = DecisionCalendar()
+
+    assert active_ids(calendar, roster, utc(2025, 1, 6, 23, 30)) == ["p1"]
+    assert active_ids(calendar, roster, utc(2025, 1, 7, 0, 30)) == []
+
+    start, end, _, key = [
+        interval for interval in compute_participant_intervals(roster[0], date(2025, 1, 6))
+        if interval[0] == utc(2025, 1, 6, 23).timestamp()
+    ][0]
+    assert key == "mealtime_mon_dinner"
+    assert utc(2025, 1, 6, 23, 59) < datetime.fromtimestamp(end, timezone.utc) < utc(2025, 1, 7)
+
+
+def test_window_on_the_neighbouring_utc_day():
+    # Monday lunch in Auckland (UTC+13) starts at 23:00 UTC on Sunday.
+    roster = [participant("p1", "Pacific/Auckland", mealtime_mon_lunch="12:00 PM")]
+    calendar = DecisionCalendar()
+
+    assert active_ids(calendar, roster, utc(2025, 1, 5, 23, 30)) == ["p1"]
+    assert active_ids(calendar, roster, utc(2025, 1, 6, 1, 30)) == []
+
+
+def test_spring_forward_window_follows_the_wall_clock():
+    # 2025-03-30 (Sunday): Zurich skips 02:00-03:00, so 01:30-03:30 local
+    # is one real hour.
+    p = participant("p1", "Europe/Zurich", mealtime_we_breakfast="01:30 AM")
+    intervals = [i for i in compute_participant_intervals(p, date(2025, 3, 30)) if i[0] == utc(2025, 3, 30, 0, 30).timestamp()]
+
+    assert len(intervals) == 1
+    start, end, _, _ = intervals[0]
+    assert end - start == 60 * 60
+
+
+def test_fall_back_window_follows_the_wall_clock():
+    # 2025-10-26 (Sunday): Zurich repeats 02:00-03:00, so 01:30-03:30 local
+    # is three real hours, longer than MEAL_WINDOW_SECONDS.
+    roster = [participant("p1", "Europe/Zurich", mealtime_we_breakfast="01:30 AM")]
+    calendar = DecisionCalendar()
+
+    assert active_ids(calendar, roster, utc(2025, 10, 26, 2, 15)) == ["p1"]
+    assert active_ids(calendar, roster, utc(2025, 10, 26, 2, 45)) == []
+
+
+@pytest.mark.parametrize("now", [
+    utc(2025, 3, 30, 0, 15), utc(2025, 3, 30, 0, 45), utc(2025, 3, 30, 1, 15), utc(2025, 3, 30, 1, 45),
+    utc(2025, 10, 25, 23, 15), utc(2025, 10, 26, 1, 45), utc(2025, 10, 26, 2, 45),
+    utc(2025, 1, 6, 11, 59), utc(2025, 1, 6, 12, 0), utc(2025, 1, 6, 14, 0), utc(2025, 1, 6, 14, 1),
+])
+def test_matches_the_wall_clock_check(monkeypatch, now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now.astimezone(tz) if tz else now.replace(tzinfo=None)
+
+    monkeypatch.setattr(jitai_utils, "datetime", FrozenDatetime)
+    roster = [
+        participant("zurich", "Europe/Zurich", mealtime_we_breakfast="01:30 AM", mealtime_mon_lunch="12:00 PM"),
+        participant("utc", "UTC", mealtime_mon_lunch="12:00 PM", mealtime_we_lunch="12:00 PM"),
+        participant("ny", "America/New_York", mealtime_mon_lunch="07:00 AM", mealtime_we_dinner="09:00 PM"),
+        participant("bad_tz", "Not/AZone", mealtime_mon_lunch="12:00 PM"),
+    ]
+
+    expected = [p["participantIdentifier"] for p in jitai_utils.get_active_meal_window_participants([dict(p) for p in roster])]
+
+    assert active_ids(DecisionCalendar(), roster, now) == expected
+
+
+def test_refresh_recomputes_only_changed_participants(monkeypatch):
+    import decision_calendar
+
+    computed = []
+    compute = decision_calendar.compute_participant_intervals
+
+    def counting(p, day):
+        computed.append(p["participantIdentifier"])
+        return compute(p, day)
+
+    monkeypatch.setattr(decision_calendar, "compute_participant_intervals", counting)
+    now = utc(2025, 1, 6, 12, 30)
+    calendar = DecisionCalendar()
+    roster = [participant("p1", "UTC", mealtime_mon_lunch="12:00 PM"), participant("p2", "UTC", mealtime_mon_lunch="06:00 PM")]
+    calendar.refresh(roster, now)
+
+    roster = [roster[0], participant("p2", "UTC", mealtime_mon_lunch="12:15 PM")]
+    assert active_ids(calendar, roster, now) == ["p1", "p2"]
+    assert computed == ["p1", "p2", "p2"]
+
+    # A new UTC day starts over.
+    calendar.refresh(list(roster), now + timedelta(days=1))
+    assert computed == ["p1", "p2", "p2", "p1", "p2"]
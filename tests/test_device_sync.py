@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import device_sync
+import storage
+from s3_utils import load_log
+
+NOW = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def state(monkeypatch):
+    monkeypatch.setitem(storage._storages, BUCKET, storage.MemoryStorage())
+    return device_sync.load_sync_state(BUCKET)
+
+
+def steps(point_id, source, value, observed):
+    return {
+        "id": point_id, "type": "Steps", "value": value,
+        "startDate": observed, "observationDate": observed,
+        "source": {"properties": {"SourceName": source}},
+    }
+
+
+def sleep(point_id, duration, observed):
+    return {"id": point_id, "type": "Sleep", "duration": duration, "startDate": observed, "observationDate": observed}
+
+
+class FakeProvider:
+    """Serves a scripted list of points per sync and records the lower bound asked for."""
+
+    NAMESPACE = namespace = "AppleHealth"
+
+    def __init__(self):
+        self.points = []
+        self.observed_after = []
+
+    def get_point_kind(self, dp):
+        return {"Steps": "steps", "Sleep": "sleep"}.get(dp.get("type"))
+
+    def parse_start_date(self, timestamp):
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+    def add_step(self, step_totals, dp, today):
+        if self.parse_start_date(dp["startDate"]).date() == today:
+            step_totals[dp["source"]["properties"]["SourceName"]] += int(dp["value"])
+
+    def aggregate_steps_by_source(self, steps_data):
+        totals = {}
+        for dp in steps_data:
+            if self.parse_start_date(dp["startDate"]).date() == NOW.date():
+                source = dp["source"]["properties"]["SourceName"]
+                totals[source] = totals.get(source, 0) + int(dp["value"])
+        return totals
+
+    def iter_device_data(self, service_access_token, project_id, participant_identifier, base_url, observed_after=None):
+        self.observed_after.append(observed_after)
+        return iter(self.points)
+
+    def get_device_data(self, service_access_token, project_id, participant_identifier, base_url, observed_after=None):
+        self.observed_after.append(observed_after)
+        return (
+            [dp for dp in self.points if self.get_point_kind(dp) == "steps"],
+            [dp for dp in self.points if self.get_point_kind(dp) == "sleep"],
+        )
+
+
+def sync(state, provider, now, pid="p1"):
+    return device_sync.sync_device_data(state, provider, "token", "project", pid, "https://api", now=now)
+
+
+def get_entry(state, pid="p1"):
+    return state.get(device_sync.SYNC_STATE_LOG)[f"{pid}::AppleHealth"]
+
+
+def test_first_sync_reads_the_trailing_day(state):
+    provider = FakeProvider()
+    provider.points = [steps("s1", "Watch", 100, "2025-01-01T11:30:00Z"), sleep("z1", 3600000, "2025-01-01T07:00:00Z")]
+
+    daily_steps, sleep_data = sync(state, provider, NOW)
+
+    assert provider.observed_after == ["2024-12-31T12:00:00Z"]
+    assert daily_steps == {"Watch": 100}
+    assert [s["duration"] for s in sleep_data] == [3600000]
+    assert get_entry(state)["watermark"] == "2025-01-01T12:00:00Z"
+
+
+def test_points_in_the_overlap_are_counted_once(state):
+    provider = FakeProvider()
+    provider.points = [steps("s1", "Watch", 100, "2025-01-01T11:30:00Z"), sleep("z1", 3600000, "2025-01-01T07:00:00Z")]
+    sync(state, provider, NOW)
+
+    # The next tick re-reads the overlap, so s1 comes back next to the new s2.
+    later = NOW + timedelta(minutes=5)
+    provider.points = [
+        steps("s1", "Watch", 100, "2025-01-01T11:30:00Z"),
+        steps("s2", "Watch", 40, "2025-01-01T12:02:00Z"),
+        steps("s3", "Phone", 7, "2025-01-01T12:03:00Z"),
+    ]
+    daily_steps, sleep_data = sync(state, provider, later)
+
+    overlap = timedelta(minutes=device_sync.SYNC_OVERLAP_MINUTES)
+    expected_after = max(NOW - overlap, later - timedelta(hours=24))
+    assert provider.observed_after[-1] == expected_after.isoformat().replace("+00:00", "Z")
+    assert daily_steps == {"Watch": 140, "Phone": 7}
+    assert [s["duration"] for s in sleep_data] == [3600000]
+
+    # A tick with nothing new changes nothing.
+    daily_steps, _ = sync(state, provider, later + timedelta(minutes=5))
+    assert daily_steps == {"Watch": 140, "Phone": 7}
+
+
+def test_points_without_an_id_are_deduplicated_by_content(state):
+    provider = FakeProvider()
+    point = steps(None, "Watch", 25, "2025-01-01T11:50:00Z")
+    provider.points = [point]
+    sync(state, provider, NOW)
+
+    daily_steps, _ = sync(state, provider, NOW + timedelta(minutes=5))
+
+    assert daily_steps == {"Watch": 25}
+
+
+def test_ids_older_than_the_overlap_are_forgotten(state):
+    provider = FakeProvider()
+    provider.points = [steps("s1", "Watch", 100, "2025-01-01T09:00:00Z")]
+    sync(state, provider, NOW)
+
+    assert "s1" not in get_entry(state)["recent_ids"]
+
+
+def test_overlapping_ticks_keep_each_others_entries(state):
+    provider = FakeProvider()
+    provider.points = [steps("s1", "Watch", 100, "2025-01-01T11:30:00Z")]
+    sync(state, provider, NOW)
+    state.save()
+
+    # Two ticks load the same state; each syncs its own participant.
+    first, second = device_sync.load_sync_state(BUCKET), device_sync.load_sync_state(BUCKET)
+    later = NOW + timedelta(minutes=5)
+    sync(first, provider, later, pid="p2")
+    sync(second, provider, later + timedelta(minutes=1))
+    second.save()
+    first.save()
+
+    saved = load_log(BUCKET, device_sync.SYNC_STATE_LOG)
+    assert saved["p1::AppleHealth"]["watermark"] == "2025-01-01T12:06:00Z"
+    assert saved["p2::AppleHealth"]["watermark"] == "2025-01-01T12:05:00Z"
+    assert saved["p1::AppleHealth"]["steps_by_source"] == {"Watch": 100}
@@ -0,0 +1,85 @@
+import json
+import time
+
+import pytest
+
+import dispatcher
+import notifier_logic
+import storage
+from s3_utils import get_log_key
+from schedule_index import NOTIFIER_CURSOR_LOG, SCHEDULE_INDEX_LOG, get_hour_bucket
+
+
+@pytest.fixture
+def logs(monkeypatch):
+    memory = storage.MemoryStorage()
+    monkeypatch.setitem(storage._storages, notifier_logic.BUCKET, memory)
+
+    def write(base_filename, data):
+        memory.put(get_log_key(base_filename), json.dumps(data).encode("utf-8"))
+
+    return write
+
+
+def make_dispatcher(poll_seconds=3600):
+    sends = []
+    d = dispatcher.Dispatcher(coalesce_seconds=0, poll_seconds=poll_seconds, send=lambda: sends.append(time.time()))
+    return d, sends
+
+
+def test_dropped_entry_is_not_resent_every_pass(logs):
+    # Due, never reached sent_log, and not kept pending by the notifier.
+    epoch = time.time() - 60
+    logs(SCHEDULE_INDEX_LOG, {get_hour_bucket(epoch): {"p1_lunch": epoch}})
+    d, sends = make_dispatcher(poll_seconds=0)
+
+    for _ in range(5):
+        d.run_once()
+
+    assert len(sends) == 1
+
+
+def test_pending_entry_is_retried_at_poll(logs):
+    epoch = time.time() - 60
+    logs(SCHEDULE_INDEX_LOG, {get_hour_bucket(epoch): {"p1_lunch": epoch}})
+    logs(NOTIFIER_CURSOR_LOG, {"cursor": epoch, "pending": {"p1_lunch": epoch}})
+    d, sends = make_dispatcher(poll_seconds=0)
+
+    for _ in range(3):
+        d.run_once()
+
+    assert len(sends) == 3
+
+
+def test_schedule_is_kept_between_passes(logs, monkeypatch):
+    now = time.time()
+    logs(SCHEDULE_INDEX_LOG, {get_hour_bucket(now): {"p1_lunch": now + 0.05, "p2_lunch": now + 0.1}})
+    d, sends = make_dispatcher()
+    loads = []
+    load_schedule = d.load_schedule
+    monkeypatch.setattr(d, "load_schedule", lambda: loads.append(1) or load_schedule())
+
+    d.run_once()
+    d.run_once()
+
+    assert len(sends) == 2
+    assert len(loads) == 1
+
+
+def test_rearm_reloads_schedule(logs, monkeypatch):
+    d, sends = make_dispatcher()
+    loads = []
+    load_schedule = d.load_schedule
+    monkeypatch.setattr(d, "load_schedule", lambda: loads.append(1) or load_schedule())
+
+    d.rearm()
+    d.run_once()
+    d.rearm()
+    d.run_once()
+
+    assert sends == []
+    assert len(loads) == 2
+
+
+def test_poll_defaults_to_scheduler_interval():
+    assert dispatcher.DISPATCH_POLL_SECONDS >= dispatcher.SCHEDULER_INTERVAL_SECONDS
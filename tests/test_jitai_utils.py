@@ -0,0 +1,153 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import api_utils
+import jitai_utils
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class FakeParticipantsAPI:
+    """Serves /participants pages of a segment roster and records each request."""
+
+    def __init__(self, size):
+        self.roster = [{"participantIdentifier": f"p{i}", "version": 1} for i in range(size)]
+        self.updated = []
+        self.fail_delta = False
+        self.requests = []
+
+    def get(self, access_token, url, query_params=None, raise_error=True):
+        path = urlsplit(url).path
+        query = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+        query.update(query_params or {})
+        self.requests.append(query)
+        if not path.endswith("/participants"):
+            pid = path.rsplit("/", 1)[-1]
+            found = [p for p in self.roster if p["participantIdentifier"] == pid]
+            return FakeResponse(found[0] if found else {}, 200 if found else 404)
+        if jitai_utils.ROSTER_DELTA_PARAM and jitai_utils.ROSTER_DELTA_PARAM in query:
+            if self.fail_delta:
+                raise RuntimeError("delta not supported")
+            participants = self.updated
+        else:
+            participants = self.roster
+        page, size = int(query["pageNumber"]), int(query["pageSize"])
+        return FakeResponse({
+            "participants": participants[page * size:(page + 1) * size],
+            "totalParticipants": len(participants),
+        })
+
+
+class Clock:
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def api(monkeypatch):
+    jitai_utils.clear_roster_cache()
+    fake = FakeParticipantsAPI(250)
+    monkeypatch.setattr(api_utils, "get_from_api", fake.get)
+    yield fake
+    jitai_utils.clear_roster_cache()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jitai_utils.time, "monotonic", clock)
+    return clock
+
+
+def get_roster():
+    return jitai_utils.get_participants_by_segment("project", "token", "s1")
+
+
+def test_roster_pages_are_fetched_in_order(api, clock):
+    roster = get_roster()
+
+    assert roster == api.roster
+    assert sorted(int(query["pageNumber"]) for query in api.requests) == [0, 1, 2]
+
+
+def test_roster_is_reused_within_ttl(api, clock):
+    roster = get_roster()
+    api.requests.clear()
+
+    clock.now += jitai_utils.ROSTER_CACHE_TTL_SECONDS - 1
+    assert get_roster() is roster
+    assert api.requests == []
+
+    clock.now += 1
+    assert get_roster() == api.roster
+    assert len(api.requests) == 3
+
+
+def test_stale_roster_is_refreshed_as_a_delta(api, clock, monkeypatch):
+    monkeypatch.setattr(jitai_utils, "ROSTER_DELTA_PARAM", "modifiedAfter")
+    get_roster()
+    api.requests.clear()
+    api.updated = [{"participantIdentifier": "p1", "version": 2}, {"participantIdentifier": "p250", "version": 1}]
+
+    clock.now += jitai_utils.ROSTER_CACHE_TTL_SECONDS
+    roster = get_roster()
+
+    assert len(api.requests) == 1 and "modifiedAfter" in api.requests[0]
+    assert roster[1] == {"participantIdentifier": "p1", "version": 2}
+    assert roster[-1] == {"participantIdentifier": "p250", "version": 1}
+    assert len(roster) == 251
+
+
+def test_failed_delta_falls_back_to_a_full_fetch(api, clock, monkeypatch):
+    monkeypatch.setattr(jitai_utils, "ROSTER_DELTA_PARAM", "modifiedAfter")
+    get_roster()
+    api.requests.clear()
+    api.fail_delta = True
+
+    clock.now += jitai_utils.ROSTER_CACHE_TTL_SECONDS
+    assert get_roster() == api.roster
+    assert len(api.requests) == 4
+
+
+def test_roster_is_fetched_in_full_after_full_refresh_interval(api, clock, monkeypatch):
+    monkeypatch.setattr(jitai_utils, "ROSTER_DELTA_PARAM", "modifiedAfter")
+    get_roster()
+    api.requests.clear()
+
+    clock.now += jitai_utils.ROSTER_FULL_REFRESH_SECONDS
+    get_roster()
+
+    assert [query for query in api.requests if "modifiedAfter" in query] == []
+    assert len(api.requests) == 3
+
+
+def test_few_participants_are_fetched_one_by_one(api):
+    participants = jitai_utils.fetch_participants("project", "token", ["p3", "p200", "missing"])
+
+    assert sorted(participants) == ["p200", "p3"]
+    assert len(api.requests) == 3
+    assert all("pageNumber" not in query for query in api.requests)
+
+
+def test_many_participants_are_read_from_project_pages(api, monkeypatch):
+    monkeypatch.setattr(jitai_utils, "PARTICIPANT_GET_MAX", 2)
+
+    participants = jitai_utils.fetch_participants("project", "token", ["p3", "p200", "missing"])
+
+    assert sorted(participants) == ["p200", "p3"]
+    assert sorted(int(query["pageNumber"]) for query in api.requests) == [0, 1, 2]
@@ -0,0 +1,108 @@
+import json
+import logging
+import threading
+
+import pytest
+
+import log_utils
+from log_utils import REDACTED, JsonFormatter, ParticipantSampler, redact
+
+
+def make_record(level=logging.DEBUG, msg="event", args=(), **extra):
+    record = logging.LogRecord("mrt.test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampler_keeps_whole_participants():
+    sampler = ParticipantSampler(0.5)
+    kept = {pid for pid in range(1000) if sampler.filter(make_record(pid=pid))}
+
+    assert 400 < len(kept) < 600
+    # The decision depends on the participant only, so a trail stays complete.
+    assert all(sampler.filter(make_record(pid=pid, msg="other")) for pid in kept)
+
+
+def test_sampler_rate_bounds():
+    assert not ParticipantSampler(0).filter(make_record(pid="p1"))
+    assert ParticipantSampler(1).filter(make_record(pid="p1"))
+
+
+def test_sampler_passes_other_records():
+    sampler = ParticipantSampler(0)
+
+    assert sampler.filter(make_record())
+    assert sampler.filter(make_record(level=logging.INFO, pid="p1"))
+
+
+def test_redact_replaces_fields_at_any_depth():
+    value = {"pid": "p1", "participant": {"firstName": "Ada", "tags": [{"email": "a@example.org"}]}}
+
+    assert redact(value) == {"pid": "p1", "participant": {"firstName": REDACTED, "tags": [{"email": REDACTED}]}}
+    assert value["participant"]["firstName"] == "Ada"
+
+
+def test_formatter_writes_extra_fields_redacted(monkeypatch):
+    monkeypatch.setattr(log_utils, "LOG_REDACT", True)
+    record = make_record(level=logging.INFO, msg="sent %d", args=(3,), pid="p1", customFields={"a": 1})
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "sent 3"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "mrt.test"
+    assert entry["pid"] == "p1"
+    assert entry["customFields"] == REDACTED
+
+
+def test_formatter_keeps_fields_when_redaction_is_off(monkeypatch):
+    monkeypatch.setattr(log_utils, "LOG_REDACT", False)
+    record = make_record(customFields={"a": 1})
+
+    assert json.loads(JsonFormatter().format(record))["customFields"] == {"a": 1}
+
+
+@pytest.fixture
+def logged(capsys):
+    def read():
+        assert log_utils.flush()
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    return read
+
+
+def test_logger_writes_json_lines(logged, monkeypatch):
+    monkeypatch.setattr(log_utils, "LOG_REDACT", True)
+    logger = log_utils.get_logger("test")
+
+    logger.warning("fetch failed for %s", "p1", extra={"pid": "p1", "email": "a@example.org"})
+
+    [entry] = logged()
+    assert entry["logger"] == "mrt.test"
+    assert entry["message"] == "fetch failed for p1"
+    assert entry["email"] == REDACTED
+
+
+def test_records_are_formatted_on_the_writer_thread(logged, monkeypatch):
+    threads = []
+    formatter = log_utils._stdout_handler.formatter
+    format_record = formatter.format
+
+    def recording_format(record):
+        threads.append(threading.current_thread())
+        return format_record(record)
+
+    monkeypatch.setattr(formatter, "format", recording_format)
+    logger = log_utils.get_logger("test")
+    args = ["p1"]
+
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        logger.exception("fetch failed for %s", args, extra={"pid": "p1"})
+    args.append("p2")
+
+    [entry] = logged()
+    assert entry["message"] == "fetch failed for ['p1']"
+    assert "ValueError: bad value" in entry["exception"]
+    assert threads and threading.current_thread() not in threads
@@ -0,0 +1,94 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def emitted(monkeypatch, capsys):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+
+    def read():
+        return [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith("{")]
+
+    return read
+
+
+def test_histogram_buckets_by_upper_bound():
+    stats = metrics.CallStats()
+    for latency_ms in (5, 10, 11, 6000):
+        stats.add(latency_ms, 0, False, False)
+
+    assert stats.get_histogram() == {"10": 2, "25": 1, "+Inf": 1}
+    assert stats.latency_ms_max == 6000
+
+
+def test_instrumented_emits_one_record(emitted):
+    @metrics.instrumented("TestHandler")
+    def handler():
+        with metrics.phase("fetch"):
+            metrics.record_call("api.notifications", 0.02, 100)
+            metrics.record_call("api.notifications", 0.3, 50, error=True, throttled=True)
+        metrics.count("notifications.sent", 3)
+        return "ok"
+
+    assert handler() == "ok"
+
+    [record] = emitted()
+    assert record["Handler"] == "TestHandler"
+    assert record["notifications.sent"] == 3
+    assert record["api.notifications.calls"] == 2
+    assert record["api.notifications.errors"] == 1
+    assert record["api.notifications.throttled"] == 1
+    assert record["api.notifications.bytes"] == 150
+    assert record["api.notifications.latency_max"] == 300.0
+    assert record["api.notifications.latency_histogram_ms"] == {"25": 1, "500": 1}
+    assert "phase.fetch" in record and "phase.total" in record
+    [directive] = record["_aws"]["CloudWatchMetrics"]
+    names = {metric["Name"] for metric in directive["Metrics"]}
+    assert "api.notifications.calls" in names
+    assert "api.notifications.latency_histogram_ms" not in names
+
+
+def test_failed_handler_still_emits(emitted):
+    @metrics.instrumented("TestHandler")
+    def handler():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        handler()
+
+    [record] = emitted()
+    assert record["errors"] == 1
+
+
+def test_metrics_outside_an_invocation_are_ignored():
+    metrics.count("ignored")
+    metrics.record_call("api.ignored", 0.1)
+    with metrics.phase("ignored"):
+        pass
+    assert metrics.get_invocation() is None
+
+
+def test_bind_records_from_pool_threads(emitted):
+    @metrics.instrumented("TestHandler")
+    def handler():
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(metrics.bind(lambda i: metrics.record_call("s3.get", 0.001)), range(20)))
+
+    handler()
+
+    [record] = emitted()
+    assert record["s3.get.calls"] == 20
+
+
+def test_directives_are_split_at_the_metric_limit():
+    invocation = metrics.Invocation("TestHandler")
+    for i in range(metrics.EMF_MAX_METRICS + 1):
+        invocation.count(f"counter.{i}")
+
+    directives = invocation.to_emf()["_aws"]["CloudWatchMetrics"]
+
+    assert [len(d["Metrics"]) for d in directives] == [metrics.EMF_MAX_METRICS, 1]
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import api_utils
+import jitai_utils
+import notifications
+import storage
+
+BUCKET = "test-bucket"
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@pytest.fixture
+def tracking(monkeypatch):
+    """Serves survey tasks, applying the date filters the API supports, and records the PUTs."""
+    monkeypatch.setitem(storage._storages, BUCKET, storage.MemoryStorage())
+    tasks = []
+    puts = []
+
+    def iter_api_pages(access_token, url, params, items_key):
+        yield [
+            t for t in tasks
+            if t["insertedDate"] > params.get("insertedAfter", "")
+            and t["modifiedDate"] > params.get("modifiedAfter", "")
+        ]
+
+    def put(url, headers=None, json=None):
+        puts.append(json)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(api_utils, "iter_api_pages", iter_api_pages)
+    monkeypatch.setattr(api_utils.http_session, "put", put)
+    monkeypatch.setattr(jitai_utils, "fetch_participants", lambda project_id, access_token, ids: {
+        pid: {"participantIdentifier": pid, "customFields": {"TrackingCount": "2"}} for pid in ids
+    })
+    return tasks, puts
+
+
+def test_old_task_completed_today_is_counted(tracking):
+    tasks, puts = tracking
+    now = datetime.now(timezone.utc)
+    tasks.append({
+        "participantIdentifier": "p1", "surveyName": "log_lunch_en", "status": "complete",
+        "insertedDate": iso(now - timedelta(days=10)), "modifiedDate": iso(now), "endDate": iso(now),
+    })
+
+    notifications.check_and_increment_tracking("https://api", "project", "token", BUCKET)
+
+    assert puts == [{"participantIdentifier": "p1", "customFields": {"TrackingCount": 3}}]
+
+    # The completion is logged, so the next tick doesn't count it again.
+    notifications.check_and_increment_tracking("https://api", "project", "token", BUCKET)
+    assert len(puts) == 1
@@ -0,0 +1,82 @@
+import pytest
+import requests
+
+import notifier_logic
+
+
+def make_response(status, body=b"[]"):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    return response
+
+
+def make_records(n):
+    return [
+        (f"p{i}::mealtime_mon_lunch", {"participant_id": f"p{i}", "notification_id": "control_00_en"})
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    """Records every POSTed batch and answers with the given status."""
+    sent = []
+    status = {"code": 200}
+
+    def post(url, headers=None, json=None):
+        sent.append([r["participantIdentifier"] for r in json])
+        return make_response(status["code"], b"[" + b",".join(b"{}" for _ in json) + b"]")
+
+    monkeypatch.setattr(notifier_logic.http_session, "post", post)
+    return sent, status
+
+
+def test_accepted_batch(posts):
+    sent, _ = posts
+    outcome = notifier_logic.post_notifications("url", {}, make_records(4))
+    assert outcome == {key: None for key, _ in make_records(4)}
+    assert len(sent) == 1
+
+
+@pytest.mark.parametrize("code", [401, 403, 404, 429, 500, 502, 503, 504])
+def test_unauthorized_throttled_or_failed_batch_is_not_resent(posts, code):
+    sent, status = posts
+    status["code"] = code
+    outcome = notifier_logic.post_notifications("url", {}, make_records(4))
+    assert len(sent) == 1
+    assert all(error and error.startswith(str(code)) for error in outcome.values())
+
+
+def test_unreachable_batch_is_not_resent(monkeypatch):
+    calls = []
+
+    def post(url, headers=None, json=None):
+        calls.append(json)
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(notifier_logic.http_session, "post", post)
+    outcome = notifier_logic.post_notifications("url", {}, make_records(4))
+    assert len(calls) == 1
+    assert all(outcome.values())
+
+
+@pytest.mark.parametrize("code", [400, 413, 422])
+def test_rejected_batch_is_split_to_isolate_bad_record(monkeypatch, code):
+    delivered = []
+
+    def post(url, headers=None, json=None):
+        pids = [r["participantIdentifier"] for r in json]
+        if "p2" in pids:
+            return make_response(code, b'{"error": "invalid participant"}')
+        delivered.extend(pids)
+        return make_response(200, b"[" + b",".join(b"{}" for _ in json) + b"]")
+
+    monkeypatch.setattr(notifier_logic.http_session, "post", post)
+    outcome = notifier_logic.post_notifications("url", {}, make_records(4))
+    assert outcome["p2::mealtime_mon_lunch"].startswith(str(code))
+    assert [key for key, error in outcome.items() if error is None] == [
+        "p0::mealtime_mon_lunch", "p1::mealtime_mon_lunch", "p3::mealtime_mon_lunch"
+    ]
+    # Each accepted participant was delivered exactly once.
+    assert sorted(delivered) == ["p0", "p1", "p3"]
@@ -0,0 +1,122 @@
+import pytest
+
+import jitai_logic
+from providers import PROVIDERS, get_platform_providers, merge_device_summaries
+
+
+def sleep(duration):
+    return {"duration": duration}
+
+
+def test_platform_providers():
+    assert [p.namespace for p in get_platform_providers("iOS")] == ["AppleHealth"]
+    assert [p.namespace for p in get_platform_providers("Fitbit")] == ["Fitbit"]
+    assert {p.namespace for p in get_platform_providers("Android")} == {"GoogleFit", "HealthConnect"}
+    assert get_platform_providers("Windows Phone") == []
+
+
+@pytest.mark.parametrize("namespace, dp_type, kind", [
+    ("AppleHealth", "Steps", "steps"),
+    ("AppleHealth", "steps", None),
+    ("AppleHealth", "Sleep Analysis", "sleep"),
+    ("AppleHealth", "HeartRate", None),
+    ("Fitbit", "Steps", "steps"),
+    ("Fitbit", "SleepLevelDeep", "sleep"),
+    ("GoogleFit", "steps", "steps"),
+    ("GoogleFit", "SleepSegment", "sleep"),
+    ("HealthConnect", "Steps", "steps"),
+    ("HealthConnect", "sleep-session", "sleep"),
+    ("HealthConnect", "", None),
+])
+def test_point_kind(namespace, dp_type, kind):
+    assert PROVIDERS[namespace].get_point_kind({"type": dp_type}) == kind
+
+
+def test_api_versions():
+    assert "/api/v2/" in PROVIDERS["HealthConnect"].get_url("project", "https://api")
+    for namespace in ("AppleHealth", "Fitbit", "GoogleFit"):
+        assert "/api/v1/" in PROVIDERS[namespace].get_url("project", "https://api")
+
+
+def test_merge_takes_larger_count_per_source_and_fuller_sleep():
+    google_fit = ({"Phone": 1200, "Watch": 300}, [sleep(3600000)])
+    health_connect = ({"Phone": 1000, "Ring": 50}, [sleep(1800000), sleep(3600000)])
+
+    daily_steps, sleep_data = merge_device_summaries([google_fit, health_connect])
+
+    assert daily_steps == {"Phone": 1200, "Watch": 300, "Ring": 50}
+    assert sleep_data == health_connect[1]
+
+
+def test_merge_of_nothing():
+    assert merge_device_summaries([]) == ({}, [])
+    assert merge_device_summaries([({}, [])]) == ({}, [])
+
+
+@pytest.fixture
+def device_data(monkeypatch):
+    """Serves canned summaries by (namespace, pid) and records the fetches."""
+    data = {}
+    fetched = []
+
+    def summarize(provider, access_token, project_id, pid, base_url):
+        fetched.append((provider.namespace, pid))
+        summary = data.get((provider.namespace, pid), ({}, []))
+        if isinstance(summary, Exception):
+            raise summary
+        return summary
+
+    monkeypatch.setattr(jitai_logic, "summarize_device_data", summarize)
+    monkeypatch.setattr(jitai_logic, "DEVICE_DATA_FETCH_MODE", "participant")
+    monkeypatch.setattr(jitai_logic, "DEVICE_DATA_SYNC_MODE", "full")
+    return data, fetched
+
+
+def fetch_contexts(pids):
+    return jitai_logic.fetch_participant_contexts("token", {"Android": pids}, {}, max_workers=1)
+
+
+def test_fallback_reads_next_namespace_only_without_data(device_data, monkeypatch):
+    monkeypatch.setattr(jitai_logic, "DEVICE_NAMESPACE_MODE", "fallback")
+    data, fetched = device_data
+    data[("HealthConnect", "p1")] = ({"Phone": 1000}, [])
+    data[("GoogleFit", "p2")] = ({"Phone": 500}, [sleep(3600000)])
+
+    contexts = fetch_contexts(["p1", "p2", "p3"])
+
+    assert sorted(fetched) == [
+        ("GoogleFit", "p2"), ("GoogleFit", "p3"),
+        ("HealthConnect", "p1"), ("HealthConnect", "p2"), ("HealthConnect", "p3"),
+    ]
+    assert contexts["p1"]["total_steps"] == 1000
+    assert contexts["p2"]["total_steps"] == 500
+    assert contexts["p2"]["total_sleep_hours"] == 1
+    assert contexts["p3"]["needs_sync_reminder"]
+
+
+def test_failed_fallback_keeps_the_first_round(device_data, monkeypatch):
+    monkeypatch.setattr(jitai_logic, "DEVICE_NAMESPACE_MODE", "fallback")
+    data, fetched = device_data
+    data[("GoogleFit", "p1")] = RuntimeError("timeout")
+    data[("HealthConnect", "p2")] = RuntimeError("timeout")
+
+    contexts = fetch_contexts(["p1", "p2"])
+
+    assert contexts["p1"]["needs_sync_reminder"]
+    # A participant whose first namespace failed is still left out.
+    assert "p2" not in contexts
+
+    # Fetching one participant at a time gives the same context.
+    assert jitai_logic.get_participant_context("token", "Android", "p1", None) == contexts["p1"]
+
+
+def test_merge_reads_every_namespace(device_data, monkeypatch):
+    monkeypatch.setattr(jitai_logic, "DEVICE_NAMESPACE_MODE", "merge")
+    data, fetched = device_data
+    data[("HealthConnect", "p1")] = ({"Phone": 1000}, [])
+    data[("GoogleFit", "p1")] = ({"Phone": 1200, "Watch": 300}, [])
+
+    contexts = fetch_contexts(["p1"])
+
+    assert sorted(fetched) == [("GoogleFit", "p1"), ("HealthConnect", "p1")]
+    assert contexts["p1"]["total_steps"] == 1200
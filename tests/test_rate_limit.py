@@ -0,0 +1,271 @@
+import threading
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import requests
+
+import rate_limit
+from rate_limit import EndpointLimiter, RateLimitedSession, TokenBucket, get_endpoint, get_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        # Powers of two keep the bucket arithmetic exact.
+        self.now = 1024.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", fake.sleep)
+    return fake
+
+
+def make_response(status, headers=None, body=b"{}"):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+@pytest.fixture
+def send(monkeypatch):
+    """Replaces the underlying HTTP send with a script of responses/exceptions."""
+    calls = []
+    script = []
+
+    def fake_request(self, method, url, *args, **kwargs):
+        calls.append(method)
+        outcome = script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    monkeypatch.setattr(rate_limit, "get_backoff", lambda attempt: 0.0)
+    monkeypatch.setattr(rate_limit.time, "sleep", lambda seconds: None)
+    return script, calls
+
+
+URL = "https://example.org/api/v1/administration/projects/p1/notifications"
+
+
+def get_limiter(session):
+    return session.get_limiter(get_endpoint(URL))
+
+
+# TokenBucket
+
+def test_bucket_allows_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.sleeps == [0.5]
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=4, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 64
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [0.25]
+
+
+def test_bucket_without_rate_never_waits(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    for _ in range(100):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+
+# EndpointLimiter (AIMD)
+
+def test_throttle_halves_limit_and_successes_grow_it_back():
+    limiter = EndpointLimiter(rate=0, burst=1, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 2
+
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 3
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_limit_never_drops_below_one_or_exceeds_max():
+    limiter = EndpointLimiter(rate=0, burst=1, max_concurrency=2)
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(throttled=True)
+    assert limiter.limit == 1
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 2
+
+
+def test_failures_do_not_grow_the_limit_back():
+    limiter = EndpointLimiter(rate=0, burst=1, max_concurrency=8)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(failed=True)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_acquire_blocks_at_limit_until_release():
+    limiter = EndpointLimiter(rate=0, burst=1, max_concurrency=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def second():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1)
+    limiter.release()
+    thread.join(1)
+
+
+def test_retry_after_pauses_endpoint(clock):
+    limiter = EndpointLimiter(rate=0, burst=1, max_concurrency=4)
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=5)
+    assert limiter.paused_until == pytest.approx(clock.now + 5)
+
+
+# Retry-After parsing
+
+def test_retry_after_seconds():
+    assert get_retry_after(make_response(429, {"Retry-After": "7"})) == 7.0
+    assert get_retry_after(make_response(429, {"Retry-After": "-3"})) == 0.0
+
+
+def test_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    seconds = get_retry_after(make_response(429, {"Retry-After": format_datetime(when, usegmt=True)}))
+    assert 25 <= seconds <= 30
+
+
+def test_retry_after_missing_or_invalid():
+    assert get_retry_after(make_response(429)) is None
+    assert get_retry_after(make_response(429, {"Retry-After": "soon"})) is None
+
+
+# Retry rules
+
+def test_429_is_retried_for_post(send):
+    script, calls = send
+    script.extend([make_response(429), make_response(200)])
+    response = RateLimitedSession(rate=0).post(URL)
+    assert response.status_code == 200
+    assert calls == ["POST", "POST"]
+
+
+def test_5xx_is_not_retried_for_post(send):
+    script, calls = send
+    script.extend([make_response(502), make_response(200)])
+    response = RateLimitedSession(rate=0).post(URL)
+    assert response.status_code == 502
+    assert calls == ["POST"]
+
+
+def test_5xx_is_retried_for_get(send):
+    script, calls = send
+    script.extend([make_response(503), make_response(500), make_response(200)])
+    response = RateLimitedSession(rate=0).get(URL)
+    assert response.status_code == 200
+    assert calls == ["GET", "GET", "GET"]
+
+
+def test_connection_error_retried_only_when_idempotent(send):
+    script, calls = send
+    script.extend([requests.ConnectionError(), make_response(200)])
+    session = RateLimitedSession(rate=0)
+    assert session.get(URL).status_code == 200
+
+    script.append(requests.ConnectionError())
+    with pytest.raises(requests.ConnectionError):
+        session.post(URL)
+    assert calls == ["GET", "GET", "POST"]
+    assert get_limiter(session).in_flight == 0
+
+
+def test_retries_stop_at_max_retries(send):
+    script, calls = send
+    script.extend([make_response(429)] * 3)
+    response = RateLimitedSession(rate=0, max_retries=2).get(URL)
+    assert response.status_code == 429
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ChunkedEncodingError(),
+    requests.exceptions.ContentDecodingError(),
+    requests.exceptions.TooManyRedirects(),
+    requests.exceptions.InvalidURL(),
+    ValueError("unexpected"),
+])
+def test_any_exception_releases_slot(send, error):
+    script, calls = send
+    script.append(error)
+    session = RateLimitedSession(rate=0, max_concurrency=1)
+    with pytest.raises(type(error)):
+        session.get(URL)
+    limiter = get_limiter(session)
+    assert limiter.in_flight == 0
+
+    script.append(make_response(200))
+    assert session.get(URL).status_code == 200
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.parametrize("outcome", [requests.ConnectionError(), requests.Timeout(), 500])
+def test_failed_requests_do_not_grow_the_limit_back(send, outcome):
+    script, calls = send
+    session = RateLimitedSession(rate=0, max_concurrency=8, max_retries=0)
+    limiter = get_limiter(session)
+    limiter.limit = 4
+
+    for _ in range(20):
+        script.append(outcome if isinstance(outcome, Exception) else make_response(outcome))
+        try:
+            session.get(URL)
+        except requests.RequestException:
+            pass
+
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+import storage
+from s3_utils import LogBuffer, RunState, append_log_part, get_log_key, iter_log_entries, load_log
+from schedule_index import NOTIFIER_CURSOR_LOG
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def memory(monkeypatch):
+    memory = storage.MemoryStorage()
+    monkeypatch.setitem(storage._storages, BUCKET, memory)
+    return memory
+
+
+def write(memory, base_filename, data):
+    memory.put(get_log_key(base_filename), json.dumps(data).encode("utf-8"))
+
+
+def test_append_log_part_writes_one_jsonl_part(memory):
+    key = append_log_part(BUCKET, "logs/tracking_2025_01_01.json", [{"n": 1}, {"n": 2}])
+
+    assert key.startswith("logs/tracking_2025_01_01/part-") and key.endswith(".jsonl")
+    assert memory.objects[key].decode("utf-8").splitlines() == ['{"n": 1}', '{"n": 2}']
+    assert append_log_part(BUCKET, "logs/tracking_2025_01_01.json", []) is None
+    assert len(memory.objects) == 1
+
+
+def test_iter_log_entries_reads_legacy_object_then_parts_in_order(memory):
+    log_key = "logs/tracking_2025_01_01.json"
+    memory.put(log_key, json.dumps({"legacy": True}).encode("utf-8"))
+    for n in range(3):
+        append_log_part(BUCKET, log_key, [{"n": n}])
+
+    assert list(iter_log_entries(BUCKET, log_key)) == [{"legacy": True}, {"n": 0}, {"n": 1}, {"n": 2}]
+    assert list(iter_log_entries(BUCKET, "logs/other.json")) == []
+
+
+def test_log_buffer_writes_one_part_per_flush(memory):
+    buffer = LogBuffer(BUCKET, "logs/2025-01-01.json")
+    buffer.append({"n": 1})
+    buffer.append({"n": 2})
+
+    assert buffer.flush() is not None
+    assert buffer.flush() is None
+    assert list(iter_log_entries(BUCKET, "logs/2025-01-01.json")) == [{"n": 1}, {"n": 2}]
+
+
+def test_run_state_writes_each_changed_log_once(memory):
+    state = RunState(BUCKET)
+    state.set("sent_log.json", "p1_lunch", {"sent": True})
+    state.set("sent_log.json", "p2_lunch", {"sent": True})
+    state.get("scheduled_log.json")
+    state.save()
+
+    assert load_log(BUCKET, "sent_log.json") == {"p1_lunch": {"sent": True}, "p2_lunch": {"sent": True}}
+    assert len(memory.objects) == 1
+
+
+def test_competing_writers_keep_both_entries(memory):
+    write(memory, "sent_log.json", {"p0_breakfast": {"sent": True}})
+    first, second = RunState(BUCKET), RunState(BUCKET)
+    first.get("sent_log.json")
+    second.get("sent_log.json")
+
+    second.set("sent_log.json", "p2_lunch", {"sent": True})
+    second.save()
+    first.set("sent_log.json", "p1_lunch", {"sent": True})
+    first.save()
+
+    assert load_log(BUCKET, "sent_log.json") == {
+        "p0_breakfast": {"sent": True},
+        "p1_lunch": {"sent": True},
+        "p2_lunch": {"sent": True},
+    }
+    assert first.get("sent_log.json") == load_log(BUCKET, "sent_log.json")
+
+
+def test_removed_pending_key_does_not_come_back(memory):
+    write(memory, NOTIFIER_CURSOR_LOG, {"cursor": 100, "pending": {"p1_lunch": 90.0}})
+    first, second = RunState(BUCKET), RunState(BUCKET)
+    first_pending = dict(first.get(NOTIFIER_CURSOR_LOG)["pending"])
+    second_pending = dict(second.get(NOTIFIER_CURSOR_LOG)["pending"])
+
+    # The second run fails p2 and keeps p1 pending, as it loaded it.
+    second_pending["p2_lunch"] = 95.0
+    second.set(NOTIFIER_CURSOR_LOG, "cursor", 110)
+    second.set(NOTIFIER_CURSOR_LOG, "pending", second_pending)
+    second.save()
+    # The first run sent p1, so it drops the key, and loses the race.
+    del first_pending["p1_lunch"]
+    first.set(NOTIFIER_CURSOR_LOG, "cursor", 120)
+    first.set(NOTIFIER_CURSOR_LOG, "pending", first_pending)
+    first.save()
+
+    assert load_log(BUCKET, NOTIFIER_CURSOR_LOG) == {"cursor": 120, "pending": {"p2_lunch": 95.0}}
+
+
+def test_merge_is_retried_against_each_new_copy(memory, monkeypatch):
+    write(memory, NOTIFIER_CURSOR_LOG, {"pending": {"p1_lunch": 90.0, "p3_lunch": 97.0}})
+    state = RunState(BUCKET)
+    pending = dict(state.get(NOTIFIER_CURSOR_LOG)["pending"])
+    del pending["p1_lunch"]
+    state.set(NOTIFIER_CURSOR_LOG, "pending", pending)
+
+    # Another writer gets in before each of the first two attempts.
+    competing = [{"p1_lunch": 90.0, "p3_lunch": 97.0, "p2_lunch": 95.0}, {"p1_lunch": 90.0, "p4_lunch": 99.0}]
+    put = memory.put
+
+    def racing_put(key, body, if_match=None, if_none_match=False):
+        if competing:
+            put(key, json.dumps({"pending": competing.pop(0)}).encode("utf-8"))
+        return put(key, body, if_match=if_match, if_none_match=if_none_match)
+
+    monkeypatch.setattr(memory, "put", racing_put)
+    state.save()
+
+    # p3 was removed by the second writer, p1 by this run; neither comes back.
+    assert load_log(BUCKET, NOTIFIER_CURSOR_LOG) == {"pending": {"p4_lunch": 99.0}}
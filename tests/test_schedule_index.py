@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import storage
+from s3_utils import RunState, get_log_key
+from schedule_index import SCHEDULE_INDEX_LOG, get_due_keys, get_hour_bucket, get_schedule_index
+
+BUCKET = "test-bucket"
+LUNCH = datetime(2025, 1, 1, 12, 30, tzinfo=timezone.utc).timestamp()
+DINNER = datetime(2025, 1, 1, 18, 0, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def logs(monkeypatch):
+    memory = storage.MemoryStorage()
+    monkeypatch.setitem(storage._storages, BUCKET, memory)
+
+    def write(base_filename, data):
+        memory.put(get_log_key(base_filename), json.dumps(data).encode("utf-8"))
+
+    return write
+
+
+def scheduled(epoch):
+    return {"send_time": datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")}
+
+
+def test_entries_missing_from_the_index_are_merged_in(logs):
+    # The scheduler saved the dinner entry to scheduled_log but not to the index.
+    logs(SCHEDULE_INDEX_LOG, {get_hour_bucket(LUNCH): {"p1::lunch": LUNCH}})
+    scheduled_log = {"p1::lunch": scheduled(LUNCH), "p1::dinner": scheduled(DINNER)}
+    state = RunState(BUCKET)
+
+    index = get_schedule_index(state, scheduled_log)
+
+    assert get_due_keys(index, None, DINNER) == ["p1::lunch", "p1::dinner"]
+    # The merge is in memory only.
+    assert state.get(SCHEDULE_INDEX_LOG) == {get_hour_bucket(LUNCH): {"p1::lunch": LUNCH}}
+
+
+def test_log_without_an_index_is_indexed_in_memory(logs):
+    index = get_schedule_index(RunState(BUCKET), {"p1::lunch": scheduled(LUNCH), "p1::bad": {"send_time": "?"}})
+
+    assert index == {get_hour_bucket(LUNCH): {"p1::lunch": LUNCH}}
+
+
+def test_complete_index_is_returned_as_loaded(logs):
+    logs(SCHEDULE_INDEX_LOG, {get_hour_bucket(LUNCH): {"p1::lunch": LUNCH}})
+    state = RunState(BUCKET)
+
+    assert get_schedule_index(state, {"p1::lunch": scheduled(LUNCH)}) is state.get(SCHEDULE_INDEX_LOG)
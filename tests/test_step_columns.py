@@ -0,0 +1,103 @@
+import random
+from collections import defaultdict
+from datetime import date
+
+import pytest
+
+import step_columns
+from api_utils import safe_parse_iso
+from step_columns import StepColumns, aggregate_steps, get_day_ordinal
+
+DAY = date(2025, 1, 6)
+
+TIMESTAMPS = [
+    "2025-01-06T10:00:00Z",
+    "2025-01-06T00:00:00Z",
+    "2025-01-05T23:59:59Z",
+    "2025-01-07T00:00:00Z",
+    "2025-01-06T23:30:00-05:00",
+    "2025-01-06T01:30:00+14:00",
+    "2025-01-06T10:00:00.123456+02:00",
+    "2025-01-06T10:00:00+0200",
+    "2025-01-06",
+    "20250106T100000Z",
+    "2025-02-30T10:00:00Z",
+    "not a date",
+    "",
+]
+SOURCES = [
+    {"properties": {"SourceName": "Watch"}},
+    {"properties": {"SourceName": "Phone"}},
+    {"properties": {}},
+    {},
+]
+VALUES = ["12", 7, "12.7", 3.2, "abc", None, "-4"]
+
+
+def baseline_aggregate(data_points, today):
+    """The per-point loop providers used before step_columns."""
+    step_totals = defaultdict(int)
+    for dp in data_points:
+        if dp.get("type") != "Steps":
+            continue
+        try:
+            start_date = safe_parse_iso(dp["startDate"])
+            if not start_date:
+                continue
+        except Exception:
+            continue
+        if start_date.date() != today:
+            continue
+        try:
+            source_name = dp["source"]["properties"].get("SourceName", "Unknown Source")
+            step_value = int(float(dp["value"]))
+            step_totals[source_name] += step_value
+        except Exception:
+            pass
+    return dict(step_totals)
+
+
+def make_points(n, seed):
+    rng = random.Random(seed)
+    points = []
+    for _ in range(n):
+        dp = {"type": "Steps", "value": rng.choice(VALUES), "source": rng.choice(SOURCES)}
+        if rng.random() > 0.02:
+            dp["startDate"] = rng.choice(TIMESTAMPS)
+        points.append(dp)
+    return points
+
+
+@pytest.fixture(params=["numpy", "loop"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        monkeypatch.setattr(step_columns, "NUMPY_MIN_POINTS", 0)
+    else:
+        monkeypatch.setattr(step_columns, "NUMPY_MIN_POINTS", 10 ** 9)
+    return request.param
+
+
+@pytest.mark.parametrize("n, seed", [(1, 0), (50, 1), (1000, 2), (5000, 3)])
+def test_matches_baseline_aggregation(engine, n, seed):
+    points = make_points(n, seed)
+
+    assert aggregate_steps(points, DAY, safe_parse_iso) == baseline_aggregate(points, DAY)
+
+
+def test_fast_path_matches_parser():
+    for timestamp in TIMESTAMPS:
+        parsed = safe_parse_iso(timestamp)
+        expected = parsed.date().toordinal() if parsed else None
+        assert get_day_ordinal(timestamp, safe_parse_iso) == expected, timestamp
+
+
+def test_sum_into_adds_to_totals_and_empties_columns(engine):
+    columns = StepColumns(safe_parse_iso)
+    columns.extend(make_points(300, 4))
+    expected = aggregate_steps(make_points(300, 4), DAY, safe_parse_iso)
+    totals = {"Watch": 1000}
+
+    columns.sum_into(totals, DAY)
+
+    assert totals == {**expected, "Watch": expected.get("Watch", 0) + 1000}
+    assert columns.sum_by_source(DAY) == {}
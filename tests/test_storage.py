@@ -0,0 +1,171 @@
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+
+import storage
+from s3_utils import append_log_part, iter_log_entries
+
+BUCKET = "test-bucket"
+
+
+class FakeS3Client:
+    """Just enough of the boto3 S3 client for S3Storage, counting calls."""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append(("get", Key))
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        body = self.objects[Key]
+        etag = storage._etag(body)
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None):
+        self.calls.append(("put", Key))
+        current = self.objects.get(Key)
+        if (IfNoneMatch and current is not None) or (IfMatch and (current is None or storage._etag(current) != IfMatch)):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.objects[Key] = Body
+        return {"ETag": storage._etag(Body)}
+
+    def get_paginator(self, name):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                client.calls.append(("list", Prefix))
+                yield {"Contents": [{"Key": key} for key in client.objects if key.startswith(Prefix)]}
+
+        return Paginator()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3Client()
+    monkeypatch.setitem(storage._storages, BUCKET, storage.S3Storage(BUCKET, client=client))
+    return client
+
+
+@pytest.fixture(params=["memory", "local", "s3"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return storage.MemoryStorage()
+    if request.param == "local":
+        return storage.LocalStorage(str(tmp_path))
+    return storage.S3Storage(BUCKET, client=FakeS3Client())
+
+
+def test_get_put_round_trip(backend):
+    assert backend.get("logs/a.json") == (None, None)
+
+    etag = backend.put("logs/a.json", b'{"a": 1}')
+
+    assert backend.get("logs/a.json") == (b'{"a": 1}', etag)
+    assert list(backend.iter_lines("logs/a.json")) == [b'{"a": 1}']
+    assert list(backend.iter_lines("logs/missing.json")) == []
+
+
+def test_conditional_puts(backend):
+    etag = backend.put("log.json", b"1", if_none_match=True)
+    with pytest.raises(storage.PreconditionFailed):
+        backend.put("log.json", b"2", if_none_match=True)
+
+    new_etag = backend.put("log.json", b"2", if_match=etag)
+    with pytest.raises(storage.PreconditionFailed):
+        backend.put("log.json", b"3", if_match=etag)
+
+    assert backend.get("log.json") == (b"2", new_etag)
+
+
+def test_list_keys(backend):
+    for key in ["logs/b/part-2.jsonl", "logs/b/part-1.jsonl", "logs/bb.json", "other/b.json"]:
+        backend.put(key, b"{}")
+
+    assert backend.list_keys("logs/b/") == ["logs/b/part-1.jsonl", "logs/b/part-2.jsonl"]
+    assert backend.list_keys("logs/b") == ["logs/b/part-1.jsonl", "logs/b/part-2.jsonl", "logs/bb.json"]
+    assert backend.list_keys("missing/") == []
+
+
+def test_s3_cache_revalidates_with_etag(s3):
+    s3_storage = storage.get_storage(BUCKET)
+    s3_storage.put("log.json", b"{}")
+    s3.calls.clear()
+
+    assert s3_storage.get("log.json")[0] == b"{}"
+    s3.objects["log.json"] = b'{"changed": true}'
+    assert s3_storage.get("log.json")[0] == b'{"changed": true}'
+    assert s3.calls == [("get", "log.json"), ("get", "log.json")]
+
+
+def test_log_parts_are_read_from_cache(s3):
+    log_key = "logs/tracking_2025_01_01.json"
+    parts = [append_log_part(BUCKET, log_key, [{"n": n}]) for n in range(3)]
+    s3.calls.clear()
+
+    assert list(iter_log_entries(BUCKET, log_key)) == [{"n": 0}, {"n": 1}, {"n": 2}]
+    # One list, and one GET for the (missing) legacy object; parts written
+    # through this storage are already cached.
+    assert s3.calls == [("list", "logs/tracking_2025_01_01/"), ("get", log_key)]
+
+    storage.get_storage(BUCKET).cache.pop(parts[1])
+    s3.calls.clear()
+    assert list(iter_log_entries(BUCKET, log_key)) == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert s3.calls == [("list", "logs/tracking_2025_01_01/"), ("get", log_key), ("get", parts[1])]
+
+    s3.calls.clear()
+    list(iter_log_entries(BUCKET, log_key))
+    assert ("get", parts[1]) not in s3.calls
+
+
+def test_mutable_objects_are_revalidated(s3):
+    s3_storage = storage.get_storage(BUCKET)
+    s3_storage.put("log.json", b"{}")
+    s3.objects["log.json"] = b'{"changed": true}'
+
+    assert s3_storage.get("log.json")[0] == b'{"changed": true}'
+    assert s3_storage.get("log.json", immutable=True)[0] == b'{"changed": true}'
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        storage.create_storage(BUCKET, backend="ftp")
+
+
+def test_local_list_keys_walks_only_the_prefix(tmp_path, monkeypatch):
+    local = storage.LocalStorage(str(tmp_path))
+    for key in ["logs/a/part-1.jsonl", "logs/a/part-2.jsonl", "logs/ab/part-1.jsonl", "logs/b/part-1.jsonl",
+                "logs/a.json", "other/a/part-1.jsonl", "top.json"]:
+        local.put(key, b"{}")
+    walked = []
+    walk = storage.os.walk
+
+    def recording_walk(top):
+        for dirpath, dirnames, filenames in walk(top):
+            walked.append(dirpath)
+            yield dirpath, dirnames, filenames
+
+    monkeypatch.setattr(storage.os, "walk", recording_walk)
+
+    assert local.list_keys("logs/a/") == ["logs/a/part-1.jsonl", "logs/a/part-2.jsonl"]
+    assert walked == [str(tmp_path / "logs" / "a")]
+    assert local.list_keys("logs/a") == [
+        "logs/a.json", "logs/a/part-1.jsonl", "logs/a/part-2.jsonl", "logs/ab/part-1.jsonl"
+    ]
+    assert local.list_keys("t") == ["top.json"]
+    assert local.list_keys("missing/") == []
+    assert len(local.list_keys("")) == 7
+
+
+def test_backend_must_implement_the_storage_methods():
+    class GetOnlyStorage(storage.LogStorage):
+        def get(self, key, immutable=False):
+            return None, None
+
+    with pytest.raises(TypeError):
+        GetOnlyStorage()